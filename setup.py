@@ -21,7 +21,7 @@ setup(
         "matchms",
         "scikit-learn",
         "tqdm",
-        "hdbscan",
+        "hdbscan>=0.8.33,<0.9",
     ],
     entry_points={
         "console_scripts": [
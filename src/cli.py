@@ -12,6 +12,9 @@ Commandes disponibles :
   hac_smiles         Pipeline de clustering HAC pour SMILES.
   hdbscan_spectra    Pipeline de clustering HDBSCAN pour spectres (fichier MGF).
   hdbscan_smiles     Pipeline de clustering HDBSCAN pour SMILES.
+  butina_smiles      Pipeline de clustering de Butina (sphere exclusion) pour SMILES, sans matrice dense.
+  matrix_spectra     Calcule la matrice de distances d'un fichier MGF binned (éventuellement un seul shard).
+  merge_matrix       Assemble les shards d'une matrice de distances en matrice complète (CSV).
   compare_clusters   Compare deux fichiers JSON de clustering et sauvegarde l'image de la comparaison.
   compare_scores     Compare deux fichiers JSON de clustering et affiche les scores ARI et NMI.
   
@@ -20,11 +23,27 @@ Commandes disponibles :
 Exemples :
   python cli.py process --mgf_file data/ALL_GNPS_cleaned.mgf --output_dir data/adducts --stats file --log-level INFO
   python cli.py kmeans_spectra --mgf_file data/adducts/spectra/[M-3H2O+H]1+.mgf --bin_size 5 --k_min 2 --k_max 10 --algorithm mini --n_init 10 --random_state 42 --mz_min 20 --mz_max 2000 --n_jobs -1 --log-level INFO
+  python cli.py kmeans_spectra --mgf_file data/adducts/spectra/[M-3H2O+H]1+.mgf --bin_size 0.01 --k_min 2 --k_max 10 --reduction svd --n_components 256 --log-level INFO
   python cli.py kmeans_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --fp_size 2048 --k_min 2 --k_max 10 --algorithm mini --n_init 10 --random_state 42 --n_jobs -1 --log-level INFO
+  python cli.py kmeans_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --k_min 2 --k_max 10 --algorithm modes --n_init 3 --log-level INFO
   python cli.py hac_spectra --mgf_file data/adducts/spectra/[M-3H2O+H]1+.mgf --bin_size 5 --n_clusters 4 --mz_min 20 --mz_max 2000 --tol 0.1 --dist_method cosine_greedy --num_workers -1 --log-level INFO
+  python cli.py hac_spectra --mgf_file data/adducts/spectra/[M-3H2O+H]1+.mgf --bin_size 5 --n_clusters 4 --dist_method cosinus --precursor_tol 20 --precursor_unit ppm --log-level INFO
+  python cli.py hdbscan_spectra --mgf_file data/adducts/spectra/[M-3H2O+H]1+.mgf --bin_size 1 --n_clusters 4 --min_samples 2 --dist_method simple --lsh --lsh_num_perm 128 --lsh_bands 32 --lsh_recall_sample 50 --log-level INFO
+  python cli.py matrix_spectra --binned_file output/tmp/binned_adducts_1.0/[M-3H2O+H]1+.mgf --dist_method cosinus --shard 0/4 --num_workers 8 --log-level INFO
+  python cli.py merge_matrix --shard_files output/tmp/matrix_shards/[M-3H2O+H]1+/[M-3H2O+H]1+_cosinus_shard*of4.npz --log-level INFO
   python cli.py hac_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --fp_size 2048 --n_clusters 4 --sim_type cosinus --log-level INFO
+  python cli.py hac_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --n_clusters 4 --hac_engine nn_chain --condensed_dtype float32 --condensed_memmap output/tmp/condensed.dat --log-level INFO
+  python cli.py hac_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --n_clusters 2-30 --auto_k --log-level INFO
+  python cli.py hac_spectra --mgf_file data/adducts/spectra/[M-3H2O+H]1+.mgf --bin_size 5 --n_clusters 5,10,20,40 --log-level INFO
   python cli.py hdbscan_spectra --mgf_file data/adducts/spectra/[M-3H2O+H]1+.mgf --bin_size 5 --n_clusters 4 --min_samples 2 --mz_min 20 --mz_max 2000 --tol 0.1 --dist_method cosine_greedy --num_workers -1 --log-level INFO
+  python cli.py hdbscan_spectra --mgf_file data/adducts/spectra/[M-3H2O+H]1+.mgf --bin_size 1 --n_clusters 4 --min_samples 2 --dist_method cosinus --feature_space --log-level INFO
+  python cli.py hdbscan_spectra --mgf_file data/adducts/spectra/[M-3H2O+H]1+.mgf --bin_size 1 --n_clusters 4 --min_samples 2 --dist_method cosinus --knn 15 --mutual_knn --log-level INFO
   python cli.py hdbscan_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --fp_size 2048 --n_clusters 4 --min_samples 1 --sim_type cosinus --log-level INFO
+  python cli.py hdbscan_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --n_clusters 4 --min_samples 2 --knn 15 --log-level INFO
+  python cli.py hdbscan_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --n_clusters 2-20 --min_samples 1,2,5 --log-level INFO
+  python cli.py hac_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --n_clusters 4 --sim_type cls --log-level INFO
+  python cli.py hdbscan_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --n_clusters 4 --blocking scaffold --link_cutoff 0.6 --blocking_ari --log-level INFO
+  python cli.py butina_smiles --smiles_file data/adducts/smiles/[M-3H2O+H]1+.smiles --fp_size 2048 --cutoff 0.65 --n_jobs -1 --log-level INFO
   python cli.py compare_clusters --cluster_file1 output\clustering_results\hac\smiles\[M-3H2O+H]1+_fp2048\[M-3H2O+H]1+_hac_18_4a92a3a1.json  --cluster_file2 .\output\clustering_results\hac\spectra\[M-3H2O+H]1+_Bin5.0\[M-3H2O+H]1+_hac_18_5485cd75.json --log-level INFO
   python cli.py compare_scores --cluster_file1 output\clustering_results\hac\smiles\[M-3H2O+H]1+_fp2048\[M-3H2O+H]1+_hac_18_4a92a3a1.json  --cluster_file2 .\output\clustering_results\hac\spectra\[M-3H2O+H]1+_Bin5.0\[M-3H2O+H]1+_hac_18_5485cd75.json
 """
@@ -32,12 +51,14 @@ Exemples :
 import argparse
 import logging
 import config
+from spectra.similarity.registry import available_metrics
 from processing import mgf_processor
 from spectra.clustering_pipeline import kmeans as spectra_kmeans
 from spectra.clustering_pipeline import hac as spectra_hac
 from smiles.clustering_pipeline import kmeans as smiles_kmeans
 from smiles.clustering_pipeline import hac as smiles_hac
 from smiles.clustering_pipeline import hdbscan as smiles_hdbscan
+from smiles.clustering_pipeline import butina as smiles_butina
 from cluster_comparison import compare as comp
 from cluster_comparison import scores as comp_scores
 
@@ -92,6 +113,13 @@ def main():
                                     help="Valeur maximale de m/z (défaut: 2000)")
     parser_kmeans_spec.add_argument("--n_jobs", type=int, default=-1,
                                     help="Nombre de jobs parallèles (défaut: -1)")
+    parser_kmeans_spec.add_argument("--reduction", type=str, choices=["random_projection", "svd"], default=None,
+                                    help="Réduction de dimension avant le clustering (défaut: aucune)")
+    parser_kmeans_spec.add_argument("--n_components", type=int, default=256,
+                                    help="Dimension de sortie de la réduction (défaut: 256)")
+    parser_kmeans_spec.add_argument("--measure_speedup", action="store_true",
+                                    help="Avec --reduction, relance la sélection de k et kmeans sans réduction "
+                                         "pour mesurer le gain de temps (double le temps d'exécution)")
     
     # Commande 'kmeans_smiles'
     parser_kmeans_smiles = subparsers.add_parser("kmeans_smiles",
@@ -101,12 +129,16 @@ def main():
                                       help="Fichier texte contenant des SMILES (un par ligne).")
     parser_kmeans_smiles.add_argument("--fp_size", type=int, default=2048,
                                       help="Taille du fingerprint Morgan (défaut: 2048)")
+    parser_kmeans_smiles.add_argument("--fp_store_dir", type=str, default=config.DEFAULT_FINGERPRINT_STORE_DIR,
+                                      help=f"Store persistant des fingerprints (défaut: {config.DEFAULT_FINGERPRINT_STORE_DIR})")
+    parser_kmeans_smiles.add_argument("--no_fp_store", action="store_true",
+                                      help="Recalcule tous les fingerprints sans utiliser le store")
     parser_kmeans_smiles.add_argument("--k_min", type=int, required=True,
                                       help="Nombre minimal de clusters à tester.")
     parser_kmeans_smiles.add_argument("--k_max", type=int, required=True,
                                       help="Nombre maximal de clusters à tester.")
-    parser_kmeans_smiles.add_argument("--algorithm", type=str, choices=["mini", "kmeans"], default="mini",
-                                      help="Algorithme à utiliser (défaut: mini)")
+    parser_kmeans_smiles.add_argument("--algorithm", type=str, choices=["mini", "kmeans", "modes", "medoids"], default="mini",
+                                      help="Algorithme à utiliser ; modes / medoids : k-modes ou k-médoïdes en distance de Tanimoto sur les fingerprints compactés (défaut: mini)")
     parser_kmeans_smiles.add_argument("--n_init", type=int, default=10,
                                       help="Nombre d'initialisations (défaut: 10)")
     parser_kmeans_smiles.add_argument("--random_state", type=int, default=42,
@@ -122,8 +154,14 @@ def main():
                                  help="Fichier MGF de spectres à traiter.")
     parser_hac_spec.add_argument("--bin_size", type=float, required=True,
                                  help="Taille du bin pour le binning.")
-    parser_hac_spec.add_argument("--n_clusters", type=int, required=True,
-                                 help="Nombre de clusters à former avec HAC.")
+    parser_hac_spec.add_argument("--n_clusters", type=str, required=True,
+                                 help="Nombre(s) de clusters à former avec HAC : entier, liste ou plage (ex: 4, 2,4,8, 2-20, 10-100:10).")
+    parser_hac_spec.add_argument("--auto_k", action="store_true",
+                                 help="Note chaque coupe de --n_clusters (silhouette) et ne garde que la meilleure")
+    parser_hac_spec.add_argument("--linkage_cache_dir", type=str, default=config.DEFAULT_LINKAGE_CACHE_DIR,
+                                 help=f"Cache des arbres HAC (défaut: {config.DEFAULT_LINKAGE_CACHE_DIR})")
+    parser_hac_spec.add_argument("--no_linkage_cache", action="store_true",
+                                 help="Reconstruit l'arbre HAC sans utiliser le cache")
     parser_hac_spec.add_argument("--mz_min", type=float, default=20,
                                  help="Valeur minimale de m/z (défaut: 20)")
     parser_hac_spec.add_argument("--mz_max", type=float, default=2000,
@@ -133,9 +171,25 @@ def main():
     parser_hac_spec.add_argument("--num_workers", type=int, default=-1,
                                  help="Nombre de workers pour le calcul parallèle (défaut: -1)")
     parser_hac_spec.add_argument("--dist_method", type=str,
-                                 choices=["cosinus", "manhattan", "simple", "cosine_greedy"],
+                                 choices=available_metrics(),
                                  default="cosinus",
                                  help="Méthode de calcul de distance pour les spectres (défaut: cosinus)")
+    parser_hac_spec.add_argument("--precursor_tol", type=float, default=None,
+                                 help="Fenêtre de masse précurseur pour le blocking ; seules les paires dans la fenêtre sont calculées (défaut: désactivé)")
+    parser_hac_spec.add_argument("--precursor_unit", type=str, choices=["da", "ppm"], default="da",
+                                 help="Unité de la fenêtre de masse précurseur (défaut: da)")
+    parser_hac_spec.add_argument("--dist_cutoff", type=float, default=None,
+                                 help="Distance maximale conservée : active le calcul seuillé et creux (méthodes cosinus et cosine_greedy, ou simple avec --lsh, défaut: désactivé)")
+    parser_hac_spec.add_argument("--min_matched_peaks", type=int, default=None,
+                                 help="Nombre minimal de pics appariés pour conserver une paire (cosine_greedy, matrice creuse, défaut: désactivé)")
+    parser_hac_spec.add_argument("--lsh", action="store_true",
+                                 help="Ne calcule que les paires candidates MinHash/LSH (méthode simple uniquement)")
+    parser_hac_spec.add_argument("--lsh_num_perm", type=int, default=128,
+                                 help="Longueur des signatures MinHash (défaut: 128)")
+    parser_hac_spec.add_argument("--lsh_bands", type=int, default=32,
+                                 help="Nombre de bandes LSH ; plus de bandes augmente le rappel et le nombre de candidats (défaut: 32)")
+    parser_hac_spec.add_argument("--lsh_recall_sample", type=int, default=0,
+                                 help="Nombre de spectres échantillonnés pour mesurer le rappel LSH (défaut: 0, pas de mesure)")
     
     # Commande 'hac_smiles'
     parser_hac_smiles = subparsers.add_parser("hac_smiles",
@@ -145,12 +199,36 @@ def main():
                                    help="Fichier texte contenant des SMILES (un par ligne).")
     parser_hac_smiles.add_argument("--fp_size", type=int, default=2048,
                                    help="Taille du fingerprint Morgan (défaut: 2048)")
-    parser_hac_smiles.add_argument("--n_clusters", type=int, required=True,
-                                   help="Nombre de clusters à former avec HAC.")
+    parser_hac_smiles.add_argument("--fp_store_dir", type=str, default=config.DEFAULT_FINGERPRINT_STORE_DIR,
+                                   help=f"Store persistant des fingerprints (défaut: {config.DEFAULT_FINGERPRINT_STORE_DIR})")
+    parser_hac_smiles.add_argument("--no_fp_store", action="store_true",
+                                   help="Recalcule tous les fingerprints sans utiliser le store")
+    parser_hac_smiles.add_argument("--n_clusters", type=str, required=True,
+                                   help="Nombre(s) de clusters à former avec HAC : entier, liste ou plage (ex: 4, 2,4,8, 2-20, 10-100:10).")
+    parser_hac_smiles.add_argument("--auto_k", action="store_true",
+                                   help="Note chaque coupe de --n_clusters (silhouette) et ne garde que la meilleure")
+    parser_hac_smiles.add_argument("--linkage_cache_dir", type=str, default=config.DEFAULT_LINKAGE_CACHE_DIR,
+                                   help=f"Cache des arbres HAC (défaut: {config.DEFAULT_LINKAGE_CACHE_DIR})")
+    parser_hac_smiles.add_argument("--no_linkage_cache", action="store_true",
+                                   help="Reconstruit l'arbre HAC sans utiliser le cache")
     parser_hac_smiles.add_argument("--sim_type", type=str,
-                                   choices=["cosinus", "jaccard"],
+                                   choices=["cosinus", "jaccard", "cls", "lingo"],
                                    default="jaccard",
-                                   help="Type de similarité pour SMILES (défaut: jaccard)")
+                                   help="Type de similarité pour SMILES ; cls : plus longue sous-séquence commune des SMILES ; lingo : Tanimoto des trigrammes des SMILES (défaut: jaccard)")
+    parser_hac_smiles.add_argument("--blocking", type=str, choices=["scaffold", "generic"], default=None,
+                                   help="Ne calcule les similarités qu'entre molécules de même squelette de Bemis-Murcko (generic : squelette générique)")
+    parser_hac_smiles.add_argument("--link_cutoff", type=float, default=0.5,
+                                   help="Similarité des fingerprints résumés de deux blocs au-delà de laquelle ils sont comparés (défaut: 0.5)")
+    parser_hac_smiles.add_argument("--hac_engine", type=str, choices=["sklearn", "nn_chain"], default="sklearn",
+                                   help="Moteur HAC ; nn_chain : chaîne des plus proches voisins sur une matrice condensée, mêmes labels, mémoire réduite (défaut: sklearn)")
+    parser_hac_smiles.add_argument("--condensed_dtype", type=str, choices=["float64", "float32"], default="float64",
+                                   help="Type de la matrice condensée de nn_chain (défaut: float64)")
+    parser_hac_smiles.add_argument("--condensed_memmap", type=str, default=None,
+                                   help="Fichier où projeter la matrice condensée de nn_chain (défaut: en mémoire)")
+    parser_hac_smiles.add_argument("--blocking_ari", action="store_true",
+                                   help="Calcule aussi le clustering sans blocage et enregistre l'ARI entre les deux")
+    parser_hac_smiles.add_argument("--measure_speedup", action="store_true",
+                                   help="Avec --sim_type lingo, mesure le gain de temps face à la matrice Morgan/Tanimoto et l'enregistre dans les résultats")
     
     # Commande 'hdbscan_spectra'
     parser_hdbscan_spec = subparsers.add_parser("hdbscan_spectra",
@@ -160,10 +238,10 @@ def main():
                                      help="Fichier MGF de spectres à traiter.")
     parser_hdbscan_spec.add_argument("--bin_size", type=float, required=True,
                                      help="Taille du bin pour le binning.")
-    parser_hdbscan_spec.add_argument("--n_clusters", type=int, required=True,
-                                     help="Nombre de clusters à former (utilisé comme min_cluster_size).")
-    parser_hdbscan_spec.add_argument("--min_samples", type=int, required=True,
-                                     help="Nombre minimum d'échantillons pour HDBSCAN.")
+    parser_hdbscan_spec.add_argument("--n_clusters", type=str, required=True,
+                                     help="Nombre de clusters à former (utilisé comme min_cluster_size) ; liste ou plage pour un balayage (ex: 4, 5,10,20, 2-30:2).")
+    parser_hdbscan_spec.add_argument("--min_samples", type=str, required=True,
+                                     help="Nombre minimum d'échantillons pour HDBSCAN ; liste ou plage pour un balayage (un arbre couvrant par valeur).")
     parser_hdbscan_spec.add_argument("--mz_min", type=float, default=20,
                                      help="Valeur minimale de m/z (défaut: 20)")
     parser_hdbscan_spec.add_argument("--mz_max", type=float, default=2000,
@@ -173,9 +251,31 @@ def main():
     parser_hdbscan_spec.add_argument("--num_workers", type=int, default=-1,
                                      help="Nombre de workers pour le calcul parallèle (défaut: -1)")
     parser_hdbscan_spec.add_argument("--dist_method", type=str,
-                                     choices=["cosinus", "manhattan", "simple", "cosine_greedy"],
+                                     choices=available_metrics(),
                                      default="cosinus",
                                      help="Méthode de calcul de distance pour les spectres (défaut: cosinus)")
+    parser_hdbscan_spec.add_argument("--precursor_tol", type=float, default=None,
+                                     help="Fenêtre de masse précurseur pour le blocking ; seules les paires dans la fenêtre sont calculées (défaut: désactivé)")
+    parser_hdbscan_spec.add_argument("--precursor_unit", type=str, choices=["da", "ppm"], default="da",
+                                     help="Unité de la fenêtre de masse précurseur (défaut: da)")
+    parser_hdbscan_spec.add_argument("--dist_cutoff", type=float, default=None,
+                                     help="Distance maximale conservée : active le calcul seuillé et creux (méthodes cosinus et cosine_greedy, ou simple avec --lsh, défaut: désactivé)")
+    parser_hdbscan_spec.add_argument("--min_matched_peaks", type=int, default=None,
+                                     help="Nombre minimal de pics appariés pour conserver une paire (cosine_greedy, matrice creuse, défaut: désactivé)")
+    parser_hdbscan_spec.add_argument("--lsh", action="store_true",
+                                     help="Ne calcule que les paires candidates MinHash/LSH (méthode simple uniquement)")
+    parser_hdbscan_spec.add_argument("--lsh_num_perm", type=int, default=128,
+                                     help="Longueur des signatures MinHash (défaut: 128)")
+    parser_hdbscan_spec.add_argument("--lsh_bands", type=int, default=32,
+                                     help="Nombre de bandes LSH ; plus de bandes augmente le rappel et le nombre de candidats (défaut: 32)")
+    parser_hdbscan_spec.add_argument("--lsh_recall_sample", type=int, default=0,
+                                     help="Nombre de spectres échantillonnés pour mesurer le rappel LSH (défaut: 0, pas de mesure)")
+    parser_hdbscan_spec.add_argument("--feature_space", action="store_true",
+                                     help="HDBSCAN sur les vecteurs binned (arbre couvrant de Prim ligne par ligne), sans matrice de distances (cosinus ou manhattan)")
+    parser_hdbscan_spec.add_argument("--knn", type=int, default=0,
+                                     help="HDBSCAN sur le graphe creux des k plus proches voisins, sans matrice de distances (cosinus, défaut: 0, désactivé)")
+    parser_hdbscan_spec.add_argument("--mutual_knn", action="store_true",
+                                     help="Ne garde que les voisins mutuels dans le graphe --knn")
     
     # Commande 'hdbscan_smiles'
     parser_hdbscan_smiles = subparsers.add_parser("hdbscan_smiles",
@@ -185,15 +285,86 @@ def main():
                                       help="Fichier texte contenant des SMILES (un par ligne).")
     parser_hdbscan_smiles.add_argument("--fp_size", type=int, default=2048,
                                       help="Taille du fingerprint Morgan (défaut: 2048)")
-    parser_hdbscan_smiles.add_argument("--n_clusters", type=int, required=True,
-                                      help="Nombre de clusters à former (utilisé comme min_cluster_size).")
-    parser_hdbscan_smiles.add_argument("--min_samples", type=int, default=1,
-                                      help="Nombre minimum d'échantillons pour HDBSCAN (défaut: 1)")
+    parser_hdbscan_smiles.add_argument("--fp_store_dir", type=str, default=config.DEFAULT_FINGERPRINT_STORE_DIR,
+                                       help=f"Store persistant des fingerprints (défaut: {config.DEFAULT_FINGERPRINT_STORE_DIR})")
+    parser_hdbscan_smiles.add_argument("--no_fp_store", action="store_true",
+                                       help="Recalcule tous les fingerprints sans utiliser le store")
+    parser_hdbscan_smiles.add_argument("--n_clusters", type=str, required=True,
+                                      help="Nombre de clusters à former (utilisé comme min_cluster_size) ; liste ou plage pour un balayage (ex: 4, 5,10,20, 2-30:2).")
+    parser_hdbscan_smiles.add_argument("--min_samples", type=str, default="1",
+                                      help="Nombre minimum d'échantillons pour HDBSCAN ; liste ou plage pour un balayage (défaut: 1)")
     parser_hdbscan_smiles.add_argument("--sim_type", type=str,
-                                      choices=["cosinus", "jaccard"],
+                                      choices=["cosinus", "jaccard", "cls", "lingo"],
                                       default="jaccard",
+                                      help="Type de similarité pour SMILES ; cls : plus longue sous-séquence commune des SMILES ; lingo : Tanimoto des trigrammes des SMILES (défaut: jaccard)")
+    parser_hdbscan_smiles.add_argument("--knn", type=int, default=0,
+                                      help="Graphe creux des k plus proches voisins au lieu de la matrice dense (défaut: 0, matrice dense)")
+    parser_hdbscan_smiles.add_argument("--blocking", type=str, choices=["scaffold", "generic"], default=None,
+                                      help="Ne calcule les similarités qu'entre molécules de même squelette de Bemis-Murcko (generic : squelette générique)")
+    parser_hdbscan_smiles.add_argument("--link_cutoff", type=float, default=0.5,
+                                      help="Similarité des fingerprints résumés de deux blocs au-delà de laquelle ils sont comparés (défaut: 0.5)")
+    parser_hdbscan_smiles.add_argument("--blocking_ari", action="store_true",
+                                      help="Calcule aussi le clustering sans blocage et enregistre l'ARI entre les deux")
+    parser_hdbscan_smiles.add_argument("--measure_speedup", action="store_true",
+                                      help="Avec --sim_type lingo, mesure le gain de temps face à la matrice Morgan/Tanimoto et l'enregistre dans les résultats")
+    
+    # Commande 'butina_smiles'
+    parser_butina_smiles = subparsers.add_parser("butina_smiles",
+                                                 help="Pipeline de clustering de Butina pour SMILES",
+                                                 parents=[parent_parser])
+    parser_butina_smiles.add_argument("--smiles_file", type=str, required=True,
+                                      help="Fichier texte contenant des SMILES (un par ligne).")
+    parser_butina_smiles.add_argument("--fp_size", type=int, default=2048,
+                                      help="Taille du fingerprint Morgan (défaut: 2048)")
+    parser_butina_smiles.add_argument("--fp_store_dir", type=str, default=config.DEFAULT_FINGERPRINT_STORE_DIR,
+                                      help=f"Store persistant des fingerprints (défaut: {config.DEFAULT_FINGERPRINT_STORE_DIR})")
+    parser_butina_smiles.add_argument("--no_fp_store", action="store_true",
+                                      help="Recalcule tous les fingerprints sans utiliser le store")
+    parser_butina_smiles.add_argument("--cutoff", type=float, default=0.65,
+                                      help="Similarité minimale entre deux voisins (défaut: 0.65)")
+    parser_butina_smiles.add_argument("--sim_type", type=str, choices=["cosinus", "jaccard"], default="jaccard",
                                       help="Type de similarité pour SMILES (défaut: jaccard)")
+    parser_butina_smiles.add_argument("--block_size", type=int, default=512,
+                                      help="Nombre de molécules par bloc pour la recherche des voisins (défaut: 512)")
+    parser_butina_smiles.add_argument("--fold_segments", type=int, default=0,
+                                      help="Segments du fingerprint replié pour élaguer davantage de paires (défaut: 0, désactivé)")
+    parser_butina_smiles.add_argument("--n_jobs", type=int, default=-1,
+                                      help="Nombre de jobs parallèles (défaut: -1)")
     
+    # Commande 'matrix_spectra'
+    parser_matrix_spec = subparsers.add_parser("matrix_spectra",
+                                               help="Calcul de la matrice de distances d'un fichier MGF binned (complète ou par shard)",
+                                               parents=[parent_parser])
+    parser_matrix_spec.add_argument("--binned_file", type=str, required=True,
+                                    help="Fichier MGF binned (partagé par tous les shards).")
+    parser_matrix_spec.add_argument("--dist_method", type=str,
+                                    choices=available_metrics(),
+                                    default="cosinus",
+                                    help="Méthode de calcul de distance pour les spectres (défaut: cosinus)")
+    parser_matrix_spec.add_argument("--tol", type=float, default=0.1,
+                                    help="Tolérance pour le calcul de la matrice de distance (défaut: 0.1)")
+    parser_matrix_spec.add_argument("--num_workers", type=int, default=-1,
+                                    help="Nombre de workers pour le calcul parallèle (défaut: -1)")
+    parser_matrix_spec.add_argument("--precursor_tol", type=float, default=None,
+                                    help="Fenêtre de masse précurseur pour le blocking (défaut: désactivé)")
+    parser_matrix_spec.add_argument("--precursor_unit", type=str, choices=["da", "ppm"], default="da",
+                                    help="Unité de la fenêtre de masse précurseur (défaut: da)")
+    parser_matrix_spec.add_argument("--block_size", type=int, default=256,
+                                    help="Nombre de spectres par bloc (défaut: 256)")
+    parser_matrix_spec.add_argument("--shard", type=str, default=None,
+                                    help="Shard à calculer, sous la forme i/N (0 <= i < N) ; sans cette option, la matrice complète est calculée")
+    parser_matrix_spec.add_argument("--output_dir", type=str, default="output/tmp/matrix_shards",
+                                    help="Répertoire de sortie (défaut: output/tmp/matrix_shards)")
+
+    # Commande 'merge_matrix'
+    parser_merge_matrix = subparsers.add_parser("merge_matrix",
+                                                help="Assemble les shards d'une matrice de distances",
+                                                parents=[parent_parser])
+    parser_merge_matrix.add_argument("--shard_files", type=str, nargs="+", required=True,
+                                     help="Fichiers .npz des shards (tous les shards i/N du même calcul).")
+    parser_merge_matrix.add_argument("--output_dir", type=str, default="output/tmp/matrix_shards",
+                                     help="Répertoire de sortie de la matrice CSV (défaut: output/tmp/matrix_shards)")
+
     # commande 'compare_clusters'
     parser_compare = subparsers.add_parser("compare_clusters",
                                             help="Compare deux fichiers JSON de clustering et sauvegarde une image des centroids",
@@ -234,7 +405,10 @@ def main():
             algorithm=args.algorithm,
             mz_min=args.mz_min,
             mz_max=args.mz_max,
-            n_jobs=args.n_jobs
+            n_jobs=args.n_jobs,
+            reduction=args.reduction,
+            n_components=args.n_components,
+            measure_speedup=args.measure_speedup
         )
     elif args.command == "kmeans_smiles":
         smiles_kmeans.run_clustering_pipeline(
@@ -245,7 +419,8 @@ def main():
             n_init=args.n_init,
             random_state=args.random_state,
             algorithm=args.algorithm,
-            n_jobs=args.n_jobs
+            n_jobs=args.n_jobs,
+            fp_store_dir=None if args.no_fp_store else args.fp_store_dir
         )
     elif args.command == "hac_spectra":
         num_workers = args.num_workers if args.num_workers != -1 else None
@@ -259,7 +434,17 @@ def main():
             mz_max=args.mz_max,
             tol=args.tol,
             num_workers=num_workers,
-            dist_method=args.dist_method
+            dist_method=args.dist_method,
+            precursor_tol=args.precursor_tol,
+            precursor_unit=args.precursor_unit,
+            dist_cutoff=args.dist_cutoff,
+            lsh=args.lsh,
+            lsh_num_perm=args.lsh_num_perm,
+            lsh_bands=args.lsh_bands,
+            lsh_recall_sample=args.lsh_recall_sample,
+            min_matched_peaks=args.min_matched_peaks,
+            auto_k=args.auto_k,
+            linkage_cache_dir=None if args.no_linkage_cache else args.linkage_cache_dir
         )
     elif args.command == "hac_smiles":
         from smiles.clustering_pipeline import hac as smiles_hac
@@ -267,7 +452,17 @@ def main():
             smiles_file=args.smiles_file,
             fp_size=args.fp_size,
             k_clusters=args.n_clusters,
-            sim_type=args.sim_type
+            sim_type=args.sim_type,
+            blocking=args.blocking,
+            link_cutoff=args.link_cutoff,
+            blocking_ari=args.blocking_ari,
+            hac_engine=args.hac_engine,
+            condensed_dtype=args.condensed_dtype,
+            condensed_memmap=args.condensed_memmap,
+            auto_k=args.auto_k,
+            linkage_cache_dir=None if args.no_linkage_cache else args.linkage_cache_dir,
+            fp_store_dir=None if args.no_fp_store else args.fp_store_dir,
+            measure_speedup=args.measure_speedup
         )
     elif args.command == "hdbscan_spectra":
         num_workers = args.num_workers if args.num_workers != -1 else None
@@ -281,7 +476,18 @@ def main():
             mz_max=args.mz_max,
             tol=args.tol,
             num_workers=num_workers,
-            dist_method=args.dist_method
+            dist_method=args.dist_method,
+            precursor_tol=args.precursor_tol,
+            precursor_unit=args.precursor_unit,
+            dist_cutoff=args.dist_cutoff,
+            lsh=args.lsh,
+            lsh_num_perm=args.lsh_num_perm,
+            lsh_bands=args.lsh_bands,
+            lsh_recall_sample=args.lsh_recall_sample,
+            min_matched_peaks=args.min_matched_peaks,
+            feature_space=args.feature_space,
+            knn=args.knn,
+            mutual_knn=args.mutual_knn
         )
     elif args.command == "hdbscan_smiles":
       smiles_hdbscan.run_hdbscan_pipeline_smiles(
@@ -289,8 +495,42 @@ def main():
           fp_size=args.fp_size,
           min_cluster_size=args.n_clusters,
           min_samples=args.min_samples,
-          sim_type=args.sim_type
+          sim_type=args.sim_type,
+          knn=args.knn,
+          blocking=args.blocking,
+          link_cutoff=args.link_cutoff,
+          blocking_ari=args.blocking_ari,
+          fp_store_dir=None if args.no_fp_store else args.fp_store_dir,
+          measure_speedup=args.measure_speedup
+      )
+    elif args.command == "butina_smiles":
+      smiles_butina.run_butina_pipeline_smiles(
+          smiles_file=args.smiles_file,
+          fp_size=args.fp_size,
+          cutoff=args.cutoff,
+          sim_type=args.sim_type,
+          block_size=args.block_size,
+          fold_segments=args.fold_segments,
+          n_jobs=args.n_jobs,
+          fp_store_dir=None if args.no_fp_store else args.fp_store_dir
       )
+    elif args.command == "matrix_spectra":
+      from spectra.similarity import sharding
+      from spectra.similarity.matrix import make_matrix_for_file
+      num_workers = args.num_workers if args.num_workers != -1 else None
+      if args.shard is None:
+          make_matrix_for_file(args.binned_file, methode=args.dist_method, output_dir=args.output_dir, tol=args.tol,
+                               num_workers=num_workers, precursor_tol=args.precursor_tol,
+                               precursor_unit=args.precursor_unit, block_size=args.block_size)
+      else:
+          shard, num_shards = sharding.parse_shard(args.shard)
+          sharding.compute_distance_shard(args.binned_file, methode=args.dist_method, shard=shard,
+                                          num_shards=num_shards, output_dir=args.output_dir, tol=args.tol,
+                                          num_workers=num_workers, precursor_tol=args.precursor_tol,
+                                          precursor_unit=args.precursor_unit, block_size=args.block_size)
+    elif args.command == "merge_matrix":
+      from spectra.similarity import sharding
+      sharding.merge_matrix_shards(args.shard_files, args.output_dir)
     elif args.command == "compare_clusters":
       comp.main_compare(args.cluster_file1, args.cluster_file2, args.output_image)
     elif args.command == "compare_scores":
@@ -0,0 +1,39 @@
+import numpy as np
+
+def butina_clustering(neighbors, sample_weight=None):
+    """
+    Clustering de Butina (sphere exclusion) sur un graphe de voisins creux.
+
+    Les éléments sont parcourus par nombre de voisins décroissant (à égalité, par indice croissant) :
+    chaque élément encore libre devient le centroïde d'un nouveau cluster, qui reçoit tous ses voisins
+    encore libres. Les nombres de voisins ne sont pas recalculés après affectation (comme RDKit).
+
+    Arguments:
+      - neighbors : scipy.sparse.csr_matrix (n, n) symétrique, une entrée par paire de voisins
+          (diagonale exclue), voir neighbors.threshold_neighbors.
+      - sample_weight : array-like (n,), optionnel
+          Multiplicité de chaque élément : un élément compte sample_weight - 1 copies de lui-même
+          et la multiplicité de chacun de ses voisins, comme si les doublons étaient présents.
+
+    Retourne:
+      - tuple:
+          labels : np.ndarray (n,) des clusters (0 pour le premier centroïde choisi).
+          centroids : liste des indices des centroïdes, dans l'ordre des clusters.
+    """
+    n = neighbors.shape[0]
+    weights = np.ones(n) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+    adjacency = neighbors.tocsr()
+    degree = (weights - 1) + (adjacency != 0).astype(float) @ weights
+    order = np.lexsort((np.arange(n), -degree))
+    labels = np.full(n, -1, dtype=np.int64)
+    centroids = []
+    indptr, indices = adjacency.indptr, adjacency.indices
+    for i in order:
+        if labels[i] >= 0:
+            continue
+        members = indices[indptr[i]:indptr[i + 1]]
+        members = members[labels[members] < 0]
+        labels[i] = len(centroids)
+        labels[members] = len(centroids)
+        centroids.append(int(i))
+    return labels, centroids
@@ -1,4 +1,17 @@
+import os
+import json
+import time
+import heapq
+import logging
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.cluster.hierarchy import linkage as scipy_linkage
 from sklearn.cluster import AgglomerativeClustering
+from clustering_utilis.common import generate_hash
+from utils.file_utils import file_digest
+
+logger = logging.getLogger(__name__)
 
 def run_hac(distance_matrix, n_clusters):
     """
@@ -14,3 +27,421 @@ def run_hac(distance_matrix, n_clusters):
     clustering = AgglomerativeClustering(n_clusters=n_clusters, metric='precomputed', linkage='average')
     clustering.fit(distance_matrix)
     return clustering.labels_
+
+# Linkages disponibles dans run_hac_condensed : chaîne des plus proches voisins (Lance-Williams)
+# pour average / complete / weighted, arbre couvrant minimal (Prim) pour single, comme scipy
+CONDENSED_LINKAGES = ("average", "complete", "weighted", "single")
+
+def condensed_size(n: int) -> int:
+    """
+    Nombre d'entrées de la matrice condensée (triangle supérieur strict, ordre de scipy) de n éléments.
+    """
+    return n * (n - 1) // 2
+
+def n_from_condensed(size: int) -> int:
+    """
+    Nombre d'éléments correspondant à une matrice condensée de size entrées.
+    """
+    n = int(round((1 + np.sqrt(1 + 8 * size)) / 2))
+    if condensed_size(n) != size:
+        raise ValueError(f"{size} is not the size of a condensed distance matrix")
+    return n
+
+def square_to_condensed(matrix, dtype=np.float32, out=None, block_size: int = 1024) -> np.ndarray:
+    """
+    Convertit une matrice de distances carrée en matrice condensée (ordre de scipy.spatial.distance.squareform),
+    ligne par ligne, sans copie carrée intermédiaire. out (optionnel) peut être un np.memmap.
+    """
+    n = matrix.shape[0]
+    if out is None:
+        out = np.empty(condensed_size(n), dtype=dtype)
+    starts = _row_starts(n)
+    for r0 in range(0, n, block_size):
+        for i in range(r0, min(r0 + block_size, n - 1)):
+            out[starts[i] + i + 1:starts[i] + n] = matrix[i, i + 1:]
+    return out
+
+def _row_starts(n: int) -> np.ndarray:
+    # L'entrée (i, j), i < j, de la matrice condensée est à l'indice starts[i] + j
+    i = np.arange(n, dtype=np.int64)
+    return i * n - i * (i + 1) // 2 - i - 1
+
+def _condensed_row(D, starts, x, n) -> np.ndarray:
+    row = np.empty(n)
+    row[:x] = D[starts[:x] + x]
+    row[x] = np.inf
+    row[x + 1:] = D[starts[x] + x + 1:starts[x] + n]
+    return row
+
+def _write_condensed_row(D, starts, y, row):
+    n = len(starts)
+    D[starts[:y] + y] = row[:y]
+    D[starts[y] + y + 1:starts[y] + n] = row[y + 1:]
+
+def _label(Z: np.ndarray, n: int):
+    """
+    Renumérote les fusions triées (indices de représentants) en identifiants de clusters de scipy
+    (n + indice de la fusion) et renseigne les tailles, comme scipy.cluster.hierarchy.
+    """
+    parent = np.arange(2 * n - 1)
+    size = np.ones(2 * n - 1, dtype=np.int64)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for k in range(n - 1):
+        x_root, y_root = find(int(Z[k, 0])), find(int(Z[k, 1]))
+        Z[k, 0], Z[k, 1] = min(x_root, y_root), max(x_root, y_root)
+        parent[x_root] = parent[y_root] = n + k
+        size[n + k] = size[x_root] + size[y_root]
+        Z[k, 3] = size[n + k]
+
+def _nn_chain(D, n, method):
+    starts = _row_starts(n)
+    size = np.ones(n, dtype=np.int64)
+    active = np.ones(n, dtype=bool)
+    Z = np.empty((n - 1, 4))
+    chain = []
+    for k in range(n - 1):
+        if not chain:
+            chain.append(int(np.argmax(active)))
+        # Parcours de la chaîne des plus proches voisins jusqu'à deux voisins réciproques
+        while True:
+            x = chain[-1]
+            row = _condensed_row(D, starts, x, n)
+            row[~active] = np.inf
+            y = int(np.argmin(row))
+            current_min = row[y]
+            # Le prédécesseur dans la chaîne est préféré à égalité, pour éviter les cycles
+            if len(chain) > 1 and row[chain[-2]] <= current_min:
+                y, current_min = chain[-2], row[chain[-2]]
+                break
+            chain.append(y)
+        del chain[-2:]
+        x, y = min(x, y), max(x, y)
+        nx, ny = size[x], size[y]
+        Z[k] = x, y, current_min, nx + ny
+        # Mise à jour de Lance-Williams : le cluster fusionné prend l'indice y
+        row_x = _condensed_row(D, starts, x, n)
+        row_y = _condensed_row(D, starts, y, n)
+        if method == "average":
+            new_row = (nx * row_x + ny * row_y) / (nx + ny)
+        elif method == "complete":
+            new_row = np.maximum(row_x, row_y)
+        else:
+            new_row = 0.5 * (row_x + row_y)
+        active[x] = False
+        size[x], size[y] = 0, nx + ny
+        new_row[~active] = 0
+        _write_condensed_row(D, starts, y, new_row)
+    return Z
+
+def _mst_single(D, n):
+    starts = _row_starts(n)
+    merged = np.zeros(n, dtype=bool)
+    closest = np.full(n, np.inf)
+    Z = np.empty((n - 1, 4))
+    x = 0
+    for k in range(n - 1):
+        merged[x] = True
+        closest = np.minimum(closest, _condensed_row(D, starts, x, n))
+        candidates = np.where(merged, np.inf, closest)
+        y = int(np.argmin(candidates))
+        Z[k, :3] = x, y, candidates[y]
+        x = y
+    return Z
+
+def linkage_condensed(condensed, method: str = "average", overwrite: bool = False) -> np.ndarray:
+    """
+    Arbre de clustering hiérarchique d'une matrice de distances condensée (float32 ou float64, éventuellement
+    un np.memmap), au format de scipy.cluster.hierarchy.linkage et avec les mêmes fusions.
+
+    average / complete / weighted utilisent l'algorithme de la chaîne des plus proches voisins : les distances
+    entre clusters sont mises à jour dans la matrice condensée elle-même (formule de Lance-Williams, calculée
+    en float64), seuls quelques vecteurs de taille n sont alloués. single utilise l'arbre couvrant minimal
+    (Prim) et ne modifie pas la matrice.
+
+    Les fusions sont celles de scipy (et donc d'AgglomerativeClustering) dès que les distances mises à jour
+    sont conservées en float64 : c'est le cas sans overwrite (copie en float64) ou pour une matrice float64.
+    En place sur une matrice float32, les moyennes (average, weighted) sont arrondies en float32 et seules
+    des égalités exactes entre distances peuvent alors être départagées différemment.
+
+    Arguments:
+      - condensed : array-like (n * (n - 1) / 2,), distances du triangle supérieur.
+      - method : str, "average", "complete", "weighted" ou "single".
+      - overwrite : bool, si True la matrice est modifiée en place (mémoire supplémentaire en O(n)) ;
+          sinon une copie float64 est faite pour average / complete / weighted.
+
+    Retourne:
+      - np.ndarray (n - 1, 4) : fusions (cluster a, cluster b, distance, taille), triées par distance.
+    """
+    if method not in CONDENSED_LINKAGES:
+        raise ValueError(f"method must be one of {', '.join(CONDENSED_LINKAGES)}")
+    n = n_from_condensed(len(condensed))
+    if n < 2:
+        return np.empty((0, 4))
+    if method == "single":
+        Z = _mst_single(condensed, n)
+    else:
+        D = condensed if overwrite else np.array(condensed, dtype=np.float64)
+        Z = _nn_chain(D, n, method)
+    Z = Z[np.argsort(Z[:, 2], kind="mergesort")]
+    _label(Z, n)
+    return Z
+
+def cut_linkage(Z: np.ndarray, n_clusters: int) -> np.ndarray:
+    """
+    Labels de la coupe de l'arbre Z en n_clusters clusters, numérotés comme AgglomerativeClustering :
+    les fusions les plus récentes sont défaites une à une, puis chaque nœud restant reçoit un label.
+    """
+    n = Z.shape[0] + 1
+    if n_clusters > n:
+        raise ValueError(f"Cannot extract more clusters than samples: {n_clusters} clusters were given "
+                         f"for a tree with {n} leaves.")
+    children = Z[:, :2].astype(np.intp)
+    nodes = [-(max(children[-1]) + 1)] if n > 1 else [0]
+    for _ in range(n_clusters - 1):
+        these_children = children[-nodes[0] - n]
+        heapq.heappush(nodes, -these_children[0])
+        heapq.heappushpop(nodes, -these_children[1])
+    labels = np.zeros(n, dtype=np.intp)
+    for label, node in enumerate(nodes):
+        stack = [-node]
+        while stack:
+            current = stack.pop()
+            if current < n:
+                labels[current] = label
+            else:
+                stack.extend(children[current - n])
+    return labels
+
+def run_hac_condensed(condensed, n_clusters, linkage: str = "average", overwrite: bool = False):
+    """
+    Équivalent de run_hac sur une matrice de distances condensée (voir linkage_condensed) :
+    mêmes labels qu'AgglomerativeClustering(metric='precomputed') sur la matrice carrée correspondante,
+    sans les copies n x n de scikit-learn.
+
+    Paramètres:
+      - condensed (numpy.ndarray ou numpy.memmap): distances condensées, float32 ou float64.
+      - n_clusters (int): nombre de clusters à former.
+      - linkage (str): "average" (défaut), "complete", "weighted" ou "single".
+      - overwrite (bool): autorise la modification en place de condensed.
+
+    Retourne:
+      - labels (numpy.ndarray): tableau des labels de clusters.
+    """
+    return cut_linkage(linkage_condensed(condensed, linkage, overwrite), n_clusters)
+
+def linkage_square(distance_matrix, linkage: str = "average") -> np.ndarray:
+    """
+    Arbre de clustering d'une matrice de distances carrée, celui qu'AgglomerativeClustering construit
+    (scipy.cluster.hierarchy.linkage sur le triangle supérieur) : cut_linkage(Z, k) donne les labels de run_hac.
+    """
+    return scipy_linkage(square_to_condensed(distance_matrix, dtype=np.float64), method=linkage)
+
+def linkage_sparse(graph, method: str = "average", max_distance: float = 1.0, nn_chain: bool = False,
+                   dtype=np.float64) -> np.ndarray:
+    """
+    Arbre de clustering d'une structure de distances creuse dont les entrées absentes valent max_distance
+    (ex. scaffold.blocked_distance_graph), sans matrice n x n.
+
+    Deux composantes connexes du graphe ne sont séparées que par des distances max_distance : elles ne fusionnent
+    qu'à max_distance, et les fusions internes à une composante ne dépassent pas max_distance (average, complete,
+    weighted, single). L'arbre de chaque composante est donc construit sur sa seule matrice condensée (scipy, ou
+    linkage_condensed en place en dtype avec nn_chain), puis les composantes sont réunies à max_distance.
+    Les fusions sont celles de l'arbre de la matrice dense, à l'ordre près des égalités à max_distance ;
+    la mémoire est celle de la plus grande composante.
+
+    Retourne:
+      - np.ndarray (n - 1, 4), format de scipy.cluster.hierarchy.linkage.
+    """
+    if method not in CONDENSED_LINKAGES:
+        raise ValueError(f"method must be one of {', '.join(CONDENSED_LINKAGES)}")
+    graph = sparse.csr_matrix(graph)
+    n = graph.shape[0]
+    if n < 2:
+        return np.empty((0, 4))
+    n_components, component = connected_components(graph, directed=False)
+    members = np.argsort(component, kind="stable")
+    bounds = np.searchsorted(component[members], np.arange(n_components + 1))
+    merges, roots = [], []
+    for c in range(n_components):
+        idx = members[bounds[c]:bounds[c + 1]]
+        roots.append(idx[0])
+        m = len(idx)
+        if m < 2:
+            continue
+        sub = graph[idx][:, idx].tocoo()
+        upper = sub.row < sub.col
+        condensed = np.full(condensed_size(m), max_distance, dtype=dtype if nn_chain else np.float64)
+        condensed[_row_starts(m)[sub.row[upper]] + sub.col[upper]] = sub.data[upper]
+        Z = linkage_condensed(condensed, method, overwrite=True) if nn_chain else scipy_linkage(condensed, method)
+        # Feuille d'origine représentant chaque nœud de l'arbre de la composante
+        rep = np.empty(2 * m - 1, dtype=np.int64)
+        rep[:m] = idx
+        for k in range(m - 1):
+            rep[m + k] = rep[int(Z[k, 0])]
+        merges.append(np.column_stack([rep[Z[:, 0].astype(np.int64)], rep[Z[:, 1].astype(np.int64)], Z[:, 2:]]))
+    # Réunion des composantes, après les fusions internes de même hauteur (tri stable)
+    roots = np.array(roots, dtype=float)
+    merges.append(np.column_stack([np.full(len(roots) - 1, roots[0]), roots[1:],
+                                   np.full(len(roots) - 1, max_distance), np.zeros(len(roots) - 1)]))
+    Z = np.vstack(merges)
+    Z = Z[np.argsort(Z[:, 2], kind="mergesort")]
+    _label(Z, n)
+    return Z
+
+def parse_cluster_counts(spec, name: str = "n_clusters") -> list:
+    """
+    Convertit une spécification de nombres de clusters en liste d'entiers triés et uniques :
+    un entier ("8"), une liste ("4,8,16") ou des plages "début-fin" / "début-fin:pas" ("2-20", "10-100:10"),
+    combinables ("2-10,20,50"). name est le nom de l'argument, repris dans le message d'erreur
+    ("min_samples", "min_cluster_size"...).
+    """
+    if isinstance(spec, int):
+        spec = str(spec)
+    counts = set()
+    try:
+        for part in str(spec).replace(" ", "").split(","):
+            if not part:
+                continue
+            if "-" in part:
+                bounds, _, step = part.partition(":")
+                start, _, stop = bounds.partition("-")
+                counts.update(range(int(start), int(stop) + 1, int(step or 1)))
+            else:
+                counts.add(int(part))
+    except ValueError as e:
+        raise ValueError(f"Invalid {name} specification: {spec!r}") from e
+    if not counts or min(counts) < 1:
+        raise ValueError(f"Invalid {name} specification: {spec!r}")
+    return sorted(counts)
+
+def cached_linkage(cache_dir: str, key: dict, build):
+    """
+    Retourne l'arbre de clustering associé à key (entrée et métrique), lu depuis cache_dir s'il y a déjà été
+    sauvegardé, sinon construit par build() puis sauvegardé (<hash de key>.npy, clé en .json à côté).
+    cache_dir=None désactive le cache.
+
+    build() retourne (Z, extras) : extras est un dict sérialisable en JSON (statistiques du calcul des distances,
+    identifiants des éléments...) sauvegardé avec la clé et restitué tel quel lors d'une relecture. Une entrée
+    de cache sans extras (format antérieur) est reconstruite.
+
+    Retourne:
+      - tuple:
+          Z : np.ndarray (n - 1, 4), format de scipy.cluster.hierarchy.linkage.
+          extras : dict retourné par build().
+          info : dict, hash de la clé, chemin, cache utilisé ou non, temps de construction / lecture.
+    """
+    start = time.perf_counter()
+    key_hash = generate_hash(key)
+    path = os.path.join(cache_dir, f"linkage_{key_hash}.npy") if cache_dir else None
+    key_path = os.path.join(cache_dir, f"linkage_{key_hash}.json") if cache_dir else None
+    saved = None
+    if path and os.path.exists(path) and os.path.exists(key_path):
+        with open(key_path, "r") as f:
+            try:
+                saved = json.load(f)
+            except json.JSONDecodeError:
+                saved = None
+    if isinstance(saved, dict) and "extras" in saved:
+        Z = np.load(path)
+        extras = saved["extras"]
+        cached = True
+    else:
+        Z, extras = build()
+        cached = False
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, Z)
+            # Écriture atomique : une exécution concurrente lit l'ancien fichier ou le nouveau, jamais un fichier partiel
+            os.replace(tmp_path, path)
+            tmp_key_path = f"{key_path}.{os.getpid()}.tmp"
+            with open(tmp_key_path, "w") as f:
+                json.dump({"key": key, "extras": extras}, f, indent=4)
+            os.replace(tmp_key_path, key_path)
+    info = {"key_hash": key_hash, "path": path, "cached": cached, "seconds": time.perf_counter() - start}
+    logger.info("Linkage tree %s in %.2fs (%s)", "loaded from cache" if cached else "built",
+                info["seconds"], path or "cache disabled")
+    return Z, extras, info
+
+def distance_silhouette(distances, labels, chunk_size: int = 512, max_distance: float = 1.0) -> float:
+    """
+    Score de silhouette moyen d'une matrice de distances carrée ou condensée (la diagonale est ignorée,
+    ce qui tolère une diagonale non nulle), ou d'une matrice creuse dont les entrées absentes valent
+    max_distance (voir linkage_sparse). Score nul pour un élément seul dans son cluster,
+    -1 si le nombre de clusters n'est pas entre 2 et n - 1 (comme kmeans.evaluate_k).
+    """
+    labels = np.asarray(labels)
+    _, label_idx = np.unique(labels, return_inverse=True)
+    n, n_labels = len(labels), label_idx.max() + 1
+    if n_labels < 2 or n_labels >= n:
+        return -1.0
+    sizes = np.bincount(label_idx, minlength=n_labels).astype(float)
+    own = np.arange(n), label_idx
+    sums = np.empty((n, n_labels))
+    if sparse.issparse(distances):
+        # Hors diagonale, en gardant les zéros explicites (paires calculées de distance nulle)
+        coo = sparse.coo_matrix(distances)
+        off = coo.row != coo.col
+        graph = sparse.csr_matrix((coo.data[off], (coo.row[off], coo.col[off])), shape=(n, n))
+        pattern = sparse.csr_matrix((np.ones(np.count_nonzero(off)), (coo.row[off], coo.col[off])), shape=(n, n))
+        membership = sparse.csr_matrix((np.ones(n), own), shape=(n, n_labels))
+        # Somme des distances calculées, plus max_distance pour chaque paire absente
+        absent = sizes[None, :] - (pattern @ membership).toarray()
+        absent[own] -= 1
+        sums = (graph @ membership).toarray() + max_distance * absent
+    elif np.ndim(distances) == 1:
+        starts = _row_starts(n)
+        for i in range(n):
+            row = _condensed_row(distances, starts, i, n)
+            row[i] = 0
+            sums[i] = np.bincount(label_idx, weights=row, minlength=n_labels)
+    else:
+        membership = np.zeros((n, n_labels))
+        membership[np.arange(n), label_idx] = 1
+        for start in range(0, n, chunk_size):
+            block = np.array(distances[start:start + chunk_size], dtype=float)
+            block[np.arange(len(block)), np.arange(start, start + len(block))] = 0
+            sums[start:start + len(block)] = block @ membership
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intra = sums[own] / (sizes[label_idx] - 1)
+        inter_all = sums / sizes
+        inter_all[own] = np.inf
+        inter = inter_all.min(axis=1)
+        sil = np.nan_to_num((inter - intra) / np.maximum(intra, inter))
+    sil[sizes[label_idx] <= 1] = 0
+    return float(sil.mean())
+
+def sweep_cuts(Z: np.ndarray, cluster_counts: list, distances=None) -> dict:
+    """
+    Coupe l'arbre Z pour chaque nombre de clusters demandé (ramené au nombre d'éléments s'il le dépasse)
+    et, si distances est fourni, calcule le score de silhouette de chaque coupe.
+
+    Retourne:
+      - dict : n_clusters -> {"labels", "height" (distance de la dernière fusion défaite),
+               "seconds" (temps de la coupe), "silhouette" (si distances)}.
+    """
+    n = Z.shape[0] + 1
+    cuts = {}
+    if not cluster_counts:
+        raise ValueError("No n_clusters to cut the tree with")
+    for k in cluster_counts:
+        if k > n:
+            logger.warning("n_clusters=%d reduced to %d: only %d elements", k, n, n)
+            k = n
+        if k in cuts:
+            continue
+        start = time.perf_counter()
+        labels = cut_linkage(Z, k)
+        cuts[k] = {"labels": labels, "height": float(Z[n - k, 2]) if k > 1 else None,
+                   "seconds": time.perf_counter() - start}
+        if distances is not None:
+            cuts[k]["silhouette"] = distance_silhouette(distances, labels)
+    return cuts
@@ -1,5 +1,28 @@
+import time
+import logging
+from importlib.metadata import version, PackageNotFoundError
 import hdbscan
 import numpy as np
+from scipy.sparse import coo_matrix, issparse
+from scipy.sparse.csgraph import connected_components
+
+logger = logging.getLogger(__name__)
+
+# Fonctions internes de hdbscan (arbre de fusion réutilisable) : leur chemin et leur signature ne font pas
+# partie de l'API publique, d'où la version bornée dans requirements.txt et l'erreur explicite ci-dessous
+try:
+    from hdbscan.hdbscan_ import _tree_to_labels, _hdbscan_generic
+    from hdbscan._hdbscan_linkage import label
+except ImportError as e:
+    try:
+        installed = version("hdbscan")
+    except PackageNotFoundError:
+        installed = "(unknown version)"
+    raise ImportError(
+        f"hdbscan {installed} does not provide the internals used to "
+        "reuse HDBSCAN trees (hdbscan.hdbscan_._tree_to_labels, _hdbscan_generic, "
+        "hdbscan._hdbscan_linkage.label); install a supported version: pip install \"hdbscan>=0.8.33,<0.9\""
+    ) from e
 
 def apply_hdbscan(matrix, min_cluster_size, min_samples):
     """
@@ -21,3 +44,140 @@ def apply_hdbscan(matrix, min_cluster_size, min_samples):
     clusterer = hdbscan.HDBSCAN(metric='precomputed', min_cluster_size=min_cluster_size, min_samples=min_samples)
     clusterer.fit(matrix)
     return clusterer.labels_, int(np.max(clusterer.labels_))
+
+def prepare_sparse_graph(matrix, max_distance: float = 1.0):
+    """
+    Prépare une matrice de distances creuse pour HDBSCAN.
+
+    Les entrées absentes d'une matrice creuse sont interprétées comme une distance maximale ;
+    HDBSCAN les considère au contraire comme infinies et exige un graphe connexe. Cette fonction :
+      - remplace les distances nulles par un epsilon (les zéros ne sont pas des arêtes pour scipy),
+      - relie les composantes connexes entre elles par des arêtes de distance max_distance.
+
+    Retourne:
+      - scipy.sparse.csr_matrix : graphe de distances symétrique et connexe.
+    """
+    coo = matrix.tocoo()
+    keep = coo.row != coo.col
+    rows, cols = coo.row[keep], coo.col[keep]
+    data = np.maximum(coo.data[keep], np.finfo(np.float32).eps)
+    n = matrix.shape[0]
+    graph = coo_matrix((data, (rows, cols)), shape=(n, n)).tocsr()
+    n_components, component = connected_components(graph, directed=False)
+    if n_components > 1:
+        _, representatives = np.unique(component, return_index=True)
+        link_rows = np.concatenate([representatives[:-1], representatives[1:]])
+        link_cols = np.concatenate([representatives[1:], representatives[:-1]])
+        rows = np.concatenate([rows, link_rows])
+        cols = np.concatenate([cols, link_cols])
+        data = np.concatenate([data, np.full(len(link_rows), max_distance)])
+        graph = coo_matrix((data, (rows, cols)), shape=(n, n)).tocsr()
+    return graph
+
+def apply_hdbscan_sparse(matrix, min_cluster_size, min_samples, max_distance: float = 1.0):
+    """
+    Applique HDBSCAN sur une matrice de distances creuse (distance maximale implicite ailleurs).
+
+    Les points ayant moins de min_samples voisins reçoivent max_distance comme distance de cœur,
+    ce qui correspond au comportement de la matrice dense où les paires absentes valent max_distance.
+
+    Retourne:
+      - tuple:
+          labels : liste des labels de clusters attribués à chaque élément.
+          max_label : nombre maximum de cluster (le label le plus élevé).
+    """
+    graph = prepare_sparse_graph(matrix, max_distance)
+    clusterer = hdbscan.HDBSCAN(metric='precomputed', min_cluster_size=min_cluster_size,
+                                min_samples=min_samples, max_dist=max_distance)
+    clusterer.fit(graph)
+    return clusterer.labels_, int(np.max(clusterer.labels_))
+
+def mutual_reachability_mst(core_distances: np.ndarray, distances_from) -> np.ndarray:
+    """
+    Arbre couvrant minimal du graphe de portée mutuelle max(cœur_i, cœur_j, d(i, j)), construit par
+    l'algorithme de Prim sans matrice de distances : seules les distances d'un point vers tous les autres
+    sont calculées à chaque étape (mémoire en O(n), temps en O(n²) évaluations de distance).
+    Les égalités sont départagées comme dans HDBSCAN sur matrice précalculée (mst_linkage_core : plus petit
+    indice, même tri des arêtes), d'où les mêmes labels.
+
+    Arguments:
+      - core_distances : np.ndarray (n,), distance de cœur de chaque point (distance à son min_samples-ième voisin).
+      - distances_from : function(i) -> np.ndarray (n,), distances du point i à tous les points.
+
+    Retourne:
+      - np.ndarray (n - 1, 3) : arêtes (i, j, poids) triées par poids croissant.
+    """
+    n = len(core_distances)
+    in_tree = np.zeros(n, dtype=bool)
+    best = np.full(n, np.inf)
+    source = np.zeros(n, dtype=np.int64)
+    edges = np.zeros((max(n - 1, 0), 3))
+    current = 0
+    for e in range(n - 1):
+        in_tree[current] = True
+        reach = np.maximum(np.maximum(distances_from(current), core_distances), core_distances[current])
+        update = (reach < best) & ~in_tree
+        best[update] = reach[update]
+        source[update] = current
+        current = int(np.argmin(np.where(in_tree, np.inf, best)))
+        edges[e] = (source[current], current, best[current])
+    # Même tri que HDBSCAN (non stable) : l'ordre des arêtes de même poids fixe l'arbre de fusion
+    return edges[np.argsort(edges[:, 2])]
+
+def mst_linkage_tree(mst: np.ndarray) -> np.ndarray:
+    """
+    Arbre de fusion (format scipy, comme single_linkage_tree_ de HDBSCAN) d'un arbre couvrant minimal
+    de portée mutuelle trié par poids croissant (voir mutual_reachability_mst).
+    """
+    return label(mst)
+
+def hdbscan_linkage_tree(matrix, min_samples: int, max_distance: float = 1.0) -> np.ndarray:
+    """
+    Arbre de fusion de HDBSCAN sur une matrice de distances (dense, ou creuse avec max_distance implicite
+    comme pour apply_hdbscan_sparse). Il ne dépend que de min_samples (distances de cœur et arbre couvrant
+    de portée mutuelle) : les clusterings de plusieurs min_cluster_size s'en extraient avec hdbscan_labels.
+
+    Retourne:
+      - np.ndarray (n - 1, 4) : arbre de fusion (format scipy).
+    """
+    # Même borne que hdbscan.hdbscan pour les petits jeux de données
+    min_samples = max(min(matrix.shape[0] - 1, min_samples), 1)
+    if issparse(matrix):
+        graph = prepare_sparse_graph(matrix, max_distance)
+        tree, _ = _hdbscan_generic(graph, min_samples, metric="precomputed", max_dist=max_distance)
+    else:
+        tree, _ = _hdbscan_generic(np.asarray(matrix, dtype=np.float64), min_samples, metric="precomputed")
+    return tree
+
+def hdbscan_labels(tree: np.ndarray, min_cluster_size: int):
+    """
+    Extrait les clusters HDBSCAN (méthode "eom") d'un arbre de fusion (voir hdbscan_linkage_tree
+    et mst_linkage_tree) : arbre condensé pour min_cluster_size, stabilités et sélection des clusters.
+
+    Retourne:
+      - tuple:
+          labels : liste des labels de clusters attribués à chaque élément.
+          max_label : nombre maximum de cluster (le label le plus élevé).
+    """
+    if min_cluster_size < 2:
+        raise ValueError("min_cluster_size must be greater than one")
+    labels = _tree_to_labels(None, tree, min_cluster_size)[0]
+    return labels, int(np.max(labels))
+
+def sweep_min_cluster_sizes(tree: np.ndarray, min_cluster_sizes: list) -> dict:
+    """
+    Extrait d'un même arbre de fusion les clusterings HDBSCAN de chaque min_cluster_size.
+
+    Retourne:
+      - dict : min_cluster_size -> {"labels", "max_label", "noise" (nombre de points de bruit),
+               "seconds" (temps de l'extraction)}.
+    """
+    sweep = {}
+    for min_cluster_size in min_cluster_sizes:
+        start = time.perf_counter()
+        labels, max_label = hdbscan_labels(tree, min_cluster_size)
+        sweep[min_cluster_size] = {"labels": labels, "max_label": max_label, "noise": int(np.sum(labels == -1)),
+                                   "seconds": time.perf_counter() - start}
+        logger.debug("min_cluster_size=%d: %d clusters, %d noise points", min_cluster_size, max_label + 1,
+                     sweep[min_cluster_size]["noise"])
+    return sweep
@@ -1,6 +1,8 @@
 import numpy as np
 from sklearn.cluster import KMeans, MiniBatchKMeans
-from sklearn.metrics import silhouette_score
+from sklearn.metrics import silhouette_score, pairwise_distances_chunked
+from sklearn.preprocessing import normalize
+from scipy.sparse import issparse
 from joblib import Parallel, delayed
 import logging
 from datetime import datetime
@@ -10,33 +12,73 @@ logger = logging.getLogger(__name__)
 
 def normalize_features(X):
     """
-    Normalise chaque ligne (échantillon) de X par sa norme L2.
+    Normalise chaque ligne (échantillon) de X par sa norme L2 (matrice dense ou creuse).
     """
+    if issparse(X):
+        return normalize(X, norm="l2")
     norms = np.linalg.norm(X, axis=1, keepdims=True)
     norms[norms == 0] = 1  # éviter la division par zéro
     return X / norms
 
-def evaluate_k(X, k, n_init, random_state, algorithm='mini'):
+def weighted_silhouette_score(X, labels, sample_weight=None, distance_chunks=None):
+    """
+    Score de silhouette (distance euclidienne) d'échantillons pondérés par leur multiplicité.
+
+    Le résultat est celui qu'obtiendrait silhouette_score sur X où chaque ligne i serait répétée
+    sample_weight[i] fois, sans construire cette matrice : les sommes de distances vers chaque cluster
+    sont pondérées, la ligne elle-même est exclue de son cluster une seule fois, et la moyenne finale
+    est pondérée. Sans poids, équivaut à silhouette_score(X, labels).
+
+    distance_chunks (optionnel) remplace la distance euclidienne : appelé sur X, il produit les distances
+    de chaque paquet de lignes consécutives à toutes les lignes, diagonale nulle
+    (ex. kmodes.tanimoto_distance_chunks), comme pairwise_distances_chunked.
+    """
+    if sample_weight is None and distance_chunks is None:
+        return silhouette_score(X, labels)
+    n = X.shape[0]
+    weights = np.ones(n) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+    _, label_idx = np.unique(labels, return_inverse=True)
+    n_clusters = label_idx.max() + 1
+    membership = np.zeros((n, n_clusters))
+    membership[np.arange(n), label_idx] = weights
+    cluster_weights = membership.sum(axis=0)
+    # Somme pondérée des distances de chaque ligne vers chaque cluster, par paquets de lignes
+    chunks = pairwise_distances_chunked(X) if distance_chunks is None else distance_chunks(X)
+    dist_sums = np.vstack([chunk @ membership for chunk in chunks])
+    own = np.arange(n), label_idx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intra = dist_sums[own] / (cluster_weights[label_idx] - 1)
+        inter_all = dist_sums / cluster_weights
+        inter_all[own] = np.inf
+        inter = inter_all.min(axis=1)
+        sil = np.nan_to_num((inter - intra) / np.maximum(intra, inter))
+    # Une ligne seule dans son cluster a un score nul (même convention que silhouette_score)
+    sil[cluster_weights[label_idx] <= 1] = 0
+    return float(np.sum(weights * sil) / np.sum(weights))
+
+def evaluate_k(X, k, n_init, random_state, algorithm='mini', sample_weight=None):
     """
     Évalue une valeur de k en exécutant KMeans (ou MiniBatchKMeans) sur X
     et en calculant le score de silhouette.
     Si le clustering ne forme qu'un seul cluster, renvoie un score de -1.
+    sample_weight (optionnel) donne la multiplicité de chaque ligne (voir weighted_silhouette_score).
     """
     if algorithm == 'mini':
         model = MiniBatchKMeans(n_clusters=k, n_init=n_init, random_state=random_state)
     else:
         model = KMeans(n_clusters=k, n_init=n_init, random_state=random_state)
-    labels = model.fit_predict(X)
+    labels = model.fit_predict(X, sample_weight=sample_weight)
     unique_labels = np.unique(labels)
     if len(unique_labels) < 2:
         score = -1  # Pas assez de clusters pour calculer la silhouette
         logger.info("Pour k = %d, un seul cluster a été formé (labels: %s).", k, unique_labels)
     else:
-        score = silhouette_score(X, labels)
+        score = weighted_silhouette_score(X, labels, sample_weight)
         logger.info("Pour k = %d, silhouette score = %.4f", k, score)
     return k, score
 
-def select_best_k(X, k_min, k_max, n_init=10, random_state=42, algorithm='mini', n_jobs=-1):
+def select_best_k(X, k_min, k_max, n_init=10, random_state=42, algorithm='mini', n_jobs=-1,
+                  sample_weight=None):
     """
     Teste en parallèle les valeurs de k de k_min à k_max et retourne le meilleur k basé sur le score de silhouette.
     
@@ -44,6 +86,7 @@ def select_best_k(X, k_min, k_max, n_init=10, random_state=42, algorithm='mini',
       - Il y a au moins 2 échantillons.
       - k_min est au moins 2.
       - k_max ne dépasse pas (n_samples - 1). Sinon, k_max est ajusté.
+    sample_weight (optionnel) : multiplicité de chaque ligne de X, transmise à evaluate_k.
     
     Retourne :
       - best_k : le meilleur k sélectionné.
@@ -60,22 +103,23 @@ def select_best_k(X, k_min, k_max, n_init=10, random_state=42, algorithm='mini',
         k_max = n_samples
 
     results = Parallel(n_jobs=n_jobs)(
-        delayed(evaluate_k)(X, k, n_init, random_state, algorithm) for k in range(k_min, k_max + 1)
+        delayed(evaluate_k)(X, k, n_init, random_state, algorithm, sample_weight) for k in range(k_min, k_max + 1)
     )
     scores = {k: score for k, score in results}
     best_k = max(scores, key=scores.get)
     logger.info("Meilleur k sélectionné : %d avec un score de silhouette de %.4f", best_k, scores[best_k])
     return best_k, scores
 
-def run_kmeans(X, k, n_init=10, random_state=42, algorithm='mini'):
+def run_kmeans(X, k, n_init=10, random_state=42, algorithm='mini', sample_weight=None):
     """
     Exécute KMeans (ou MiniBatchKMeans) sur X avec k clusters et retourne les labels, centres et le score de silhouette.
+    sample_weight (optionnel) : multiplicité de chaque ligne de X.
     """
     if algorithm == 'mini':
         model = MiniBatchKMeans(n_clusters=k, n_init=n_init, random_state=random_state)
     else:
         model = KMeans(n_clusters=k, n_init=n_init, random_state=random_state)
-    labels = model.fit_predict(X)
+    labels = model.fit_predict(X, sample_weight=sample_weight)
     centers = model.cluster_centers_
-    score = silhouette_score(X, labels)
+    score = weighted_silhouette_score(X, labels, sample_weight)
     return labels, centers, score
\ No newline at end of file
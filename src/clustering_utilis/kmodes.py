@@ -0,0 +1,271 @@
+"""
+Clustering de fingerprints binaires compactés en distance de Tanimoto (1 - |a ET b| / |a OU b|),
+sans décompacter ni normaliser les bits :
+  - "modes"   : k-modes, chaque centre est le vote majoritaire (pondéré) des bits de son cluster ;
+  - "medoids" : k-médoïdes par mini-lots, chaque centre est une molécule du jeu de données.
+Les distances passent par les popcounts de utils.bitops, l'affectation aux centres est répartie sur des threads.
+"""
+import logging
+import numpy as np
+from scipy import sparse
+from joblib import Parallel, delayed
+from utils.bitops import as_words, row_popcounts, and_popcounts, pack_rows, unpack_rows
+from clustering_utilis.kmeans import weighted_silhouette_score
+
+logger = logging.getLogger(__name__)
+
+BINARY_ALGORITHMS = ("modes", "medoids")
+
+def tanimoto_distances(words_a, counts_a, words_b, counts_b) -> np.ndarray:
+    """
+    Distances de Tanimoto (len(words_a), len(words_b)) entre lignes compactées en mots de 64 bits,
+    distance maximale 1 entre deux fingerprints vides (similarité nulle, comme packed.tanimoto_block).
+    """
+    common = and_popcounts(words_a, words_b)
+    union = counts_a[:, None] + counts_b[None, :] - common
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 1 - np.where(union > 0, common / union, 0.0)
+
+def _assign_chunk(words, counts, center_words, center_counts, start, stop):
+    dist = tanimoto_distances(words[start:stop], counts[start:stop], center_words, center_counts)
+    labels = np.argmin(dist, axis=1)
+    return start, labels, dist[np.arange(len(labels)), labels]
+
+def assign_to_centers(words, counts, center_words, center_counts, n_jobs=1, chunk_size=2048):
+    """
+    Affecte chaque ligne au centre le plus proche, par paquets de chunk_size lignes répartis sur n_jobs threads.
+
+    Retourne:
+      - tuple:
+          labels : np.ndarray (n,) indice du centre le plus proche.
+          distances : np.ndarray (n,) distance à ce centre.
+    """
+    n = len(counts)
+    bounds = [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+    if n_jobs == 1 or len(bounds) <= 1:
+        results = [_assign_chunk(words, counts, center_words, center_counts, *b) for b in bounds]
+    else:
+        results = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_assign_chunk)(words, counts, center_words, center_counts, *b) for b in bounds
+        )
+    labels = np.empty(n, dtype=np.int64)
+    distances = np.empty(n)
+    for start, chunk_labels, chunk_dist in results:
+        labels[start:start + len(chunk_labels)] = chunk_labels
+        distances[start:start + len(chunk_labels)] = chunk_dist
+    return labels, distances
+
+def _init_centers(words, counts, k, weights, rng):
+    """
+    Initialisation de type k-means++ : chaque nouveau centre est tiré avec une probabilité proportionnelle
+    au poids fois le carré de la distance au centre le plus proche déjà choisi.
+    """
+    n = len(counts)
+    centers = [int(rng.choice(n, p=weights / weights.sum()))]
+    closest = tanimoto_distances(words, counts, words[centers], counts[centers])[:, 0]
+    for _ in range(1, k):
+        p = weights * closest ** 2
+        if p.sum() <= 0:
+            # Tous les points coïncident avec un centre : on complète par des points non encore choisis
+            remaining = np.setdiff1d(np.arange(n), centers)
+            centers.append(int(rng.choice(remaining)))
+        else:
+            centers.append(int(rng.choice(n, p=p / p.sum())))
+        new = tanimoto_distances(words, counts, words[centers[-1:]], counts[centers[-1:]])[:, 0]
+        closest = np.minimum(closest, new)
+    return np.array(centers, dtype=np.int64)
+
+def majority_centers(packed, labels, k, n_bits, sample_weight=None, chunk_size=4096) -> tuple:
+    """
+    Centres de k-modes : un bit est à 1 dans le centre d'un cluster si au moins la moitié du poids
+    du cluster a ce bit. Les bits sont décompactés par paquets de chunk_size lignes seulement.
+
+    Retourne:
+      - tuple:
+          centers : np.ndarray (k, n_octets) en uint8 (compacté comme packed).
+          cluster_weights : np.ndarray (k,) poids total de chaque cluster (0 : cluster vide).
+    """
+    n = len(labels)
+    weights = np.ones(n) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+    bit_weights = np.zeros((k, n_bits))
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        membership = sparse.csr_matrix((weights[start:stop], (labels[start:stop], np.arange(stop - start))),
+                                       shape=(k, stop - start))
+        bit_weights += membership @ unpack_rows(packed[start:stop], n_bits).astype(float)
+    cluster_weights = np.bincount(labels, weights=weights, minlength=k)
+    return pack_rows(bit_weights * 2 >= cluster_weights[:, None]), cluster_weights
+
+def _fit_modes(packed, words, counts, k, n_bits, weights, rng, max_iter, n_jobs):
+    center_words = words[_init_centers(words, counts, k, weights, rng)]
+    labels = None
+    for iteration in range(max_iter):
+        new_labels, distances = assign_to_centers(words, counts, center_words, row_popcounts(center_words), n_jobs)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        centers, cluster_weights = majority_centers(packed, labels, k, n_bits, weights)
+        centers = as_words(centers)
+        # Un cluster vide (ou de centre vide) est réamorcé sur le point le plus éloigné de son centre
+        for c in np.flatnonzero((cluster_weights == 0) | (row_popcounts(centers) == 0)):
+            far = int(np.argmax(distances * weights))
+            centers[c] = words[far]
+            distances[far] = 0
+        center_words = centers
+    labels, distances = assign_to_centers(words, counts, center_words, row_popcounts(center_words), n_jobs)
+    return labels, center_words, float(np.sum(weights * distances)), iteration + 1
+
+def _update_medoids(words, counts, batch, batch_labels, medoids, weights):
+    """
+    Pour chaque cluster, choisit parmi son médoïde et les membres du mini-lot celui qui minimise
+    la somme pondérée des distances aux membres du mini-lot.
+    """
+    medoids = medoids.copy()
+    for c in np.unique(batch_labels):
+        members = batch[batch_labels == c]
+        candidates = np.concatenate([[medoids[c]], members])
+        cost = tanimoto_distances(words[candidates], counts[candidates], words[members], counts[members]) @ weights[members]
+        medoids[c] = candidates[int(np.argmin(cost))]
+    return medoids
+
+def _fit_medoids(words, counts, k, weights, rng, max_iter, batch_size, n_jobs):
+    n = len(counts)
+    medoids = _init_centers(words, counts, k, weights, rng)
+    batch_size = min(batch_size, n)
+    # Arrêt lorsque les médoïdes n'ont pas changé pendant l'équivalent d'un passage complet sur les données
+    patience = int(np.ceil(n / batch_size))
+    stable = 0
+    for iteration in range(max_iter):
+        batch = np.sort(rng.choice(n, size=batch_size, replace=False))
+        batch_labels, _ = assign_to_centers(words[batch], counts[batch], words[medoids], counts[medoids], n_jobs)
+        new_medoids = _update_medoids(words, counts, batch, batch_labels, medoids, weights)
+        stable = stable + 1 if np.array_equal(new_medoids, medoids) else 0
+        medoids = new_medoids
+        if stable >= patience:
+            break
+    labels, distances = assign_to_centers(words, counts, words[medoids], counts[medoids], n_jobs)
+    return labels, medoids, float(np.sum(weights * distances)), iteration + 1
+
+def fit_binary_clusters(packed, k, n_bits=None, algorithm="modes", n_init=3, max_iter=100, batch_size=1024,
+                        random_state=42, sample_weight=None, n_jobs=-1):
+    """
+    Clustering en k groupes de fingerprints compactés (distance de Tanimoto).
+
+    Arguments:
+      - packed : np.ndarray (n, n_octets) en uint8.
+      - k : int, nombre de clusters.
+      - n_bits : int, taille du fingerprint (défaut : 8 * n_octets).
+      - algorithm : str, "modes" (vote majoritaire) ou "medoids" (k-médoïdes par mini-lots).
+      - n_init : int, nombre d'initialisations ; la meilleure (inertie minimale) est conservée.
+      - max_iter : int, nombre maximal d'itérations (de mini-lots pour "medoids").
+      - batch_size : int, taille des mini-lots de "medoids".
+      - random_state : int, graine aléatoire.
+      - sample_weight : array-like (n,), optionnel, multiplicité de chaque ligne.
+      - n_jobs : int, nombre de threads de l'affectation aux centres (défaut -1 : tous les cœurs).
+
+    Retourne:
+      - tuple:
+          labels : np.ndarray (n,) des clusters.
+          centers : np.ndarray (k, n_octets) des centres compactés pour "modes",
+                    indices (k,) des médoïdes pour "medoids".
+          inertia : float, somme pondérée des distances de chaque ligne à son centre.
+    """
+    if algorithm not in BINARY_ALGORITHMS:
+        raise ValueError(f"algorithm must be one of {', '.join(BINARY_ALGORITHMS)}")
+    packed = np.ascontiguousarray(packed, dtype=np.uint8)
+    n_bits = n_bits or 8 * packed.shape[1]
+    words = as_words(packed)
+    counts = row_popcounts(words)
+    weights = np.ones(len(counts)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+    rng = np.random.default_rng(random_state)
+    best = None
+    for _ in range(n_init):
+        if algorithm == "modes":
+            labels, centers, inertia, n_iter = _fit_modes(packed, words, counts, k, n_bits, weights, rng,
+                                                          max_iter, n_jobs)
+            centers = centers.view(np.uint8)[:, :packed.shape[1]]
+        else:
+            labels, centers, inertia, n_iter = _fit_medoids(words, counts, k, weights, rng, max_iter,
+                                                            batch_size, n_jobs)
+        logger.debug("k-%s (k=%d): inertia %.4f after %d iterations", algorithm, k, inertia, n_iter)
+        if best is None or inertia < best[2]:
+            best = (labels, centers, inertia)
+    return best
+
+def tanimoto_distance_chunks(packed, chunk_size=512):
+    """
+    Distances de Tanimoto de chaque paquet de chunk_size lignes compactées à toutes les lignes
+    (diagonale nulle), pour kmeans.weighted_silhouette_score.
+    """
+    words = as_words(packed)
+    counts = row_popcounts(words)
+    n = len(counts)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        chunk = tanimoto_distances(words[start:stop], counts[start:stop], words, counts)
+        chunk[np.arange(stop - start), np.arange(start, stop)] = 0
+        yield chunk
+
+def tanimoto_silhouette_score(packed, labels, sample_weight=None, chunk_size=512) -> float:
+    """
+    Score de silhouette en distance de Tanimoto : kmeans.weighted_silhouette_score (même pondération)
+    sur les distances de tanimoto_distance_chunks.
+    """
+    return weighted_silhouette_score(packed, labels, sample_weight,
+                                     distance_chunks=lambda X: tanimoto_distance_chunks(X, chunk_size))
+
+def evaluate_k_binary(packed, k, n_init, random_state, algorithm="modes", sample_weight=None, n_bits=None):
+    """
+    Évalue une valeur de k par fit_binary_clusters et le score de silhouette en distance de Tanimoto.
+    Si le clustering ne forme qu'un seul cluster, renvoie un score de -1.
+    """
+    labels, _, _ = fit_binary_clusters(packed, k, n_bits, algorithm, n_init, random_state=random_state,
+                                       sample_weight=sample_weight, n_jobs=1)
+    unique_labels = np.unique(labels)
+    if len(unique_labels) < 2:
+        score = -1
+        logger.info("Pour k = %d, un seul cluster a été formé (labels: %s).", k, unique_labels)
+    else:
+        score = tanimoto_silhouette_score(packed, labels, sample_weight)
+        logger.info("Pour k = %d, silhouette score (Tanimoto) = %.4f", k, score)
+    return k, score
+
+def select_best_k_binary(packed, k_min, k_max, n_init=3, random_state=42, algorithm="modes", n_jobs=-1,
+                         sample_weight=None, n_bits=None):
+    """
+    Équivalent de kmeans.select_best_k pour les fingerprints compactés : teste en parallèle les valeurs
+    de k de k_min à k_max et retourne le meilleur k selon le score de silhouette en distance de Tanimoto.
+
+    Retourne :
+      - best_k : le meilleur k sélectionné.
+      - scores : dictionnaire des scores pour chaque k testé.
+    """
+    n_samples = packed.shape[0]
+    if n_samples < 2:
+        raise ValueError("Le nombre d'échantillons doit être au moins 2 pour effectuer le clustering.")
+    if k_min < 2:
+        logger.warning("k_min ajusté à 2 car le clustering nécessite au moins 2 clusters.")
+        k_min = 2
+    if k_max >= n_samples:
+        logger.warning("k_max ajusté à %d car il ne peut excéder n_samples", n_samples - 1)
+        k_max = n_samples - 1
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(evaluate_k_binary)(packed, k, n_init, random_state, algorithm, sample_weight, n_bits)
+        for k in range(k_min, k_max + 1)
+    )
+    scores = {k: score for k, score in results}
+    best_k = max(scores, key=scores.get)
+    logger.info("Meilleur k sélectionné : %d avec un score de silhouette de %.4f", best_k, scores[best_k])
+    return best_k, scores
+
+def run_binary_clustering(packed, k, n_init=3, random_state=42, algorithm="modes", sample_weight=None,
+                          n_bits=None, n_jobs=-1):
+    """
+    Équivalent de kmeans.run_kmeans : exécute fit_binary_clusters avec k clusters et retourne
+    les labels, les centres (voir fit_binary_clusters) et le score de silhouette en distance de Tanimoto.
+    """
+    labels, centers, _ = fit_binary_clusters(packed, k, n_bits, algorithm, n_init, random_state=random_state,
+                                             sample_weight=sample_weight, n_jobs=n_jobs)
+    score = tanimoto_silhouette_score(packed, labels, sample_weight)
+    return labels, centers, score
@@ -0,0 +1,79 @@
+import logging
+import numpy as np
+import joblib
+from scipy.sparse import csr_matrix
+
+logger = logging.getLogger(__name__)
+
+REDUCTION_METHODS = ("random_projection", "svd")
+
+def fit_reduction(X, method: str, n_components: int, random_state: int = 42):
+    """
+    Ajuste une réduction de dimension sur la matrice de caractéristiques X et retourne X projetée.
+
+    Méthodes disponibles :
+      - "random_projection" : projection aléatoire creuse (SparseRandomProjection), qui préserve
+        approximativement les distances euclidiennes ;
+      - "svd" : SVD tronquée randomisée (TruncatedSVD), qui conserve les directions de plus forte variance.
+
+    Arguments:
+      - X : array-like ou matrice creuse (n_échantillons, n_caractéristiques).
+      - method : str, "random_projection" ou "svd".
+      - n_components : int, dimension de sortie (ramenée à min(n_échantillons, n_caractéristiques) - 1 si besoin).
+      - random_state : int, graine aléatoire.
+
+    Retourne:
+      - tuple:
+          model : projection ajustée (à sauvegarder avec save_reduction).
+          X_reduced : np.ndarray (n_échantillons, n_components).
+          info : dict avec la méthode, les dimensions d'entrée et de sortie et la variance expliquée
+                 (SVD uniquement, None pour la projection aléatoire).
+    """
+    if method not in REDUCTION_METHODS:
+        raise ValueError(f"Méthode de réduction inconnue: {method} (attendu: {', '.join(REDUCTION_METHODS)})")
+    n_samples, n_features = X.shape
+    max_components = max(1, min(n_samples, n_features) - 1)
+    if n_components > max_components:
+        logger.warning("n_components ajusté à %d (n_samples=%d, n_features=%d).", max_components, n_samples, n_features)
+        n_components = max_components
+
+    # Les bins fins sont majoritairement vides : la réduction travaille sur la matrice creuse
+    X_sparse = csr_matrix(X)
+    if method == "svd":
+        from sklearn.decomposition import TruncatedSVD
+        model = TruncatedSVD(n_components=n_components, algorithm="randomized", random_state=random_state)
+    else:
+        from sklearn.random_projection import SparseRandomProjection
+        model = SparseRandomProjection(n_components=n_components, dense_output=True, random_state=random_state)
+    X_reduced = np.asarray(model.fit_transform(X_sparse))
+
+    explained_variance = None
+    if method == "svd":
+        explained_variance = float(np.sum(model.explained_variance_ratio_))
+    info = {
+        "method": method,
+        "n_features": int(n_features),
+        "n_components": int(n_components),
+        "explained_variance": explained_variance,
+    }
+    logger.info("Reduction %s: %d -> %d features (explained variance: %s).",
+                method, n_features, n_components, explained_variance)
+    return model, X_reduced, info
+
+def apply_reduction(model, X) -> np.ndarray:
+    """
+    Projette de nouveaux spectres (même binning que lors de l'ajustement) avec une réduction ajustée.
+    """
+    return np.asarray(model.transform(csr_matrix(X)))
+
+def save_reduction(model, output_file: str):
+    """
+    Sauvegarde une réduction ajustée (joblib) pour projeter ultérieurement de nouveaux spectres.
+    """
+    joblib.dump(model, output_file)
+
+def load_reduction(input_file: str):
+    """
+    Charge une réduction sauvegardée par save_reduction.
+    """
+    return joblib.load(input_file)
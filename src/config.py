@@ -10,6 +10,8 @@ DEFAULT_PROCESSED_SPECTRA_DIR = "./data/adducts/spectra"
 # Pour l'étape similarity
 DEFAULT_BINNED_TMP_DIR_BASE = "./output/tmp/binned_adducts"
 DEFAULT_SIMILARITY_OUTPUT_DIR = "./output/similarity_matrixes/spectra"
+DEFAULT_FINGERPRINT_STORE_DIR = "./output/fingerprint_store"
+DEFAULT_LINKAGE_CACHE_DIR = "./output/linkage_cache"
 
 # Paramètres généraux
 MZ_FROM = 20
@@ -15,11 +15,15 @@ def clean_compound_name(compound_name: str) -> str:
 def filter_params(params: dict) -> dict:
     """
     Extrait les paramètres pertinents et nettoie le nom de la molécule.
+    La masse du précurseur (pepmass) est conservée si elle est présente.
     """
     compound_name = params.get('compound_name', '')
     compound_name = clean_compound_name(compound_name)
     smiles = params.get('smiles', '')
-    return {"compound_name": compound_name, "smiles": smiles}
+    filtered = {"compound_name": compound_name, "smiles": smiles}
+    if 'pepmass' in params:
+        filtered['pepmass'] = params['pepmass']
+    return filtered
 
 def filter_peaks(mz_array, intensity_array, mz_from: float, mz_to: float, min_intensity: float):
     """
@@ -46,6 +50,6 @@ def filter_peaks(mz_array, intensity_array, mz_from: float, mz_to: float, min_in
 
 def fingerprint(params: dict) -> str:
     """
-    Génère une empreinte hashable à partir des paramètres (à l'exclusion de l'ID).
+    Génère une empreinte hashable à partir des paramètres (à l'exclusion de l'ID et du pepmass).
     """
-    return chr(30).join([f"{key}{chr(31)}{params[key]}" for key in sorted(params) if key != 'id'])
+    return chr(30).join([f"{key}{chr(31)}{params[key]}" for key in sorted(params) if key not in ('id', 'pepmass')])
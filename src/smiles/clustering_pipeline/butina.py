@@ -0,0 +1,113 @@
+import os
+import logging
+import numpy as np
+import config
+from clustering_utilis.butina import butina_clustering
+from clustering_utilis.common import generate_hash, write_json_results
+from utils.file_utils import read_smiles_file
+from smiles.similarity.matrix import packed_fingerprints
+from smiles.similarity.packed import SIM_TYPES
+from smiles.similarity.neighbors import threshold_neighbors
+from smiles.similarity.dedup import deduplicate_smiles, expand_labels
+
+logger = logging.getLogger(__name__)
+
+def run_butina_pipeline_smiles(smiles_file: str,
+                               fp_size: int = 2048,
+                               cutoff: float = 0.65,
+                               sim_type: str = "jaccard",
+                               block_size: int = 512,
+                               fold_segments: int = 0,
+                               n_jobs: int = -1,
+                               fp_store_dir: str = config.DEFAULT_FINGERPRINT_STORE_DIR) -> str:
+    """
+    Exécute le pipeline de clustering de Butina (sphere exclusion) sur un fichier de SMILES,
+    sans matrice de similarité dense.
+
+    Étapes :
+      1. Lit le fichier de SMILES et regroupe les écritures d'une même molécule (SMILES canonique,
+         voir dedup.deduplicate_smiles).
+      2. Calcule les fingerprints Morgan compactés des molécules uniques (packed_fingerprints).
+      3. Recherche, par blocs de block_size molécules, les paires dont la similarité atteint cutoff
+         (neighbors.threshold_neighbors) : les paires exclues par les bornes sur le nombre de bits
+         ne sont pas calculées, et seules les paires retenues sont conservées.
+      4. Applique le clustering de Butina sur ce graphe, le nombre de voisins de chaque molécule
+         tenant compte des doublons du fichier.
+      5. Réaffecte les labels à chaque ligne du fichier et sauvegarde les résultats dans un fichier JSON :
+         output/clustering_results/butina/smiles/<base_name>_fp<fp_size>/
+         Le nom final du fichier JSON sera par exemple :
+         "[M-3H2O+H]1+_butina_120_ab12cd34.json" (120 clusters).
+
+    Paramètres :
+      - smiles_file : str   — chemin vers le fichier de SMILES (un SMILES par ligne).
+      - fp_size     : int   — taille du fingerprint Morgan (défaut : 2048).
+      - cutoff      : float — similarité minimale entre deux voisins (défaut : 0.65, soit une distance de 0.35).
+      - sim_type    : str   — type de similarité ("cosinus" ou "jaccard", défaut : "jaccard").
+      - block_size  : int   — nombre de molécules par bloc pour la recherche des voisins.
+      - fold_segments: int  — segments du fingerprint replié pour une borne supplémentaire (0 : désactivée).
+      - n_jobs      : int   — nombre de processus / threads (défaut -1 : tous les cœurs).
+      - fp_store_dir: str   — store persistant des fingerprints (None : tout recalculer).
+
+    Retourne :
+      - output_file : str — chemin complet du fichier JSON contenant les résultats.
+
+    Remarque : Les IDs dans les résultats correspondent aux indices originaux dans le fichier (commençant à 0).
+    """
+    if sim_type.lower() not in SIM_TYPES:
+        raise ValueError(f"sim_type must be one of {', '.join(SIM_TYPES)}")
+
+    # 1. Lecture et déduplication des SMILES
+    smiles_list = read_smiles_file(smiles_file)
+    dedup = deduplicate_smiles(smiles_list, n_jobs=n_jobs)
+
+    # 2-3. Fingerprints compactés et graphe des voisins au-dessus du seuil
+    packed, _ = packed_fingerprints(dedup["unique"], fp_size=fp_size, n_jobs=n_jobs, store_dir=fp_store_dir)
+    neighbors, search_stats = threshold_neighbors(packed, cutoff, sim_type.lower(), block_size=block_size,
+                                                  fold_segments=fold_segments, n_jobs=n_jobs)
+
+    # 4. Clustering de Butina pondéré par les multiplicités
+    labels_unique, centroids = butina_clustering(neighbors, sample_weight=dedup["counts"])
+    # Les SMILES invalides, exclus de la recherche, forment chacun un cluster singleton
+    labels = expand_labels(labels_unique, dedup["inverse"])
+    n_clusters = int(labels.max()) + 1 if len(labels) else 0
+
+    # 5. Résultats (ID = index de ligne) et sauvegarde
+    results = [{"id": i, "cluster": int(labels[i])} for i in range(len(smiles_list))]
+    params = {
+        "smiles_file": smiles_file,
+        "fp_size": fp_size,
+        "cutoff": cutoff,
+        "sim_type": sim_type
+    }
+    cluster_sizes = np.bincount(labels, minlength=n_clusters)
+    performance = {
+        "n_clusters": n_clusters,
+        "singletons": int(np.sum(cluster_sizes == 1)),
+        "neighbor_search": search_stats,
+        "centroids": [dedup["unique"][c] for c in centroids],
+        "unique_molecules": len(dedup["unique"]),
+        "invalid_smiles": dedup["invalid"]
+    }
+
+    hash_val = generate_hash(params)
+    base_name = os.path.splitext(os.path.basename(smiles_file))[0]
+    results_dir = os.path.join("output", "clustering_results", "butina", "smiles", f"{base_name}_fp{fp_size}")
+    os.makedirs(results_dir, exist_ok=True)
+    output_file = os.path.join(results_dir, f"{base_name}_butina_{n_clusters}_{hash_val}.json")
+
+    write_json_results(params, performance, results, output_file)
+    logger.info("Butina clustering pipeline for SMILES completed (%d clusters). Results saved in %s",
+                n_clusters, output_file)
+    return output_file
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    if len(sys.argv) < 3:
+        print("Usage: butina_smiles.py <smiles_file> <fp_size> [cutoff] [sim_type]")
+        sys.exit(1)
+    smiles_file = sys.argv[1]
+    fp_size = int(sys.argv[2])
+    cutoff = float(sys.argv[3]) if len(sys.argv) > 3 else 0.65
+    sim_type = sys.argv[4] if len(sys.argv) > 4 else "jaccard"
+    run_butina_pipeline_smiles(smiles_file, fp_size, cutoff, sim_type=sim_type)
@@ -5,33 +5,84 @@ import json
 import hashlib
 from datetime import datetime
 import numpy as np
-from clustering_utilis.hac import run_hac
+import config
+from clustering_utilis.hac import (linkage_condensed, linkage_square, linkage_sparse, cut_linkage, square_to_condensed,
+                                  condensed_size, parse_cluster_counts, cached_linkage, sweep_cuts)
 from clustering_utilis.common import generate_hash, write_json_results
-from utils.file_utils import read_smiles_file
-from smiles.similarity.matrix import generate_similarity_matrix
-from smiles.similarity.representations import morgan_fingerprint
-from smiles.similarity.metrics import similarity_cosinus, similarity_jaccard
+from utils.file_utils import read_smiles_file, file_digest
+from smiles.similarity.matrix import (smiles_similarity_matrix, smiles_blocked_graph, packed_fingerprints,
+                                     SMILES_SIM_TYPES)
+from smiles.similarity.packed import packed_condensed_distances, SIM_TYPES
+from cluster_comparison.scores import ARI
+from smiles.similarity.dedup import deduplicate_smiles, expand_labels
+from smiles.similarity.lingo import measure_lingo_speedup
 
 logger = logging.getLogger(__name__)
 
+HAC_ENGINES = ("sklearn", "nn_chain")
+
+def _condensed_distances(smiles: list, sim_type: str, fp_size: int, store_dir: str, dtype: str,
+                         memmap_path: str = None) -> np.ndarray:
+    """
+    Distances condensées (1 - similarité) des SMILES pour run_hac_condensed : calculées directement par blocs
+    pour "jaccard" et "cosinus", converties depuis la matrice carrée pour "cls" et "lingo".
+    Avec memmap_path, la matrice condensée est un fichier projeté en mémoire.
+    """
+    n = len(smiles)
+    out = None
+    if memmap_path:
+        out = np.memmap(memmap_path, dtype=dtype, mode="w+", shape=(condensed_size(n),))
+    if sim_type in SIM_TYPES:
+        packed, _ = packed_fingerprints(smiles, fp_size=fp_size, store_dir=store_dir)
+        return packed_condensed_distances(packed, sim_type, dtype=dtype, out=out)
+    return square_to_condensed(1 - smiles_similarity_matrix(smiles, sim_type, fp_size=fp_size, store_dir=store_dir),
+                               dtype=dtype, out=out)
+
 def run_hac_pipeline_smiles(smiles_file: str,
                             fp_size: int = 2048,
-                            k_clusters: int = 3,
-                            sim_type: str = "jaccard") -> str:
+                            k_clusters=3,
+                            sim_type: str = "jaccard",
+                            blocking: str = None,
+                            link_cutoff: float = 0.5,
+                            blocking_ari: bool = False,
+                            hac_engine: str = "sklearn",
+                            condensed_dtype: str = "float64",
+                            condensed_memmap: str = None,
+                            auto_k: bool = False,
+                            linkage_cache_dir: str = config.DEFAULT_LINKAGE_CACHE_DIR,
+                            fp_store_dir: str = config.DEFAULT_FINGERPRINT_STORE_DIR,
+                            measure_speedup: bool = False):
     """
     Exécute le pipeline de clustering HAC sur un fichier de SMILES.
     
     Étapes :
-      1. Lit le fichier de SMILES et génère la matrice de similarité via generate_similarity_matrix.
-         - La transformation utilisée est morgan_fingerprint (avec fp_size).
-         - La fonction de similarité choisie dépend de sim_type :
-             • "cosinus" → similarity_cosinus
-             • "jaccard" → similarity_jaccard
+      1. Lit le fichier de SMILES, regroupe les écritures d'une même molécule (SMILES canonique,
+         voir dedup.deduplicate_smiles ; chaînes identiques pour "lingo", sans RDKit) et génère la matrice
+         de similarité des molécules uniques :
+         - "jaccard" (Tanimoto) ou "cosinus" : fingerprints Morgan (fp_size bits) compactés, similarité
+           calculée par blocs à partir des popcounts des mots communs (packed_similarity_matrix),
+         - "cls" : plus longue sous-séquence commune des SMILES (algorithme bit-parallèle, lcs.cls_similarity_matrix).
+         - "lingo" : Tanimoto des comptes de trigrammes des SMILES (lingo.lingo_similarity_matrix).
       2. Convertit la matrice de similarité en matrice de distance (distance = 1 - similarité).
-      3. Applique le clustering HAC sur la matrice de distance.
-      4. Génère les résultats en attribuant à chaque molécule un ID égal à son index.
-      5. Génère un hash (à partir des paramètres, en excluant les données variables) et sauvegarde
-         les résultats dans un fichier JSON dans le dossier :
+         Avec blocking ("scaffold" ou "generic"), les distances exactes ne sont calculées qu'entre molécules
+         de même squelette de Bemis-Murcko (et entre blocs dont les fingerprints résumés atteignent link_cutoff),
+         les autres paires valant 1 (smiles_blocked_graph). L'arbre est alors construit composante connexe
+         par composante connexe de cette structure creuse (linkage_sparse), sans matrice n x n, et la silhouette
+         de auto_k est calculée sur la même structure. blocking_ari calcule aussi le clustering sans
+         blocage et enregistre l'ARI entre les deux.
+      3. Construit l'arbre HAC complet (average linkage, celui d'AgglomerativeClustering) : chaque molécule
+         unique compte une fois dans la moyenne des distances. Avec hac_engine="nn_chain", les étapes 1-3
+         travaillent sur une matrice condensée (condensed_dtype, éventuellement projetée depuis le fichier
+         condensed_memmap) traitée en place par la chaîne des plus proches voisins (linkage_condensed).
+         L'arbre ne dépend pas du nombre de clusters : il est sauvegardé dans linkage_cache_dir, avec pour clé
+         le contenu du fichier et les paramètres de distance, et relu aux exécutions suivantes (étapes 1-3 évitées) ;
+         les statistiques du blocage ("blocking") sont sauvegardées avec lui.
+      4. Coupe l'arbre pour chaque nombre de clusters de k_clusters. Avec auto_k, chaque coupe est notée par
+         le score de silhouette sur la matrice de distances et seule la meilleure est conservée ; les scores
+         sont enregistrés dans le bloc performance ("cut_scores").
+      5. Pour chaque coupe conservée, attribue à chaque ligne du fichier un ID égal à son index et le label
+         de sa molécule, génère un hash (à partir des paramètres, en excluant les données variables)
+         et sauvegarde les résultats dans un fichier JSON dans le dossier :
          output/clustering_results/hac/smiles/<base_name>_fp<fp_size>/
          Le nom final du fichier JSON sera par exemple :
          "[M-3H2O+H]1+_hac_4_ab12cd34.json".
@@ -39,54 +90,135 @@ def run_hac_pipeline_smiles(smiles_file: str,
     Paramètres :
       - smiles_file : str  — chemin vers le fichier de SMILES (un SMILES par ligne).
       - fp_size     : int  — taille du fingerprint Morgan (défaut : 2048).
-      - k_clusters  : int  — nombre de clusters à former.
-      - sim_type    : str  — type de similarité ("cosinus" ou "jaccard", défaut : "jaccard").
+      - k_clusters  : int ou str — nombre(s) de clusters à former : entier, liste ou plage
+                              ("4", "2,4,8", "2-20", "10-100:10", voir parse_cluster_counts).
+      - sim_type    : str  — type de similarité ("cosinus", "jaccard", "cls" ou "lingo", défaut : "jaccard").
+      - blocking    : str  — blocage par squelette ("scaffold", "generic" ou None, défaut : None).
+      - link_cutoff : float — similarité des fingerprints résumés au-delà de laquelle deux blocs sont comparés.
+      - blocking_ari: bool — calcule aussi le résultat sans blocage et enregistre l'ARI (défaut : False).
+      - hac_engine  : str  — "sklearn" (défaut) ou "nn_chain".
+      - condensed_dtype : str — "float64" (défaut, labels identiques à sklearn) ou "float32" (moitié moins
+                              de mémoire ; des égalités exactes de moyennes peuvent être départagées autrement).
+      - condensed_memmap : str — fichier de la matrice condensée projetée en mémoire (None : en mémoire vive).
+      - auto_k      : bool — choisit parmi k_clusters la coupe de meilleur score de silhouette (défaut : False).
+      - linkage_cache_dir : str — dossier du cache des arbres HAC (None : pas de cache).
+      - fp_store_dir: str  — store persistant des fingerprints (None : tout recalculer).
+      - measure_speedup : bool — avec "lingo", mesure le temps de la matrice Lingo face à celui de la matrice
+                              Morgan/Tanimoto et l'enregistre dans le bloc performance ("lingo_speedup").
     
     Retourne :
-      - output_file : str — chemin complet du fichier JSON contenant les résultats.
+      - output_files : list — chemins complets des fichiers JSON de résultats, un par coupe conservée.
     """
-    # Choix de la fonction de similarité
-    if sim_type.lower() == "cosinus":
-        similarity_fn = similarity_cosinus
-    elif sim_type.lower() == "jaccard":
-        similarity_fn = similarity_jaccard
-    else:
-        raise ValueError("sim_type must be either 'cosinus' or 'jaccard'")
+    if sim_type.lower() not in SMILES_SIM_TYPES:
+        raise ValueError(f"sim_type must be one of {', '.join(SMILES_SIM_TYPES)}")
+    if hac_engine not in HAC_ENGINES:
+        raise ValueError(f"hac_engine must be one of {', '.join(HAC_ENGINES)}")
     
-    transform = lambda s: morgan_fingerprint(s, fp_size=fp_size)
-    
-    # 1. Génération de la matrice de similarité
-    sim_matrix = generate_similarity_matrix(smiles_file, transform, similarity_fn)
-    logger.info("Similarity matrix generated with shape: %s", sim_matrix.shape)
-    
-    # 2. Conversion en matrice de distance
-    distance_matrix = 1 - sim_matrix
-    
-    # 3. Exécution du clustering HAC sur la matrice de distance
-    labels = run_hac(distance_matrix, n_clusters=k_clusters)
-    
-    # 4. Génération des résultats (ID = index)
+    # 1. Déduplication des SMILES
     smiles_list = read_smiles_file(smiles_file)
-    results = [{"id": i, "cluster": int(labels[i])} for i in range(len(smiles_list))]
-    
-    # 5. Préparation des paramètres et génération du hash
-    params = {
-        "smiles_file": smiles_file,
+    dedup = deduplicate_smiles(smiles_list, canonical=sim_type.lower() != "lingo")
+    cluster_counts = parse_cluster_counts(k_clusters, "k_clusters")
+    performance = {"unique_molecules": len(dedup["unique"]), "invalid_smiles": dedup["invalid"]}
+    distances = {}
+    if measure_speedup and sim_type.lower() == "lingo":
+        performance["lingo_speedup"] = measure_lingo_speedup(dedup["unique"], fp_size=fp_size)
+
+    def distance_matrix():
+        # 1-2. Matrice des distances des molécules uniques (carrée, ou condensée pour nn_chain)
+        if "matrix" in distances:
+            return distances["matrix"]
+        if blocking:
+            # Distances exactes à l'intérieur des blocs de squelettes, distance maximale ailleurs
+            # (structure creuse, sans matrice n x n)
+            matrix, performance["blocking"] = smiles_blocked_graph(dedup["unique"], blocking, sim_type.lower(),
+                                                                   link_cutoff=link_cutoff, fp_size=fp_size,
+                                                                   store_dir=fp_store_dir)
+        elif hac_engine == "nn_chain":
+            # Matrice condensée des distances, sans matrice carrée pour "jaccard" et "cosinus"
+            matrix = _condensed_distances(dedup["unique"], sim_type.lower(), fp_size, fp_store_dir,
+                                          condensed_dtype, condensed_memmap)
+        else:
+            sim_matrix = smiles_similarity_matrix(dedup["unique"], sim_type.lower(), fp_size=fp_size,
+                                                  store_dir=fp_store_dir)
+            logger.info("Similarity matrix generated with shape: %s", sim_matrix.shape)
+            matrix = 1 - sim_matrix
+        distances["matrix"] = matrix
+        return matrix
+
+    def build_tree():
+        # 3. Arbre HAC complet (average linkage), indépendant du nombre de clusters
+        if blocking:
+            tree = linkage_sparse(distance_matrix(), "average", nn_chain=hac_engine == "nn_chain",
+                                  dtype=condensed_dtype)
+        elif hac_engine == "nn_chain":
+            # La matrice n'est modifiée en place que si elle ne sert plus au score des coupes
+            tree = linkage_condensed(distance_matrix(), "average", overwrite=not auto_k)
+        else:
+            tree = linkage_square(distance_matrix(), "average")
+        # Statistiques du calcul des distances, sauvegardées avec l'arbre et restituées lors d'une relecture
+        return tree, {"performance": {name: performance[name] for name in ("blocking",) if name in performance}}
+
+    tree_key = {
+        "smiles_md5": file_digest(smiles_file),
         "fp_size": fp_size,
-        "k_clusters": k_clusters,
-        "sim_type": sim_type
+        "sim_type": sim_type.lower(),
+        "canonical_dedup": sim_type.lower() != "lingo",
+        "blocking": blocking,
+        "link_cutoff": link_cutoff if blocking else None,
+        "linkage": "average",
+        "condensed_dtype": condensed_dtype if hac_engine == "nn_chain" else "float64"
     }
-    performance = {}  # Vous pouvez ajouter d'autres métriques si nécessaire
-    
-    hash_val = generate_hash(params)
+    tree, extras, performance["linkage_tree"] = cached_linkage(linkage_cache_dir, tree_key, build_tree)
+    performance.update(extras["performance"])
+
+    # 4. Coupes de l'arbre pour chaque nombre de clusters (score de silhouette en mode automatique)
+    cuts = sweep_cuts(tree, cluster_counts, distance_matrix() if auto_k else None)
+    if auto_k:
+        performance["cut_scores"] = {k: cut["silhouette"] for k, cut in cuts.items()}
+        selected = [max(cuts, key=lambda k: cuts[k]["silhouette"])]
+        performance["selected_n_clusters"] = selected[0]
+        logger.info("Selected n_clusters=%d (silhouette %.4f)", selected[0], cuts[selected[0]]["silhouette"])
+    else:
+        selected = list(cuts)
+    if blocking and blocking_ari:
+        sim_matrix = smiles_similarity_matrix(dedup["unique"], sim_type.lower(), fp_size=fp_size,
+                                              store_dir=fp_store_dir)
+        unblocked_tree = linkage_square(1 - sim_matrix, "average")
+
     base_name = os.path.splitext(os.path.basename(smiles_file))[0]
     results_dir = os.path.join("output", "clustering_results", "hac", "smiles", f"{base_name}_fp{fp_size}")
     os.makedirs(results_dir, exist_ok=True)
-    output_file = os.path.join(results_dir, f"{base_name}_hac_{k_clusters}_{hash_val}.json")
-    
-    write_json_results(params, performance, results, output_file)
-    logger.info("HAC clustering pipeline for SMILES completed. Results saved in %s", output_file)
-    return output_file
+    output_files = []
+    for k in selected:
+        labels = expand_labels(cuts[k]["labels"], dedup["inverse"])
+        cut_performance = dict(performance, n_clusters=k, cut_height=cuts[k]["height"],
+                               cut_seconds=cuts[k]["seconds"])
+        if blocking and blocking_ari and "blocking" in performance:
+            unblocked = expand_labels(cut_linkage(unblocked_tree, k), dedup["inverse"])
+            cut_performance["blocking"] = dict(performance["blocking"],
+                                               ari_vs_unblocked=ARI(unblocked.tolist(), labels.tolist()))
+            logger.info("ARI between blocked and unblocked HAC (k=%d): %.4f", k,
+                        cut_performance["blocking"]["ari_vs_unblocked"])
+
+        # 5. Résultats (ID = index de ligne), paramètres, hash et sauvegarde
+        results = [{"id": i, "cluster": int(labels[i])} for i in range(len(smiles_list))]
+        params = {
+            "smiles_file": smiles_file,
+            "fp_size": fp_size,
+            "k_clusters": k,
+            "sim_type": sim_type,
+            "blocking": blocking,
+            "link_cutoff": link_cutoff if blocking else None,
+            "hac_engine": hac_engine,
+            "condensed_dtype": condensed_dtype if hac_engine == "nn_chain" else None,
+            "auto_k_candidates": cluster_counts if auto_k else None
+        }
+        hash_val = generate_hash(params)
+        output_file = os.path.join(results_dir, f"{base_name}_hac_{k}_{hash_val}.json")
+        write_json_results(params, cut_performance, results, output_file)
+        logger.info("HAC clustering pipeline for SMILES completed (k=%d). Results saved in %s", k, output_file)
+        output_files.append(output_file)
+    return output_files
 
 if __name__ == "__main__":
     import sys
@@ -96,6 +228,6 @@ if __name__ == "__main__":
         sys.exit(1)
     smiles_file = sys.argv[1]
     fp_size = int(sys.argv[2])
-    k_clusters = int(sys.argv[3])
+    k_clusters = sys.argv[3]
     sim_type = sys.argv[4] if len(sys.argv) > 4 else "jaccard"
     run_hac_pipeline_smiles(smiles_file, fp_size, k_clusters, sim_type=sim_type)
@@ -5,156 +5,213 @@ import json
 import hashlib
 from datetime import datetime
 import numpy as np
+import config
+from scipy import sparse
 from scipy.spatial.distance import pdist, squareform
-from clustering_utilis.hdbscan import apply_hdbscan
+from clustering_utilis.hdbscan import hdbscan_linkage_tree, hdbscan_labels, sweep_min_cluster_sizes
+from clustering_utilis.hac import parse_cluster_counts
 from clustering_utilis.common import generate_hash, write_json_results
 from utils.file_utils import read_smiles_file
-from smiles.similarity.matrix import generate_similarity_matrix
-from smiles.similarity.representations import morgan_fingerprint
-from smiles.similarity.metrics import similarity_cosinus, similarity_jaccard
+from smiles.similarity.matrix import smiles_similarity_matrix, smiles_knn_graph, smiles_blocked_graph, SMILES_SIM_TYPES
+from cluster_comparison.scores import ARI
+from smiles.similarity.dedup import deduplicate_smiles, expand_labels
+from smiles.similarity.lingo import measure_lingo_speedup
 
 logger = logging.getLogger(__name__)
 
-def remove_duplicate_smiles(smiles):
+def _noise_to_singletons(labels: list, max_label: int) -> list:
     """
-    Élimine les doublons d'une liste de SMILES et construit un mapping qui associe chaque
-    SMILES unique à la liste de ses indices dans la liste originale.
-    
-    Retourne:
-      - unique_smiles: list of str
-      - mapping: dict, clé = SMILES, valeur = liste d'indices
-    """
-    mapping = {}
-    for i, smile in enumerate(smiles):
-        if smile not in mapping:
-            mapping[smile] = []
-        mapping[smile].append(i)
-    unique_smiles = list(mapping.keys())
-    return unique_smiles, mapping
-
-def map_labels(mapping, unique_labels, total):
-    """
-    Affecte à chaque SMILES de la liste originale le label correspondant,
-    en se basant sur le mapping des SMILES uniques.
-    Retourne:
-      - list of int: liste des labels assignés, dans l'ordre de l'ensemble original.
+    Attribue à chaque élément resté en bruit (-1) un cluster singleton, numéroté à partir de max_label + 1.
     """
-    res = [None] * total
-    for idx, smile in enumerate(mapping.keys()):
-        label = unique_labels[idx]
-        for i in mapping[smile]:
-            res[i] = label
-    return res
+    labels = list(labels)
+    current_cluster_id = max_label + 1
+    for idx, label in enumerate(labels):
+        if label == -1:
+            labels[idx] = current_cluster_id
+            current_cluster_id += 1
+    return labels
 
 def run_hdbscan_pipeline_smiles(smiles_file: str,
                                 fp_size: int = 2048,
-                                min_cluster_size: int = 4,
-                                min_samples: int = 1,
-                                sim_type: str = "jaccard") -> str:
+                                min_cluster_size=4,
+                                min_samples=1,
+                                sim_type: str = "jaccard",
+                                knn: int = 0,
+                                blocking: str = None,
+                                link_cutoff: float = 0.5,
+                                blocking_ari: bool = False,
+                                fp_store_dir: str = config.DEFAULT_FINGERPRINT_STORE_DIR,
+                                measure_speedup: bool = False):
     """
     Exécute le pipeline de clustering HDBSCAN sur un fichier de SMILES.
     
     Étapes :
-      1. Lit le fichier de SMILES et élimine les doublons pour obtenir une liste unique et un mapping.
-      2. Crée un fichier temporaire contenant uniquement les SMILES uniques.
-      3. Utilise la fonction generate_similarity_matrix sur ce fichier pour générer la matrice de similarité.
-      4. Convertit la matrice de similarité en matrice de distance : distance = 1 - similarité.
-      5. Applique HDBSCAN sur la matrice de distance pour obtenir les labels pour les SMILES uniques.
-      6. Réaffecte ces labels aux SMILES originaux via le mapping.
-      7. Génère un hash à partir des paramètres et sauvegarde les résultats dans un fichier JSON dans :
+      1. Lit le fichier de SMILES et regroupe les écritures d'une même molécule (SMILES canonique,
+         voir dedup.deduplicate_smiles ; chaînes identiques pour "lingo", sans RDKit).
+      2. Génère la matrice de similarité des molécules uniques (smiles_similarity_matrix) : à partir des
+         fingerprints Morgan compactés pour "jaccard" et "cosinus", de la LCS des SMILES pour "cls",
+         ou des comptes de trigrammes (lingos) des SMILES pour "lingo".
+      3. Convertit la matrice de similarité en matrice de distance : distance = 1 - similarité.
+         Avec knn > 0, les étapes 2-3 sont remplacées par un graphe creux des distances de chaque
+         molécule vers ses knn plus proches voisins (smiles_knn_graph), sans matrice n x n ; knn est
+         porté au moins à min_samples pour que les distances de cœur restent exactes.
+         Avec blocking ("scaffold" ou "generic"), seules les distances entre molécules de même squelette
+         de Bemis-Murcko (et entre blocs dont les fingerprints résumés atteignent link_cutoff) sont
+         calculées (smiles_blocked_graph), les autres valant 1 ; blocking_ari compare le résultat
+         à celui obtenu sans blocage (ARI).
+      4. Construit, pour chaque valeur de min_samples, l'arbre de fusion de HDBSCAN sur ces distances
+         (distances de cœur et arbre couvrant de portée mutuelle), qui ne dépend pas de min_cluster_size.
+      5. Extrait de cet arbre les labels des molécules uniques pour chaque min_cluster_size (HDBSCAN n'accepte
+         pas de poids : chaque molécule compte une fois), puis les réaffecte à chaque ligne du fichier.
+      6. Attribue à chaque ligne restée en bruit un cluster singleton.
+      7. Pour chaque combinaison, génère un hash à partir des paramètres et sauvegarde les résultats
+         dans un fichier JSON dans :
          output/clustering_results/hdbscan/smiles/<base_name>_fp<fp_size>/
          Le nom du fichier final inclut min_cluster_size et le hash.
+      8. Avec plusieurs combinaisons, sauvegarde dans le même dossier un résumé du balayage
+         "<base_name>_hdbscan_sweep_<hash>.json" (une ligne par combinaison).
     
     Paramètres:
       - smiles_file : str   : Chemin du fichier de SMILES (un SMILES par ligne).
       - fp_size     : int   : Taille du fingerprint Morgan (défaut : 2048).
-      - min_cluster_size : int : Taille minimale d'un cluster pour HDBSCAN.
-      - min_samples : int   : Nombre minimum d'échantillons pour HDBSCAN (défaut : 1).
-      - sim_type    : str   : Type de similarité à utiliser ("cosinus" ou "jaccard", défaut : "jaccard").
+      - min_cluster_size : int ou str : Taille minimale d'un cluster pour HDBSCAN ; liste ou plage pour un
+                              balayage ("5,10,20", "2-30:2", voir parse_cluster_counts).
+      - min_samples : int ou str : Nombre minimum d'échantillons pour HDBSCAN (défaut : 1, même syntaxe).
+      - sim_type    : str   : Type de similarité à utiliser ("cosinus", "jaccard", "cls" ou "lingo", défaut : "jaccard").
+      - knn         : int   : Nombre de plus proches voisins du graphe creux (défaut : 0, matrice dense ;
+                              "cls" n'est disponible qu'en matrice dense).
+      - blocking    : str   : Blocage par squelette ("scaffold", "generic" ou None, défaut : None ; exclusif avec knn).
+      - link_cutoff : float : Similarité des fingerprints résumés au-delà de laquelle deux blocs sont comparés.
+      - blocking_ari: bool  : Calcule aussi le résultat sans blocage et enregistre l'ARI (défaut : False).
+      - fp_store_dir: str   : Store persistant des fingerprints (None : tout recalculer).
+      - measure_speedup: bool : Avec "lingo", mesure le temps de la matrice Lingo face à celui de la matrice
+                              Morgan/Tanimoto et l'enregistre dans le bloc performance ("lingo_speedup").
     
     Retourne:
-      - output_file : str  : Chemin complet du fichier JSON contenant les résultats.
+      - output_files : list : Chemins complets des fichiers JSON de résultats, un par combinaison.
     
     Remarque : Les IDs dans les résultats correspondent aux indices originaux dans le fichier (commençant à 0).
     """
-    # 1. Lire le fichier de SMILES
+    if sim_type.lower() not in SMILES_SIM_TYPES:
+        raise ValueError(f"sim_type must be one of {', '.join(SMILES_SIM_TYPES)}")
+    
+    # 1. Lire le fichier de SMILES et dédupliquer par SMILES canonique
     original_smiles = read_smiles_file(smiles_file)
     total = len(original_smiles)
-    unique_smiles, mapping = remove_duplicate_smiles(original_smiles)
-    logger.info("Found %d unique SMILES out of %d", len(unique_smiles), total)
-    
-    # 2. Écrire les SMILES uniques dans un fichier temporaire
+    dedup = deduplicate_smiles(original_smiles, canonical=sim_type.lower() != "lingo")
     base_name = os.path.splitext(os.path.basename(smiles_file))[0]
-    temp_dir = os.path.join("output", "tmp", "unique_smiles")
-    os.makedirs(temp_dir, exist_ok=True)
-    unique_file = os.path.join(temp_dir, f"{base_name}_unique.smiles")
-    with open(unique_file, "w") as f:
-        for smile in unique_smiles:
-            f.write(smile + "\n")
-    
-    # 3. Choix de la fonction de similarité
-    if sim_type.lower() == "cosinus":
-        similarity_fn = similarity_cosinus
-    elif sim_type.lower() == "jaccard":
-        similarity_fn = similarity_jaccard
+    if blocking and knn > 0:
+        raise ValueError("blocking and knn cannot be combined")
+    performance = {"unique_molecules": len(dedup["unique"]), "invalid_smiles": dedup["invalid"]}
+    if measure_speedup and sim_type.lower() == "lingo":
+        performance["lingo_speedup"] = measure_lingo_speedup(dedup["unique"], fp_size=fp_size)
+    min_cluster_sizes = parse_cluster_counts(min_cluster_size, "min_cluster_size")
+    min_samples_values = parse_cluster_counts(min_samples, "min_samples")
+    
+    if blocking:
+        # 2-3. Distances exactes à l'intérieur des blocs de squelettes (structure creuse)
+        distances, performance["blocking"] = smiles_blocked_graph(dedup["unique"], blocking, sim_type.lower(),
+                                                                  link_cutoff=link_cutoff, fp_size=fp_size,
+                                                                  store_dir=fp_store_dir)
+    elif knn > 0:
+        # 2-3. Graphes creux des k plus proches voisins, construits à la demande (un par valeur de k)
+        graphs = {}
     else:
-        raise ValueError("sim_type must be either 'cosinus' or 'jaccard'")
-    
-    # Transformation : morgan_fingerprint avec fp_size
-    transform = lambda s: morgan_fingerprint(s, fp_size=fp_size)
-    
-    # 4. Générer la matrice de similarité à partir du fichier unique
-    sim_matrix = generate_similarity_matrix(unique_file, transform, similarity_fn)
-    logger.info("Similarity matrix generated with shape: %s", sim_matrix.shape)
-    
-    # 5. Conversion en matrice de distance
-    distance_matrix = 1 - sim_matrix
-    
-    # 6. Appliquer HDBSCAN sur la matrice de distance pour les SMILES uniques
-    labels_unique, max_label = apply_hdbscan(distance_matrix, min_cluster_size, min_samples)
-    
-    # 7. Réaffecter les labels aux SMILES originaux via le mapping
-    mapped_labels = map_labels(mapping, labels_unique, total)
-    
-    # === Intégration de la logique d'attribution des bruits à des clusters uniques ===
-    # Initialiser l'ID du nouveau cluster à partir de max_label + 1
-    current_cluster_id = max_label + 1
-    for idx, label in enumerate(mapped_labels):
-        if label == -1:
-            mapped_labels[idx] = current_cluster_id
-            current_cluster_id += 1
-    # =================================================================================
+        # 2. Générer la matrice de similarité des molécules uniques
+        sim_matrix = smiles_similarity_matrix(dedup["unique"], sim_type.lower(), fp_size=fp_size,
+                                              store_dir=fp_store_dir)
+        logger.info("Similarity matrix generated with shape: %s", sim_matrix.shape)
+        
+        # 3. Conversion en matrice de distance
+        distances = 1 - sim_matrix
+    if blocking and blocking_ari:
+        sim_matrix = smiles_similarity_matrix(dedup["unique"], sim_type.lower(), fp_size=fp_size,
+                                              store_dir=fp_store_dir)
+        # Même chemin creux que le résultat bloqué, pour que l'ARI ne mesure que l'effet du blocage
+        full_graph = sparse.csr_matrix(np.maximum(1 - sim_matrix, np.finfo(np.float32).eps))
 
-    # 8. Préparer les résultats (IDs = indices originaux, commençant à 0)
-    results = [{"id": i, "cluster": int(mapped_labels[i])} for i in range(total)]
+    def build_tree(samples):
+        # 4. Arbre de fusion de HDBSCAN (distances de cœur et arbre couvrant), qui ne dépend que de min_samples
+        if knn > 0:
+            k = max(knn, samples)
+            if k not in graphs:
+                graphs[k] = smiles_knn_graph(dedup["unique"], k, sim_type.lower(), fp_size=fp_size,
+                                             store_dir=fp_store_dir)
+                logger.info("kNN distance graph generated: %d molecules, %d edges (k=%d)", graphs[k].shape[0],
+                            graphs[k].nnz // 2, k)
+            return hdbscan_linkage_tree(graphs[k], samples)
+        return hdbscan_linkage_tree(distances, samples)
     
     params = {
         "smiles_file": smiles_file,
         "fp_size": fp_size,
         "min_cluster_size": min_cluster_size,
         "min_samples": min_samples,
-        "sim_type": sim_type
+        "sim_type": sim_type,
+        "knn": knn,
+        "blocking": blocking,
+        "link_cutoff": link_cutoff if blocking else None
     }
-    performance = {"max_label": max_label}
-    
-    hash_val = generate_hash(params)
     results_dir = os.path.join("output", "clustering_results", "hdbscan", "smiles", f"{base_name}_fp{fp_size}")
     os.makedirs(results_dir, exist_ok=True)
-    output_file = os.path.join(results_dir, f"{base_name}_hdbscan_{min_cluster_size}_{hash_val}.json")
-    
-    write_json_results(params, performance, results, output_file)
-    logger.info("HDBSCAN clustering pipeline for SMILES completed. Results saved in %s", output_file)
-    return output_file
+    output_files = []
+    summary = []
+    for samples in min_samples_values:
+        start = time.time()
+        tree = build_tree(samples)
+        tree_seconds = time.time() - start
+        logger.info("HDBSCAN tree built for min_samples=%d in %.2f s", samples, tree_seconds)
+        unblocked_tree = hdbscan_linkage_tree(full_graph, samples) if blocking and blocking_ari else None
+        # 5. Clusterings de chaque min_cluster_size, extraits du même arbre (HDBSCAN n'accepte pas de poids :
+        #    chaque molécule unique compte une fois), réaffectés à chaque ligne du fichier
+        for size, extraction in sweep_min_cluster_sizes(tree, min_cluster_sizes).items():
+            max_label = extraction["max_label"]
+            # 6. Les bruits deviennent des clusters singletons
+            # (les SMILES invalides, exclus du clustering, sont traités comme du bruit)
+            expanded = expand_labels(extraction["labels"], dedup["inverse"], invalid_label=-1)
+            mapped_labels = _noise_to_singletons(expanded.tolist(), max_label)
+            combination_performance = dict(performance, max_label=max_label, tree_seconds=tree_seconds,
+                                           extract_seconds=extraction["seconds"])
+            if unblocked_tree is not None:
+                unblocked, unblocked_max = hdbscan_labels(unblocked_tree, size)
+                unblocked = _noise_to_singletons(expand_labels(unblocked, dedup["inverse"], invalid_label=-1).tolist(),
+                                                 unblocked_max)
+                combination_performance["blocking"] = dict(performance["blocking"],
+                                                           ari_vs_unblocked=ARI(unblocked, mapped_labels))
+                logger.info("ARI between blocked and unblocked HDBSCAN (min_cluster_size=%d, min_samples=%d): %.4f",
+                            size, samples, combination_performance["blocking"]["ari_vs_unblocked"])
+            
+            # 7. Préparer les résultats (IDs = indices originaux, commençant à 0) et sauvegarder
+            results = [{"id": i, "cluster": int(mapped_labels[i])} for i in range(total)]
+            combination = dict(params, min_cluster_size=size, min_samples=samples)
+            hash_val = generate_hash(combination)
+            output_file = os.path.join(results_dir, f"{base_name}_hdbscan_{size}_{hash_val}.json")
+            write_json_results(combination, combination_performance, results, output_file)
+            logger.info("HDBSCAN clustering pipeline for SMILES completed (min_cluster_size=%d, min_samples=%d). "
+                        "Results saved in %s", size, samples, output_file)
+            output_files.append(output_file)
+            summary.append({"min_cluster_size": size, "min_samples": samples, "clusters": max_label + 1,
+                            "noise": extraction["noise"], "tree_seconds": tree_seconds,
+                            "extract_seconds": extraction["seconds"], "output_file": output_file})
+    
+    if len(output_files) > 1:
+        # 8. Résumé du balayage : une ligne par combinaison
+        params["min_cluster_size"], params["min_samples"] = min_cluster_sizes, min_samples_values
+        summary_file = os.path.join(results_dir, f"{base_name}_hdbscan_sweep_{generate_hash(params)}.json")
+        write_json_results(params, dict(performance, combinations=len(summary)), summary, summary_file)
+        logger.info("HDBSCAN sweep summary (%d combinations) saved in %s", len(summary), summary_file)
+    return output_files
 
 if __name__ == "__main__":
     import sys
     logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
     if len(sys.argv) < 4:
-        print("Usage: hdbscan_smiles.py <smiles_file> <fp_size> <min_cluster_size> [min_samples] [sim_type]")
+        print("Usage: hdbscan_smiles.py <smiles_file> <fp_size> <min_cluster_size> [min_samples] [sim_type] [knn]")
         sys.exit(1)
     smiles_file = sys.argv[1]
     fp_size = int(sys.argv[2])
-    min_cluster_size = int(sys.argv[3])
-    min_samples = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    min_cluster_size = sys.argv[3]
+    min_samples = sys.argv[4] if len(sys.argv) > 4 else 1
     sim_type = sys.argv[5] if len(sys.argv) > 5 else "jaccard"
-    run_hdbscan_pipeline_smiles(smiles_file, fp_size, min_cluster_size, min_samples, sim_type=sim_type)
+    knn = int(sys.argv[6]) if len(sys.argv) > 6 else 0
+    run_hdbscan_pipeline_smiles(smiles_file, fp_size, min_cluster_size, min_samples, sim_type=sim_type, knn=knn)
@@ -1,40 +1,57 @@
 import os
 import numpy as np
+import config
 import logging
 import json
 import hashlib
 from datetime import datetime
 from utils.file_utils import read_smiles_file
-from smiles.similarity.matrix import generate_fingerprint_matrix
+from smiles.similarity.matrix import packed_fingerprints
+from smiles.similarity.dedup import deduplicate_smiles, expand_labels
+from utils.bitops import unpack_rows
 from clustering_utilis.kmeans import normalize_features, select_best_k, run_kmeans
+from clustering_utilis.kmodes import BINARY_ALGORITHMS, select_best_k_binary, run_binary_clustering
 from clustering_utilis.common import generate_hash, write_json_results
 
 logger = logging.getLogger(__name__)
 
-def load_feature_matrix(smiles_file: str, fp_size: int = 2048):
+def load_feature_matrix(smiles_file: str, fp_size: int = 2048, n_jobs: int = -1, fp_store_dir: str = None,
+                        unpack: bool = True):
     """
-    Lit un fichier contenant des SMILES (un par ligne) et génère la matrice de fingerprints.
+    Lit un fichier contenant des SMILES (un par ligne), regroupe les écritures d'une même molécule
+    (SMILES canonique, voir dedup.deduplicate_smiles) et génère la matrice de fingerprints des molécules
+    uniques (calculés en parallèle sur n_jobs processus, ou lus dans le store fp_store_dir s'il est renseigné).
     
     Retourne:
-      - X : matrice numpy de dimension (n_samples, fp_size)
+      - X : matrice numpy de dimension (n_unique, fp_size), ou les fingerprints compactés
+            (n_unique, fp_size / 8) en uint8 si unpack vaut False.
       - smiles_list : liste des SMILES lues du fichier.
+      - dedup : dict (unique, inverse, counts, invalid), voir dedup.deduplicate_smiles.
     """
     smiles_list = read_smiles_file(smiles_file)
-    X = generate_fingerprint_matrix(smiles_file, fp_size=fp_size)
+    dedup = deduplicate_smiles(smiles_list, n_jobs=n_jobs)
+    packed, _ = packed_fingerprints(dedup["unique"], fp_size=fp_size, n_jobs=n_jobs, store_dir=fp_store_dir)
+    X = unpack_rows(packed, fp_size) if unpack else packed
     logger.info("Fingerprint matrix shape: %s", X.shape)
-    return X, smiles_list
+    return X, smiles_list, dedup
 
 def run_clustering_pipeline(smiles_file: str, fp_size: int, k_min: int, k_max: int,
                             n_init: int = 10, random_state: int = 42, algorithm: str = 'mini',
-                            n_jobs: int = -1) -> str:
+                            n_jobs: int = -1, fp_store_dir: str = config.DEFAULT_FINGERPRINT_STORE_DIR) -> str:
     """
     Exécute le pipeline de clustering kmeans sur un fichier de SMILES.
     
     Étapes :
-      1. Lecture du fichier de SMILES et génération de la matrice de fingerprints via generate_fingerprint_matrix.
+      1. Lecture du fichier de SMILES, déduplication par SMILES canonique et génération de la matrice
+         de fingerprints des molécules uniques (les fingerprints déjà présents dans le store fp_store_dir
+         sont réutilisés ; None pour tout recalculer).
       2. Normalisation L2 de la matrice.
       3. Sélection du meilleur nombre de clusters (k) via le score de silhouette.
-      4. Exécution du clustering kmeans.
+         Avec algorithm "modes" ou "medoids", les étapes 2-4 travaillent directement sur les fingerprints
+         compactés en distance de Tanimoto (k-modes à centres par vote majoritaire ou k-médoïdes par
+         mini-lots, voir clustering_utilis.kmodes), la silhouette étant elle aussi en distance de Tanimoto.
+      4. Exécution du clustering kmeans, chaque molécule étant pondérée par son nombre d'occurrences
+         (le kmeans et la silhouette sont ceux du fichier complet), puis réaffectation des labels à chaque ligne.
       5. Génération d'un hash basé sur les paramètres.
       6. Sauvegarde des résultats dans un fichier JSON dans output/clustering_results/kmeans/smiles.
     
@@ -43,10 +60,21 @@ def run_clustering_pipeline(smiles_file: str, fp_size: int, k_min: int, k_max: i
     Retourne:
       - Le chemin complet du fichier JSON généré.
     """
-    X, smiles_list = load_feature_matrix(smiles_file, fp_size)
-    X_norm = normalize_features(X)
-    best_k, scores = select_best_k(X_norm, k_min, k_max, n_init, random_state, algorithm, n_jobs)
-    labels, centers, silhouette = run_kmeans(X_norm, best_k, n_init, random_state, algorithm)
+    binary = algorithm in BINARY_ALGORITHMS
+    X, smiles_list, dedup = load_feature_matrix(smiles_file, fp_size, n_jobs, fp_store_dir, unpack=not binary)
+    if binary:
+        best_k, scores = select_best_k_binary(X, k_min, k_max, n_init, random_state, algorithm, n_jobs,
+                                              sample_weight=dedup["counts"], n_bits=fp_size)
+        labels_unique, centers, silhouette = run_binary_clustering(X, best_k, n_init, random_state, algorithm,
+                                                                   sample_weight=dedup["counts"], n_bits=fp_size,
+                                                                   n_jobs=n_jobs)
+    else:
+        X_norm = normalize_features(X)
+        best_k, scores = select_best_k(X_norm, k_min, k_max, n_init, random_state, algorithm, n_jobs,
+                                       sample_weight=dedup["counts"])
+        labels_unique, centers, silhouette = run_kmeans(X_norm, best_k, n_init, random_state, algorithm,
+                                                        sample_weight=dedup["counts"])
+    labels = expand_labels(labels_unique, dedup["inverse"])
     
     # Pour chaque SMILES, l'ID est son index
     results = []
@@ -63,7 +91,10 @@ def run_clustering_pipeline(smiles_file: str, fp_size: int, k_min: int, k_max: i
         "random_state": random_state,
         "algorithm": algorithm
     }
-    performance = {"silhouette_score": silhouette, "scores": scores}
+    performance = {"silhouette_score": silhouette, "scores": scores,
+                   "unique_molecules": len(dedup["unique"]), "invalid_smiles": dedup["invalid"]}
+    if algorithm == "medoids":
+        performance["medoids"] = [dedup["unique"][i] for i in centers]
     
     hash_val = generate_hash(params)
     base_name = os.path.splitext(os.path.basename(smiles_file))[0]
@@ -0,0 +1,103 @@
+"""
+Déduplication des SMILES par molécule : les écritures différentes d'une même molécule
+(ex. "OCC" et "CCO") sont ramenées à leur SMILES canonique RDKit avant le clustering.
+
+Les pipelines ne traitent que les molécules uniques, avec leur multiplicité comme poids quand
+l'algorithme le permet, puis réaffectent les labels à chaque ligne du fichier (expand_labels).
+"""
+import logging
+import multiprocessing as mp
+import numpy as np
+from rdkit import Chem, RDLogger
+
+logger = logging.getLogger(__name__)
+
+def _init_canonical_worker():
+    RDLogger.DisableLog("rdApp.*")
+
+def _canonical_chunk(smiles: list) -> list:
+    canonical = []
+    for smile in smiles:
+        mol = Chem.MolFromSmiles(smile)
+        canonical.append(Chem.MolToSmiles(mol) if mol is not None else None)
+    return canonical
+
+def canonicalize_smiles(smiles: list, n_jobs: int = -1, chunk_size: int = 1024) -> list:
+    """
+    Retourne le SMILES canonique RDKit de chaque SMILES (None si le SMILES est invalide).
+
+    Chaque écriture distincte n'est canonisée qu'une fois ; les paquets de chunk_size SMILES
+    sont répartis sur n_jobs processus.
+    """
+    distinct = list(dict.fromkeys(smiles))
+    chunks = [distinct[start:start + chunk_size] for start in range(0, len(distinct), chunk_size)]
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = mp.cpu_count()
+    if n_jobs == 1 or len(chunks) <= 1:
+        results = map(_canonical_chunk, chunks)
+    else:
+        with mp.Pool(processes=min(n_jobs, len(chunks)), initializer=_init_canonical_worker) as pool:
+            results = pool.map(_canonical_chunk, chunks)
+    lookup = {}
+    for chunk, canonical in zip(chunks, results):
+        lookup.update(zip(chunk, canonical))
+    return [lookup[smile] for smile in smiles]
+
+def deduplicate_smiles(smiles: list, n_jobs: int = -1, canonical: bool = True) -> dict:
+    """
+    Regroupe les SMILES décrivant la même molécule (même SMILES canonique).
+
+    Les SMILES invalides ne peuvent pas être canonisés ni comparés : ils sont exclus des molécules
+    uniques (indice -1 dans inverse) et reçoivent chacun un cluster singleton dans expand_labels.
+    Avec canonical=False, seules les chaînes identiques sont regroupées, sans RDKit (similarités
+    calculées sur les chaînes, ex. "lingo") : aucun SMILES n'est alors invalide.
+
+    Arguments:
+      - smiles : list, SMILES dans l'ordre du fichier.
+      - n_jobs : int, nombre de processus pour la canonisation (défaut -1 : tous les cœurs).
+      - canonical : bool, regroupe par SMILES canonique RDKit (défaut) ou par chaîne identique.
+
+    Retourne:
+      - dict:
+          unique : liste des SMILES uniques (canoniques, ou d'origine si canonical=False),
+                   dans l'ordre de première apparition.
+          inverse : np.ndarray (n,), indice dans unique de chaque SMILES d'origine (-1 si invalide).
+          counts : np.ndarray (n_unique,), multiplicité de chaque SMILES unique.
+          invalid : liste de {"index", "smiles"} des SMILES invalides (indices d'origine).
+    """
+    keys = canonicalize_smiles(smiles, n_jobs=n_jobs) if canonical else smiles
+    position, unique, inverse, invalid = {}, [], np.empty(len(smiles), dtype=np.int64), []
+    for i, (smile, canon) in enumerate(zip(smiles, keys)):
+        if canon is None:
+            invalid.append({"index": i, "smiles": smile})
+            inverse[i] = -1
+            continue
+        if canon not in position:
+            position[canon] = len(unique)
+            unique.append(canon)
+        inverse[i] = position[canon]
+    counts = np.bincount(inverse[inverse >= 0], minlength=len(unique))
+    if invalid:
+        logger.warning("%d invalid SMILES could not be canonicalized: %s", len(invalid),
+                       ", ".join(f"{item['index']}:{item['smiles']}" for item in invalid[:20])
+                       + (" ..." if len(invalid) > 20 else ""))
+    logger.info("Found %d unique molecules out of %d SMILES", len(unique), len(smiles))
+    return {"unique": unique, "inverse": inverse, "counts": counts, "invalid": invalid}
+
+def expand_labels(labels, inverse: np.ndarray, invalid_label: int = None) -> np.ndarray:
+    """
+    Réaffecte à chaque SMILES d'origine le label de sa molécule unique.
+
+    Les SMILES invalides (indice -1 dans inverse) reçoivent chacun un cluster singleton, numéroté après
+    le plus grand label, ou invalid_label s'il est renseigné (ex. -1, le bruit de HDBSCAN).
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    valid = inverse >= 0
+    expanded = np.empty(len(inverse), dtype=np.int64)
+    expanded[valid] = labels[inverse[valid]]
+    if invalid_label is not None:
+        expanded[~valid] = invalid_label
+    else:
+        first = int(labels.max()) + 1 if labels.size else 0
+        expanded[~valid] = first + np.arange(np.count_nonzero(~valid))
+    return expanded
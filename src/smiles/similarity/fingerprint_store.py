@@ -0,0 +1,295 @@
+"""
+Stockage persistant des fingerprints Morgan compactés, partagé entre adduits et exécutions.
+
+Pour chaque jeu de paramètres du générateur (rayon, taille), le dossier du store contient :
+  - morgan_r<rayon>_fp<taille>.bin   : tableau des fingerprints compactés, en ajout seul
+                                       (une ligne de ceil(taille / 8) octets par molécule), lu par memmap ;
+  - morgan_r<rayon>_fp<taille>.index : index en ajout seul, une ligne "clé<TAB>ligne" par entrée.
+    La clé est le SMILES canonique RDKit ; les SMILES tels qu'écrits dans les fichiers sont ajoutés
+    comme alias pour éviter de les re-canoniser. Les SMILES invalides sont indexés avec la ligne -1.
+
+Store non replié (open_unfolded_store), commun à toutes les tailles de fingerprint d'un même rayon :
+  - morgan_r<rayon>_unfolded.bin   : paires (identifiant d'environnement, compte) en uint32, en ajout seul ;
+  - morgan_r<rayon>_unfolded.rows  : (début, nombre de paires) en int64 de chaque molécule ;
+  - morgan_r<rayon>_unfolded.index : index au même format que ci-dessus.
+Lorsqu'il est activé (défaut), les fingerprints absents du store d'une taille donnée sont repliés à partir
+du store non replié : un balayage de fp_size ne parse chaque SMILES qu'une seule fois avec RDKit.
+
+Les écritures sont protégées par un verrou de fichier : plusieurs exécutions peuvent lire le store
+en même temps et n'ajoutent, chacune à leur tour, que les fingerprints manquants.
+"""
+import os
+import logging
+from contextlib import contextmanager
+import numpy as np
+from smiles.similarity.representations import (batch_packed_fingerprints, batch_unfolded_fingerprints, fold_packed,
+                                                log_invalid_smiles)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def _file_lock(lock_path: str):
+    """
+    Verrou exclusif sur un fichier, entre processus (fcntl sous Unix, msvcrt sous Windows).
+    """
+    with open(lock_path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def open_fingerprint_store(store_dir: str, fp_size: int = 2048, radius: int = 2, unfolded: bool = True) -> dict:
+    """
+    Ouvre (ou crée) le store de fingerprints pour ces paramètres du générateur Morgan.
+    Si unfolded vaut True, les fingerprints manquants sont repliés depuis le store non replié du même dossier.
+
+    Retourne:
+      - dict : état du store (chemins, taille des lignes, index chargé), à passer à get_fingerprints.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    prefix = os.path.join(store_dir, f"morgan_r{radius}_fp{fp_size}")
+    store = {
+        "bin_path": prefix + ".bin",
+        "index_path": prefix + ".index",
+        "lock_path": prefix + ".lock",
+        "fp_size": fp_size,
+        "radius": radius,
+        "row_bytes": (fp_size + 7) // 8,
+        "index": {},
+        "index_offset": 0,
+        "unfolded": open_unfolded_store(store_dir, radius) if unfolded else None,
+    }
+    _refresh_index(store)
+    return store
+
+def open_unfolded_store(store_dir: str, radius: int = 2) -> dict:
+    """
+    Ouvre (ou crée) le store des fingerprints Morgan non repliés de ce rayon.
+
+    Retourne:
+      - dict : état du store, à passer à get_unfolded_fingerprints.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    prefix = os.path.join(store_dir, f"morgan_r{radius}_unfolded")
+    store = {
+        "bin_path": prefix + ".bin",
+        "rows_path": prefix + ".rows",
+        "index_path": prefix + ".index",
+        "lock_path": prefix + ".lock",
+        "radius": radius,
+        "index": {},
+        "index_offset": 0,
+    }
+    _refresh_index(store)
+    return store
+
+def _refresh_index(store: dict):
+    """
+    Lit les entrées ajoutées à l'index depuis la dernière lecture (une dernière ligne incomplète est ignorée).
+    """
+    if not os.path.exists(store["index_path"]):
+        return
+    with open(store["index_path"], "rb") as f:
+        f.seek(store["index_offset"])
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].decode("utf-8").splitlines():
+        key, _, row = line.rpartition("\t")
+        if key:
+            store["index"][key] = int(row)
+            # La première clé d'une ligne est son SMILES canonique (écrite avant ses alias)
+            store.setdefault("row_keys", {}).setdefault(int(row), key)
+    store["index_offset"] += end
+
+def _read_rows(store: dict, rows: np.ndarray) -> np.ndarray:
+    packed = np.zeros((len(rows), store["row_bytes"]), dtype=np.uint8)
+    valid = rows >= 0
+    if np.any(valid):
+        n_rows = os.path.getsize(store["bin_path"]) // store["row_bytes"]
+        table = np.memmap(store["bin_path"], dtype=np.uint8, mode="r", shape=(n_rows, store["row_bytes"]))
+        packed[valid] = table[rows[valid]]
+        del table
+    return packed
+
+def _index_entries(index: dict, items: list, first_row: int):
+    """
+    Entrées d'index à ajouter pour des SMILES (SMILES, SMILES canonique ou None, indice calculé), avec une seule
+    nouvelle ligne par molécule absente de l'index. Retourne (indices calculés à écrire, lignes d'index).
+    """
+    new_rows, position, lines = [], {}, []
+    for smile, canon, k in items:
+        if canon is None:
+            row = -1
+        elif canon in index:
+            row = index[canon]
+        elif canon in position:
+            row = position[canon]
+        else:
+            row = position[canon] = first_row + len(new_rows)
+            new_rows.append(k)
+            lines.append(f"{canon}\t{row}\n")
+        if smile != canon and smile not in index:
+            lines.append(f"{smile}\t{row}\n")
+    return new_rows, lines
+
+def _append(store: dict, items: list, computed: np.ndarray):
+    """
+    Ajoute au store (sous verrou) les SMILES calculés, donnés comme (SMILES, SMILES canonique ou None,
+    indice de la ligne dans computed). Une molécule déjà présente, éventuellement ajoutée entre-temps
+    par une autre exécution, n'est pas dupliquée : seul l'alias est ajouté.
+    """
+    with _file_lock(store["lock_path"]):
+        _refresh_index(store)
+        size = os.path.getsize(store["bin_path"]) if os.path.exists(store["bin_path"]) else 0
+        # Une ligne partielle (écriture interrompue) est complétée pour garder l'alignement
+        first_row = -(-size // store["row_bytes"])
+        new_rows, lines = _index_entries(store["index"], items, first_row)
+        if not lines:
+            return
+        with open(store["bin_path"], "ab") as f:
+            f.write(b"\0" * (first_row * store["row_bytes"] - size))
+            f.write(np.ascontiguousarray(computed[new_rows]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # Les fingerprints sont écrits avant l'index : une entrée indexée pointe toujours vers une ligne complète
+        with open(store["index_path"], "ab") as f:
+            f.write("".join(lines).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        _refresh_index(store)
+
+def get_fingerprints(store: dict, smiles: list, n_jobs: int = -1, warn_invalid: bool = True):
+    """
+    Retourne les fingerprints compactés d'une liste de SMILES, en ne calculant que ceux absents du store.
+
+    Les SMILES sont d'abord recherchés tels quels (alias), puis les manquants sont calculés en lot
+    (voir representations.batch_packed_fingerprints) ; ceux dont le SMILES canonique est déjà connu
+    réutilisent la ligne existante. Les nouveaux fingerprints et alias sont ensuite ajoutés au store.
+    Les SMILES invalides sont signalés une fois (warn_invalid), avec leur indice dans smiles.
+
+    Retourne:
+      - tuple:
+          packed : np.ndarray (n, ceil(fp_size / 8)) en uint8, dans l'ordre des SMILES.
+          invalid : liste de {"index", "smiles"} des SMILES invalides (lignes nulles dans packed).
+    """
+    _refresh_index(store)
+    index = store["index"]
+    rows = np.array([index.get(smile, -2) for smile in smiles], dtype=np.int64)
+    hits = int(np.count_nonzero(rows != -2))
+    misses = sorted({smile for smile, row in zip(smiles, rows) if row == -2})
+    if misses and store.get("unfolded") is not None:
+        unfolded, _, canonical = get_unfolded_fingerprints(store["unfolded"], misses, n_jobs=n_jobs,
+                                                           return_canonical=True, warn_invalid=False)
+        computed = fold_packed(unfolded, store["fp_size"])
+    elif misses:
+        computed, _, canonical = batch_packed_fingerprints(misses, fp_size=store["fp_size"], radius=store["radius"],
+                                                           n_jobs=n_jobs, return_canonical=True, warn_invalid=False)
+    if misses:
+        _append(store, [(smile, canon, k) for k, (smile, canon) in enumerate(zip(misses, canonical))], computed)
+        rows = np.array([index.get(smile, -1) for smile in smiles], dtype=np.int64)
+    logger.info("Fingerprint store: %d/%d SMILES found, %d unique SMILES computed.", hits, len(smiles), len(misses))
+    invalid = [{"index": i, "smiles": smile} for i, (smile, row) in enumerate(zip(smiles, rows)) if row < 0]
+    if warn_invalid:
+        log_invalid_smiles(invalid)
+    return _read_rows(store, rows), invalid
+
+def _write_synced(path: str, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _append_unfolded(store: dict, items: list, unfolded: dict):
+    """
+    Ajoute au store non replié (sous verrou) les SMILES calculés, comme _append.
+    """
+    with _file_lock(store["lock_path"]):
+        _refresh_index(store)
+        rows_size = os.path.getsize(store["rows_path"]) if os.path.exists(store["rows_path"]) else 0
+        bin_size = os.path.getsize(store["bin_path"]) if os.path.exists(store["bin_path"]) else 0
+        first_row = -(-rows_size // 16)
+        new_rows, lines = _index_entries(store["index"], items, first_row)
+        if not lines:
+            return
+        indptr = unfolded["indptr"]
+        lengths = np.array([indptr[k + 1] - indptr[k] for k in new_rows], dtype=np.int64)
+        first_pair = -(-bin_size // 8)
+        starts = first_pair + np.cumsum(lengths) - lengths
+        pairs = [np.column_stack([unfolded["ids"][indptr[k]:indptr[k + 1]],
+                                  unfolded["counts"][indptr[k]:indptr[k + 1]]]) for k in new_rows]
+        pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.uint32)
+        # Paires, puis table des lignes, puis index : une entrée indexée pointe toujours vers des données complètes
+        _write_synced(store["bin_path"], b"\0" * (first_pair * 8 - bin_size) + pairs.astype(np.uint32).tobytes())
+        _write_synced(store["rows_path"], b"\0" * (first_row * 16 - rows_size)
+                      + np.column_stack([starts, lengths]).astype(np.int64).tobytes())
+        _write_synced(store["index_path"], "".join(lines).encode("utf-8"))
+        _refresh_index(store)
+
+def _read_unfolded(store: dict, rows: np.ndarray) -> dict:
+    lengths = np.zeros(len(rows), dtype=np.int64)
+    starts = np.zeros(len(rows), dtype=np.int64)
+    valid = rows >= 0
+    if np.any(valid):
+        n_rows = os.path.getsize(store["rows_path"]) // 16
+        table = np.memmap(store["rows_path"], dtype=np.int64, mode="r", shape=(n_rows, 2))
+        starts[valid], lengths[valid] = table[rows[valid], 0], table[rows[valid], 1]
+        del table
+    indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    positions = np.arange(indptr[-1]) - np.repeat(indptr[:-1], lengths) + np.repeat(starts, lengths)
+    pairs = np.zeros((0, 2), dtype=np.uint32)
+    if len(positions):
+        n_pairs = os.path.getsize(store["bin_path"]) // 8
+        table = np.memmap(store["bin_path"], dtype=np.uint32, mode="r", shape=(n_pairs, 2))
+        pairs = np.array(table[positions])
+        del table
+    return {"indptr": indptr, "ids": pairs[:, 0].copy(), "counts": pairs[:, 1].copy()}
+
+def get_unfolded_fingerprints(store: dict, smiles: list, n_jobs: int = -1, return_canonical: bool = False,
+                              warn_invalid: bool = True):
+    """
+    Retourne les fingerprints non repliés d'une liste de SMILES (format de
+    representations.batch_unfolded_fingerprints), en ne calculant que ceux absents du store.
+    Les SMILES invalides sont signalés une fois (warn_invalid), avec leur indice dans smiles.
+
+    Retourne:
+      - tuple:
+          unfolded : dict "indptr", "ids", "counts", dans l'ordre des SMILES.
+          invalid : liste de {"index", "smiles"} des SMILES invalides (lignes vides).
+          canonical : liste des SMILES canoniques, None si invalide (uniquement si return_canonical).
+    """
+    _refresh_index(store)
+    index = store["index"]
+    rows = np.array([index.get(smile, -2) for smile in smiles], dtype=np.int64)
+    hits = int(np.count_nonzero(rows != -2))
+    misses = sorted({smile for smile, row in zip(smiles, rows) if row == -2})
+    if misses:
+        computed, _, canonical = batch_unfolded_fingerprints(misses, radius=store["radius"], n_jobs=n_jobs,
+                                                             return_canonical=True, warn_invalid=False)
+        _append_unfolded(store, [(smile, canon, k) for k, (smile, canon) in enumerate(zip(misses, canonical))],
+                         computed)
+        rows = np.array([index.get(smile, -1) for smile in smiles], dtype=np.int64)
+    logger.info("Unfolded fingerprint store: %d/%d SMILES found, %d unique SMILES computed.",
+                hits, len(smiles), len(misses))
+    invalid = [{"index": i, "smiles": smile} for i, (smile, row) in enumerate(zip(smiles, rows)) if row < 0]
+    if warn_invalid:
+        log_invalid_smiles(invalid)
+    unfolded = _read_unfolded(store, rows)
+    if return_canonical:
+        row_keys = store.get("row_keys", {})
+        return unfolded, invalid, [row_keys.get(int(row)) if row >= 0 else None for row in rows]
+    return unfolded, invalid
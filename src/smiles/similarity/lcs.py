@@ -0,0 +1,148 @@
+"""
+Longueur de la plus longue sous-séquence commune (LCS) entre SMILES, calculée en parallèle sur les bits.
+
+Algorithme bit-parallèle de Hyyrö : pour une chaîne requête de longueur m, chaque caractère c
+a un masque M[c] dont le bit p vaut 1 si requête[p] == c. Un vecteur V de m bits (initialement à 1)
+est mis à jour pour chaque caractère c de la cible :
+    U = V & M[c]
+    V = (V + U) | (V - U)
+et la LCS vaut le nombre de bits à 0 de V. Le coût est de len(cible) x ceil(m / 64) opérations
+sur des mots de 64 bits, au lieu de m x len(cible) cellules pour la programmation dynamique.
+
+Ici, une requête est comparée à toutes ses cibles à la fois : les SMILES sont encodés en tableau
+de codes de caractères, et les opérations sur V portent sur un vecteur numpy (un mot par cible).
+"""
+import numpy as np
+from joblib import Parallel, delayed
+from utils.bitops import popcount
+
+_WORD = 64
+
+def lcs_length(smile1: str, smile2: str) -> int:
+    """
+    LCS de deux chaînes par l'algorithme bit-parallèle (entiers Python de taille arbitraire).
+    """
+    m = len(smile1)
+    if m == 0 or not smile2:
+        return 0
+    masks = {}
+    for p, char in enumerate(smile1):
+        masks[char] = masks.get(char, 0) | (1 << p)
+    full = (1 << m) - 1
+    v = full
+    for char in smile2:
+        u = v & masks.get(char, 0)
+        v = ((v + u) | (v - u)) & full
+    return m - bin(v).count("1")
+
+def encode_smiles(smiles: list):
+    """
+    Encode des SMILES en codes de caractères (0 est réservé au remplissage, qui ne modifie pas V).
+
+    Retourne:
+      - tuple:
+          codes : np.ndarray (n, longueur max) en int32, complété par des 0.
+          lengths : np.ndarray (n,) des longueurs.
+          alphabet_size : int, nombre de codes (remplissage compris).
+    """
+    alphabet = {}
+    lengths = np.array([len(smile) for smile in smiles], dtype=np.int64)
+    codes = np.zeros((len(smiles), int(lengths.max()) if len(smiles) else 0), dtype=np.int32)
+    for i, smile in enumerate(smiles):
+        codes[i, :len(smile)] = [alphabet.setdefault(char, len(alphabet) + 1) for char in smile]
+    return codes, lengths, len(alphabet) + 1
+
+def _match_masks(query_codes: np.ndarray, alphabet_size: int) -> np.ndarray:
+    """
+    Masques de correspondance de la requête : tableau (alphabet_size, n_mots) en uint64.
+    """
+    m = len(query_codes)
+    masks = np.zeros((alphabet_size, max(1, -(-m // _WORD))), dtype=np.uint64)
+    positions = np.arange(m)
+    bits = np.left_shift(np.uint64(1), (positions % _WORD).astype(np.uint64))
+    np.bitwise_or.at(masks, (query_codes, positions // _WORD), bits)
+    return masks
+
+def query_lcs_lengths(query_codes: np.ndarray, codes: np.ndarray, alphabet_size: int) -> np.ndarray:
+    """
+    LCS d'une requête (codes sans remplissage) avec chaque ligne de codes, calculées ensemble.
+
+    Retourne:
+      - np.ndarray (len(codes),) en int64.
+    """
+    m = len(query_codes)
+    if m == 0 or codes.shape[1] == 0:
+        return np.zeros(len(codes), dtype=np.int64)
+    masks = _match_masks(query_codes, alphabet_size)
+    n_words = masks.shape[1]
+    full = np.full(n_words, np.iinfo(np.uint64).max, dtype=np.uint64)
+    if m % _WORD:
+        full[-1] = np.uint64((1 << (m % _WORD)) - 1)
+    v = np.repeat(full[:, None], len(codes), axis=1)
+    for t in range(codes.shape[1]):
+        u = masks[codes[:, t]].T & v
+        # U est inclus dans V : V - U = V ^ U, seule l'addition propage une retenue entre mots
+        diff = v ^ u
+        if n_words == 1:
+            v = (v + u) | diff
+        else:
+            total = np.empty_like(v)
+            carry = np.zeros(len(codes), dtype=np.uint64)
+            for w in range(n_words):
+                partial = v[w] + u[w]
+                total[w] = partial + carry
+                carry = ((partial < v[w]) | (total[w] < partial)).astype(np.uint64)
+            v = total | diff
+        v &= full[:, None]
+    return m - popcount(v).sum(axis=0, dtype=np.int64)
+
+def lcs_lengths(query: str, smiles: list) -> np.ndarray:
+    """
+    LCS d'un SMILES requête avec chacun des SMILES de la liste.
+    """
+    codes, lengths, alphabet_size = encode_smiles([query] + list(smiles))
+    return query_lcs_lengths(codes[0, :lengths[0]], codes[1:], alphabet_size)
+
+def _cls_rows(codes, lengths, alphabet_size, row_indices) -> list:
+    """
+    Similarités CLS des lignes demandées avec les colonnes j >= i (triangle supérieur).
+    """
+    rows = []
+    for i in row_indices:
+        targets = codes[i:, :int(lengths[i:].max())]
+        lcs = query_lcs_lengths(codes[i, :lengths[i]], targets, alphabet_size)
+        max_len = np.maximum(lengths[i], lengths[i:])
+        rows.append(np.where(max_len > 0, lcs / np.maximum(max_len, 1), 1.0))
+    return rows
+
+def cls_similarity_matrix(smiles: list, n_jobs: int = -1, block_size: int = 256) -> np.ndarray:
+    """
+    Matrice de similarité CLS : LCS / max(len(s1), len(s2)), soit 1 - metrics.CLS_distance.
+
+    Chaque ligne i est calculée d'un bloc (requête i contre les SMILES j >= i). Les blocs de block_size
+    lignes entrelacées sont répartis sur n_jobs processus (joblib).
+
+    Arguments:
+      - smiles : list, SMILES à comparer.
+      - n_jobs : int, nombre de processus (défaut -1 : tous les cœurs).
+      - block_size : int, nombre de lignes par bloc.
+
+    Retourne:
+      - np.ndarray : matrice de similarité (n, n).
+    """
+    n = len(smiles)
+    codes, lengths, alphabet_size = encode_smiles(smiles)
+    num_blocks = max(1, -(-n // block_size))
+    blocks = [range(k, n, num_blocks) for k in range(num_blocks)]
+    if n_jobs == 1 or num_blocks <= 1:
+        block_rows = [_cls_rows(codes, lengths, alphabet_size, block) for block in blocks]
+    else:
+        block_rows = Parallel(n_jobs=n_jobs)(
+            delayed(_cls_rows)(codes, lengths, alphabet_size, block) for block in blocks
+        )
+    sim_matrix = np.zeros((n, n))
+    for block, rows in zip(blocks, block_rows):
+        for i, row in zip(block, rows):
+            sim_matrix[i, i:] = row
+            sim_matrix[i:, i] = row
+    return sim_matrix
@@ -0,0 +1,156 @@
+"""
+Similarité Lingo : Tanimoto sur les comptes de n-grammes (lingos, voir representations.gen_lingos)
+des chaînes SMILES, sans passer par RDKit.
+
+    sim(a, b) = Σ_l min(Na_l, Nb_l) / Σ_l max(Na_l, Nb_l)
+
+Chaque SMILES devient un vecteur creux de comptes sur un vocabulaire commun. Pour obtenir les Σmin par
+produit de matrices creuses, chaque compte N_l est déplié en N_l colonnes binaires (l, 1), ..., (l, N_l) :
+le produit scalaire de deux lignes dépliées vaut alors Σ_l min(Na_l, Nb_l), et Σmax = Σa + Σb - Σmin.
+"""
+import time
+import logging
+import numpy as np
+from scipy import sparse
+from joblib import Parallel, delayed
+from smiles.similarity.representations import gen_lingos, batch_packed_fingerprints
+from smiles.similarity.packed import packed_similarity_matrix
+
+logger = logging.getLogger(__name__)
+
+def lingo_vectors(smiles: list, n: int = 3):
+    """
+    Convertit chaque SMILES en vecteur creux de comptes de lingos sur un vocabulaire partagé.
+    Une chaîne plus courte que n n'a aucun lingo : elle compte comme son propre et unique lingo,
+    ce qui lui donne une similarité de 1 avec une chaîne identique et de 0 avec toute autre.
+
+    Retourne:
+      - tuple:
+          counts : scipy.sparse.csr_matrix (n_smiles, taille du vocabulaire) en int32.
+          vocabulary : dict lingo -> indice de colonne.
+    """
+    vocabulary, indptr, indices = {}, [0], []
+    for smile in smiles:
+        lingos = gen_lingos(smile, n) if len(smile) >= n else [smile]
+        indices.extend(vocabulary.setdefault(lingo, len(vocabulary)) for lingo in lingos)
+        indptr.append(len(indices))
+    counts = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), np.array(indices, dtype=np.int64), indptr),
+                               shape=(len(smiles), len(vocabulary)))
+    counts.sum_duplicates()
+    return counts, vocabulary
+
+def _unfold_counts(counts: sparse.csr_matrix) -> sparse.csr_matrix:
+    """
+    Déplie les comptes en colonnes binaires (lingo, niveau) : la colonne l * max + t vaut 1 si N_l > t.
+    """
+    counts = counts.tocoo()
+    max_count = int(counts.data.max()) if counts.nnz else 1
+    repeats = counts.data.astype(np.int64)
+    rows = np.repeat(counts.row, repeats)
+    starts = np.repeat(np.cumsum(repeats) - repeats, repeats)
+    levels = np.arange(len(rows)) - starts
+    cols = np.repeat(counts.col.astype(np.int64), repeats) * max_count + levels
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                             shape=(counts.shape[0], counts.shape[1] * max_count))
+
+def prepare_lingo(smiles: list, n: int = 3):
+    """
+    Retourne la matrice dépliée et le nombre total de lingos de chaque SMILES, utilisés par les blocs.
+    """
+    counts, _ = lingo_vectors(smiles, n)
+    return _unfold_counts(counts), np.asarray(counts.sum(axis=1)).ravel().astype(np.float64)
+
+def lingo_block(unfolded, totals, rows: tuple, cols: tuple) -> np.ndarray:
+    """
+    Similarité Lingo (Tanimoto des comptes) entre les molécules rows[0]:rows[1] et cols[0]:cols[1].
+    """
+    common = (unfolded[rows[0]:rows[1]] @ unfolded[cols[0]:cols[1]].T).toarray()
+    union = totals[rows[0]:rows[1], None] + totals[None, cols[0]:cols[1]] - common
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, common / union, 0.0)
+
+def _lingo_tile(unfolded, totals, rows, cols):
+    return rows, cols, lingo_block(unfolded, totals, rows, cols)
+
+def lingo_similarity_matrix(smiles: list, n: int = 3, block_size: int = 1024, n_jobs: int = -1) -> np.ndarray:
+    """
+    Calcule la matrice de similarité Lingo d'une liste de SMILES.
+
+    Seuls les blocs du triangle supérieur sont calculés (produits de matrices creuses),
+    répartis sur n_jobs threads.
+
+    Arguments:
+      - smiles : list, SMILES à comparer.
+      - n : int, taille des lingos (défaut 3).
+      - block_size : int, nombre de molécules par bloc.
+      - n_jobs : int, nombre de threads (défaut -1 : tous les cœurs).
+
+    Retourne:
+      - np.ndarray : matrice de similarité (n_smiles, n_smiles).
+    """
+    unfolded, totals = prepare_lingo(smiles, n)
+    size = len(smiles)
+    bounds = [(start, min(start + block_size, size)) for start in range(0, size, block_size)]
+    tiles = [(bounds[bi], bounds[bj]) for bi in range(len(bounds)) for bj in range(bi, len(bounds))]
+    if n_jobs == 1 or len(tiles) <= 1:
+        results = [_lingo_tile(unfolded, totals, rows, cols) for rows, cols in tiles]
+    else:
+        results = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_lingo_tile)(unfolded, totals, rows, cols) for rows, cols in tiles
+        )
+    sim_matrix = np.zeros((size, size))
+    for (r0, r1), (c0, c1), block in results:
+        sim_matrix[r0:r1, c0:c1] = block
+        sim_matrix[c0:c1, r0:r1] = block.T
+    return sim_matrix
+
+def lingo_top_k(smiles: list, k: int = 10, threshold: float = 0.0, n: int = 3, block_size: int = 1024):
+    """
+    Retourne les k plus proches voisins Lingo de chaque SMILES (lui-même exclu) dont la similarité
+    atteint threshold, sans construire la matrice complète (mémoire en block_size x n_smiles).
+
+    Retourne:
+      - tuple:
+          neighbors : np.ndarray (n_smiles, k) en int64, indices des voisins par similarité
+                      décroissante, complété par -1.
+          similarities : np.ndarray (n_smiles, k), similarités correspondantes, complétées par 0.
+    """
+    unfolded, totals = prepare_lingo(smiles, n)
+    size = len(smiles)
+    k = min(k, max(size - 1, 0))
+    neighbors = np.full((size, k), -1, dtype=np.int64)
+    similarities = np.zeros((size, k))
+    if k == 0:
+        return neighbors, similarities
+    for start in range(0, size, block_size):
+        stop = min(start + block_size, size)
+        block = lingo_block(unfolded, totals, (start, stop), (0, size))
+        block[np.arange(stop - start), np.arange(start, stop)] = -1
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_sims, axis=1, kind="stable")
+        top, top_sims = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_sims, order, axis=1)
+        keep = top_sims >= threshold
+        neighbors[start:stop] = np.where(keep, top, -1)
+        similarities[start:stop] = np.where(keep, top_sims, 0.0)
+    return neighbors, similarities
+
+def measure_lingo_speedup(smiles: list, fp_size: int = 2048, n: int = 3, n_jobs: int = -1) -> dict:
+    """
+    Compare le temps de calcul de la matrice de similarité Lingo à celui de la similarité de Tanimoto
+    sur fingerprints Morgan compactés (calcul des fingerprints compris, sans store).
+
+    Retourne:
+      - dict : temps en secondes de chaque méthode et rapport morgan / lingo.
+    """
+    start = time.perf_counter()
+    packed, _ = batch_packed_fingerprints(smiles, fp_size=fp_size, n_jobs=n_jobs)
+    packed_similarity_matrix(packed, "jaccard", n_jobs=n_jobs)
+    morgan_time = time.perf_counter() - start
+    start = time.perf_counter()
+    lingo_similarity_matrix(smiles, n=n, n_jobs=n_jobs)
+    lingo_time = time.perf_counter() - start
+    info = {"n_smiles": len(smiles), "morgan_jaccard_time": morgan_time, "lingo_time": lingo_time,
+            "speedup": morgan_time / lingo_time if lingo_time > 0 else None}
+    logger.info("Lingo similarity: %.2fs vs Morgan/Jaccard: %.2fs on %d SMILES", lingo_time, morgan_time, len(smiles))
+    return info
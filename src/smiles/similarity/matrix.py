@@ -1,65 +1,126 @@
 import numpy as np
 from utils.file_utils import read_smiles_file
-from rdkit import DataStructs
-from smiles.similarity.representations import morgan_fingerprint
+from smiles.similarity.representations import batch_packed_fingerprints
+from smiles.similarity.fingerprint_store import open_fingerprint_store, get_fingerprints
+from smiles.similarity.packed import packed_similarity_matrix
+from smiles.similarity.lcs import cls_similarity_matrix
+from smiles.similarity.lingo import lingo_similarity_matrix, lingo_top_k
+from smiles.similarity.neighbors import packed_knn, knn_distance_graph
+from smiles.similarity.scaffold import (BLOCKING_MODES, compute_scaffolds, scaffold_blocks,
+                                         blocked_distance_graph)
+from utils.bitops import unpack_rows
 
-def generate_similarity_matrix(smiles_file: str, transform, similarity_fn) -> np.ndarray:
-    """
-    Lit un fichier contenant des SMILES (un SMILES par ligne) et génère la matrice de similarité.
-    
-    Arguments:
-      - smiles_file : str
-          Chemin vers le fichier texte contenant les SMILES.
-      - transform : function
-          Fonction qui transforme un SMILES en une représentation (ex: fingerprint, n‑grammes, etc.).
-          Si transform est None, la fonction de similarité sera appliquée directement sur les SMILES.
-      - similarity_fn : function
-          Fonction qui calcule la similarité entre deux représentations.
-    
-    Retourne:
-      - np.ndarray : La matrice de similarité (de dimension n x n, où n est le nombre de SMILES).
-    """
-    smiles = read_smiles_file(smiles_file)
-    n = len(smiles)
-    sim_matrix = np.zeros((n, n))
-    for i in range(n):
-        for j in range(i, n):
-            if transform is not None:
-                rep1 = transform(smiles[i])
-                rep2 = transform(smiles[j])
-                sim = similarity_fn(rep1, rep2)
-            else:
-                sim = similarity_fn(smiles[i], smiles[j])
-            sim_matrix[i, j] = sim
-            sim_matrix[j, i] = sim  # Assurer la symétrie
-    return sim_matrix
+# Types de similarité proposés par les pipelines SMILES (voir smiles_similarity_matrix)
+SMILES_SIM_TYPES = ("jaccard", "cosinus", "cls", "lingo")
 
-def generate_fingerprint_matrix(smiles_file: str, fp_size: int = 2048) -> np.ndarray:
+def generate_fingerprint_matrix(smiles_file: str, fp_size: int = 2048, n_jobs: int = -1,
+                                store_dir: str = None) -> np.ndarray:
     """
     Lit un fichier contenant des SMILES (un SMILES par ligne) et génère une matrice de fingerprints.
     
     Chaque SMILES est transformé en fingerprint (par défaut de taille fp_size via la méthode Morgan),
-    puis converti en un vecteur numpy binaire.
+    puis converti en un vecteur numpy binaire. Les fingerprints sont calculés en parallèle
+    (voir representations.batch_packed_fingerprints) ; un SMILES invalide donne une ligne nulle.
     
     Arguments:
       - smiles_file : str
           Chemin vers le fichier texte contenant les SMILES.
       - fp_size : int, optionnel
           Taille du fingerprint à générer (défaut 2048).
+      - n_jobs : int, optionnel
+          Nombre de processus pour le calcul des fingerprints (défaut -1 : tous les cœurs).
+      - store_dir : str, optionnel
+          Dossier du store de fingerprints persistant (voir fingerprint_store) ; None pour tout recalculer.
     
     Retourne:
-      - np.ndarray : Une matrice 2D de dimension (n_molecules, fp_size), 
+      - np.ndarray : Une matrice 2D de dimension (n_molecules, fp_size) en uint8,
                      où chaque ligne correspond au fingerprint binaire d’un SMILES.
     """
+    packed, _ = generate_packed_fingerprint_matrix(smiles_file, fp_size, n_jobs, store_dir)
+    return unpack_rows(packed, fp_size)
+
+def generate_packed_fingerprint_matrix(smiles_file: str, fp_size: int = 2048, n_jobs: int = -1,
+                                       store_dir: str = None):
+    """
+    Lit un fichier contenant des SMILES (un SMILES par ligne) et génère la matrice des fingerprints
+    Morgan compactés (8 bits par octet, 256 octets par molécule pour fp_size=2048).
+
+    Les similarités se calculent directement sur cette matrice (voir packed.packed_similarity_matrix).
+    Si store_dir est renseigné, les fingerprints sont lus dans le store persistant et seuls
+    les SMILES absents sont calculés (voir fingerprint_store.get_fingerprints).
+
+    Retourne:
+      - tuple:
+          packed : np.ndarray (n_molecules, ceil(fp_size / 8)) en uint8, dans l'ordre du fichier.
+          invalid : liste de {"index", "smiles"} des SMILES invalides (lignes nulles dans packed).
+    """
     smiles = read_smiles_file(smiles_file)
-    n = len(smiles)
-    fp_matrix = np.zeros((n, fp_size), dtype=int)
-    for i, smile in enumerate(smiles):
-        try:
-            fp = morgan_fingerprint(smile, fp_size)
-        except Exception as e:
-            raise ValueError(f"Erreur lors de la génération du fingerprint pour SMILES '{smile}': {e}")
-        arr = np.zeros((fp_size,), dtype=int)
-        DataStructs.ConvertToNumpyArray(fp, arr)
-        fp_matrix[i, :] = arr
-    return fp_matrix
+    return packed_fingerprints(smiles, fp_size, n_jobs, store_dir)
+
+def packed_fingerprints(smiles: list, fp_size: int = 2048, n_jobs: int = -1, store_dir: str = None):
+    """
+    Comme generate_packed_fingerprint_matrix, pour une liste de SMILES déjà lue
+    (ex. les molécules uniques retournées par dedup.deduplicate_smiles).
+    """
+    if store_dir is not None:
+        store = open_fingerprint_store(store_dir, fp_size=fp_size)
+        return get_fingerprints(store, smiles, n_jobs=n_jobs)
+    return batch_packed_fingerprints(smiles, fp_size=fp_size, n_jobs=n_jobs)
+
+def smiles_similarity_matrix(smiles: list, sim_type: str = "jaccard", fp_size: int = 2048, n_jobs: int = -1,
+                             store_dir: str = None) -> np.ndarray:
+    """
+    Matrice de similarité d'une liste de SMILES pour l'un des types de SMILES_SIM_TYPES :
+      - "jaccard" (Tanimoto) ou "cosinus" : sur les fingerprints Morgan compactés
+        (packed_fingerprints puis packed.packed_similarity_matrix) ;
+      - "cls" : plus longue sous-séquence commune des chaînes, normalisée par la plus longue
+        (lcs.cls_similarity_matrix), sans fingerprint ;
+      - "lingo" : Tanimoto des comptes de trigrammes des SMILES (lingo.lingo_similarity_matrix), sans RDKit.
+
+    Retourne:
+      - np.ndarray : matrice de similarité (n, n).
+    """
+    if sim_type not in SMILES_SIM_TYPES:
+        raise ValueError(f"sim_type must be one of {', '.join(SMILES_SIM_TYPES)}")
+    if sim_type == "cls":
+        return cls_similarity_matrix(smiles, n_jobs=n_jobs)
+    if sim_type == "lingo":
+        return lingo_similarity_matrix(smiles, n_jobs=n_jobs)
+    packed, _ = packed_fingerprints(smiles, fp_size=fp_size, n_jobs=n_jobs, store_dir=store_dir)
+    return packed_similarity_matrix(packed, sim_type, n_jobs=n_jobs)
+
+def smiles_knn_graph(smiles: list, k: int, sim_type: str = "jaccard", fp_size: int = 2048, n_jobs: int = -1,
+                     store_dir: str = None):
+    """
+    Graphe creux des distances (1 - similarité) de chaque SMILES vers ses k plus proches voisins,
+    calculé par blocs sans matrice n x n (voir neighbors.packed_knn et lingo.lingo_top_k).
+    Types pris en charge : "jaccard", "cosinus" et "lingo".
+
+    Retourne:
+      - scipy.sparse.csr_matrix (n, n) symétrique, à passer à apply_hdbscan_sparse.
+    """
+    if sim_type == "lingo":
+        neighbors, similarities = lingo_top_k(smiles, k=k)
+    elif sim_type in ("jaccard", "cosinus"):
+        packed, _ = packed_fingerprints(smiles, fp_size=fp_size, n_jobs=n_jobs, store_dir=store_dir)
+        neighbors, similarities = packed_knn(packed, k, sim_type, n_jobs=n_jobs)
+    else:
+        raise ValueError("k-nearest-neighbour graphs support sim_type 'jaccard', 'cosinus' or 'lingo'")
+    return knn_distance_graph(neighbors, similarities)
+
+def smiles_blocked_graph(smiles: list, blocking: str = "scaffold", sim_type: str = "jaccard", link_cutoff: float = 0.5,
+                         fp_size: int = 2048, n_jobs: int = -1, store_dir: str = None):
+    """
+    Structure de distances creuse par blocs de squelettes de Bemis-Murcko (voir scaffold.blocked_distance_graph) :
+    blocking vaut "scaffold" (squelette exact) ou "generic" (squelette générique). Types "jaccard" et "cosinus".
+
+    Retourne:
+      - tuple (graph, stats), voir scaffold.blocked_distance_graph.
+    """
+    if blocking not in BLOCKING_MODES:
+        raise ValueError(f"blocking must be one of {', '.join(BLOCKING_MODES)}")
+    if sim_type not in ("jaccard", "cosinus"):
+        raise ValueError("scaffold blocking supports sim_type 'jaccard' or 'cosinus'")
+    scaffolds = compute_scaffolds(smiles, generic=blocking == "generic", n_jobs=n_jobs)
+    packed, _ = packed_fingerprints(smiles, fp_size=fp_size, n_jobs=n_jobs, store_dir=store_dir)
+    return blocked_distance_graph(packed, scaffold_blocks(scaffolds), sim_type, link_cutoff=link_cutoff, n_jobs=n_jobs)
@@ -1,6 +1,7 @@
 import numpy as np
 from sklearn.metrics.pairwise import cosine_distances
 from rdkit import DataStructs
+from smiles.similarity.lcs import lcs_length
 
 def similarity_cosinus(rep1, rep2) -> float:
     """
@@ -21,17 +22,10 @@ def similarity_jaccard(fp1, fp2) -> float:
 
 def CLS(smile1: str, smile2: str) -> int:
     """
-    Calcule la longueur de la plus longue sous-séquence commune (CLS) entre deux SMILES.
-    """
-    m, n = len(smile1), len(smile2)
-    dp = [[0] * (n + 1) for _ in range(m + 1)]
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            if smile1[i - 1] == smile2[j - 1]:
-                dp[i][j] = dp[i - 1][j - 1] + 1
-            else:
-                dp[i][j] = max(dp[i - 1][j], dp[i][j - 1])
-    return dp[m][n]
+    Calcule la longueur de la plus longue sous-séquence commune (CLS) entre deux SMILES
+    (algorithme bit-parallèle, voir lcs.lcs_length ; lcs.cls_similarity_matrix pour une matrice complète).
+    """
+    return lcs_length(smile1, smile2)
 
 def CLS_distance(smile1: str, smile2: str) -> float:
     """
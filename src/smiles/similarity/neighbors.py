@@ -0,0 +1,220 @@
+"""
+Recherche des voisins au-dessus d'un seuil de similarité, avec élagage par bornes sur le nombre de bits.
+
+Pour deux fingerprints de a et b bits à 1 (a <= b), les bits communs sont au plus a, d'où :
+  - Tanimoto <= a / b  : un voisin de seuil t a un nombre de bits dans [a * t, a / t] ;
+  - cosinus  <= sqrt(a / b) : intervalle [a * t², a / t²].
+Les fingerprints sont triés par nombre de bits : pour chaque bloc de requêtes, seules les colonnes
+de l'intervalle compatible sont examinées, et la borne est ensuite appliquée paire par paire.
+
+Borne optionnelle sur un fingerprint replié grossièrement : les bits sont comptés par segment
+(fold_segments segments), et les bits communs sont au plus Σ_k min(a_k, b_k). Cette borne, moins
+coûteuse que le calcul exact, écarte la plupart des paires restantes avant le popcount complet.
+"""
+import time
+import logging
+import numpy as np
+from scipy import sparse
+from joblib import Parallel, delayed
+from utils.bitops import as_words, popcount, row_popcounts, and_popcounts
+from smiles.similarity.packed import SIM_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Marge des bornes, pour qu'un arrondi flottant n'écarte jamais une paire exactement au seuil
+_SLACK = 1e-9
+
+def _count_interval_exponent(sim_type: str) -> int:
+    return 1 if sim_type == "jaccard" else 2
+
+def _similarity(common, counts_a, counts_b, sim_type):
+    if sim_type == "jaccard":
+        union = counts_a + counts_b - common
+        return np.where(union > 0, common / np.maximum(union, 1), 0.0)
+    denom = np.sqrt(counts_a.astype(float) * counts_b)
+    return np.where(denom > 0, common / np.where(denom > 0, denom, 1), 0.0)
+
+def segment_counts(words: np.ndarray, fold_segments: int) -> np.ndarray:
+    """
+    Nombre de bits à 1 de chaque fingerprint dans chacun des fold_segments segments de mots consécutifs.
+
+    Retourne:
+      - np.ndarray (n, fold_segments) en int32.
+    """
+    word_counts = popcount(words).astype(np.int32)
+    bounds = np.linspace(0, words.shape[1], fold_segments + 1).astype(int)
+    return np.add.reduceat(word_counts, bounds[:-1], axis=1)
+
+def _neighbor_tile(words, counts, segments, rows, cols, cutoff, sim_type, exponent):
+    """
+    Paires (i < j) d'une tuile dont la similarité atteint cutoff, avec le nombre de paires restantes
+    après chaque borne.
+    """
+    counts_r, counts_c = counts[rows[0]:rows[1]], counts[cols[0]:cols[1]]
+    # Borne sur le nombre de bits (les colonnes ont au moins autant de bits que les lignes : tri croissant)
+    keep = counts_c[None, :] * cutoff ** exponent <= counts_r[:, None] + _SLACK
+    if rows[0] == cols[0]:
+        keep &= np.triu(np.ones_like(keep), k=1)
+    n_count = int(np.count_nonzero(keep))
+    n_fold = n_count
+    if n_count and segments is not None:
+        i, j = np.nonzero(keep)
+        bound = np.minimum(segments[rows[0] + i], segments[cols[0] + j]).sum(axis=1)
+        ok = _similarity(bound, counts_r[i], counts_c[j], sim_type) >= cutoff - _SLACK
+        keep[i[~ok], j[~ok]] = False
+        n_fold = int(np.count_nonzero(ok))
+    if not n_fold:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0), n_count, n_fold
+    i, j = np.nonzero(keep)
+    if n_fold > keep.size // 4:
+        common = and_popcounts(words[rows[0]:rows[1]], words[cols[0]:cols[1]])[i, j]
+    else:
+        common = popcount(words[rows[0] + i] & words[cols[0] + j]).sum(axis=1, dtype=np.int64)
+    sims = _similarity(common, counts_r[i], counts_c[j], sim_type)
+    found = sims >= cutoff
+    return rows[0] + i[found], cols[0] + j[found], sims[found], n_count, n_fold
+
+def threshold_neighbors(packed: np.ndarray, cutoff: float, sim_type: str = "jaccard", block_size: int = 512,
+                        fold_segments: int = 0, n_jobs: int = -1):
+    """
+    Graphe des paires de fingerprints compactés dont la similarité atteint cutoff, en ignorant
+    les paires exclues par les bornes sur le nombre de bits (même résultat que le calcul de toutes les paires).
+
+    Arguments:
+      - packed : np.ndarray (n, n_octets) en uint8.
+      - cutoff : float, similarité minimale (> 0) d'un voisin.
+      - sim_type : str, "jaccard" (Tanimoto) ou "cosinus".
+      - block_size : int, nombre de molécules par tuile.
+      - fold_segments : int, nombre de segments du fingerprint replié (défaut 0 : pas de borne repliée ;
+          8 ou 16 sont utiles pour des seuils élevés, à partir de 0.65 en Tanimoto).
+      - n_jobs : int, nombre de threads (défaut -1 : tous les cœurs).
+
+    Retourne:
+      - tuple:
+          graph : scipy.sparse.csr_matrix (n, n) symétrique des similarités des voisins (indices d'origine).
+          stats : dict, paires totales, paires restantes après chaque borne, taux d'élagage,
+                  temps et débit (paires par seconde).
+    """
+    if sim_type not in SIM_TYPES:
+        raise ValueError(f"sim_type must be one of {', '.join(SIM_TYPES)}")
+    if cutoff <= 0:
+        raise ValueError("cutoff must be positive: every pair is a neighbour otherwise")
+    start = time.perf_counter()
+    exponent = _count_interval_exponent(sim_type)
+    words = as_words(packed)
+    counts = row_popcounts(words)
+    order = np.argsort(counts, kind="stable")
+    words, counts = words[order], counts[order]
+    segments = segment_counts(words, fold_segments) if fold_segments else None
+    n = len(counts)
+    tiles = []
+    for r0 in range(0, n, block_size):
+        r1 = min(r0 + block_size, n)
+        # Dernière colonne compatible avec la requête de plus grand nombre de bits du bloc
+        max_count = counts[r1 - 1] / cutoff ** exponent + _SLACK
+        hi = max(int(np.searchsorted(counts, max_count, side="right")), r1)
+        tiles.extend(((r0, r1), (c0, min(c0 + block_size, hi))) for c0 in range(r0, hi, block_size))
+    if n_jobs == 1 or len(tiles) <= 1:
+        results = [_neighbor_tile(words, counts, segments, rows, cols, cutoff, sim_type, exponent)
+                   for rows, cols in tiles]
+    else:
+        results = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_neighbor_tile)(words, counts, segments, rows, cols, cutoff, sim_type, exponent)
+            for rows, cols in tiles
+        )
+    i = order[np.concatenate([r[0] for r in results])] if results else np.zeros(0, np.int64)
+    j = order[np.concatenate([r[1] for r in results])] if results else np.zeros(0, np.int64)
+    sims = np.concatenate([r[2] for r in results]) if results else np.zeros(0)
+    graph = sparse.csr_matrix((np.concatenate([sims, sims]), (np.concatenate([i, j]), np.concatenate([j, i]))),
+                              shape=(n, n))
+    elapsed = time.perf_counter() - start
+    total = n * (n - 1) // 2
+    after_count = sum(r[3] for r in results)
+    after_fold = sum(r[4] for r in results)
+    stats = {
+        "total_pairs": total,
+        "pairs_after_popcount_bound": after_count,
+        "pairs_after_fold_bound": after_fold,
+        "neighbor_pairs": len(sims),
+        "popcount_pruning_rate": 1 - after_count / total if total else 0.0,
+        "total_pruning_rate": 1 - after_fold / total if total else 0.0,
+        "elapsed_seconds": elapsed,
+        "pairs_per_second": total / elapsed if elapsed > 0 else None,
+    }
+    logger.info("Neighbour search: %d/%d pairs pruned by popcount bound (%.1f%%), %.1f%% in total, "
+                "%d neighbours, %.3g pairs/s", total - after_count, total, 100 * stats["popcount_pruning_rate"],
+                100 * stats["total_pruning_rate"], len(sims), stats["pairs_per_second"] or 0)
+    return graph, stats
+
+def _knn_rows(words, counts, rows, k, sim_type, block_size):
+    """
+    k plus proches voisins des lignes rows[0]:rows[1], en parcourant les colonnes par tuiles
+    et en ne gardant à chaque étape que les k meilleurs candidats.
+    """
+    n = len(counts)
+    size = rows[1] - rows[0]
+    best_idx = np.full((size, 0), -1, dtype=np.int64)
+    best_sim = np.zeros((size, 0))
+    local = np.arange(size)
+    for c0 in range(0, n, block_size):
+        c1 = min(c0 + block_size, n)
+        common = and_popcounts(words[rows[0]:rows[1]], words[c0:c1])
+        sims = _similarity(common, counts[rows[0]:rows[1], None], counts[None, c0:c1], sim_type)
+        # La molécule elle-même n'est pas son propre voisin
+        diag = (local + rows[0] >= c0) & (local + rows[0] < c1)
+        sims[local[diag], local[diag] + rows[0] - c0] = -1
+        cand_idx = np.hstack([best_idx, np.broadcast_to(np.arange(c0, c1), sims.shape)])
+        cand_sim = np.hstack([best_sim, sims])
+        if cand_sim.shape[1] > k:
+            top = np.argpartition(-cand_sim, k - 1, axis=1)[:, :k]
+            cand_idx = np.take_along_axis(cand_idx, top, axis=1)
+            cand_sim = np.take_along_axis(cand_sim, top, axis=1)
+        best_idx, best_sim = cand_idx, cand_sim
+    order = np.argsort(-best_sim, axis=1, kind="stable")
+    return rows, np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_sim, order, axis=1)
+
+def packed_knn(packed: np.ndarray, k: int, sim_type: str = "jaccard", block_size: int = 512, n_jobs: int = -1):
+    """
+    k plus proches voisins (lui-même exclu) de chaque fingerprint compacté, sans matrice n x n :
+    la mémoire est en block_size x (block_size + k) par thread.
+
+    Retourne:
+      - tuple, au même format que lingo.lingo_top_k :
+          neighbors : np.ndarray (n, k) en int64, par similarité décroissante.
+          similarities : np.ndarray (n, k).
+    """
+    if sim_type not in SIM_TYPES:
+        raise ValueError(f"sim_type must be one of {', '.join(SIM_TYPES)}")
+    words = as_words(packed)
+    counts = row_popcounts(words)
+    n = len(counts)
+    k = min(k, max(n - 1, 0))
+    neighbors = np.full((n, k), -1, dtype=np.int64)
+    similarities = np.zeros((n, k))
+    if k == 0:
+        return neighbors, similarities
+    bounds = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    if n_jobs == 1 or len(bounds) <= 1:
+        results = [_knn_rows(words, counts, rows, k, sim_type, block_size) for rows in bounds]
+    else:
+        results = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_knn_rows)(words, counts, rows, k, sim_type, block_size) for rows in bounds
+        )
+    for (r0, r1), idx, sims in results:
+        neighbors[r0:r1] = idx
+        similarities[r0:r1] = sims
+    return neighbors, similarities
+
+def knn_distance_graph(neighbors: np.ndarray, similarities: np.ndarray) -> sparse.csr_matrix:
+    """
+    Graphe de distances (1 - similarité) symétrique à partir des k plus proches voisins,
+    pour apply_hdbscan_sparse : une arête i-j existe si j est voisin de i ou i voisin de j.
+    Les distances nulles (fingerprints identiques) sont ramenées à un epsilon pour rester des arêtes.
+    """
+    n = neighbors.shape[0]
+    rows = np.repeat(np.arange(n), neighbors.shape[1])
+    cols = neighbors.ravel()
+    valid = cols >= 0
+    dist = np.maximum(1 - similarities.ravel()[valid], np.finfo(np.float32).eps)
+    graph = sparse.csr_matrix((dist, (rows[valid], cols[valid])), shape=(n, n))
+    return graph.maximum(graph.T).tocsr()
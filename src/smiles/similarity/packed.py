@@ -0,0 +1,103 @@
+import numpy as np
+from joblib import Parallel, delayed
+from utils.bitops import as_words, row_popcounts, and_popcounts
+
+SIM_TYPES = ("jaccard", "cosinus")
+
+def tanimoto_block(common: np.ndarray, counts_a: np.ndarray, counts_b: np.ndarray) -> np.ndarray:
+    """
+    Similarité de Tanimoto d'un bloc à partir des bits communs et du nombre de bits de chaque ligne :
+    |a ET b| / (|a| + |b| - |a ET b|), 0 si les deux fingerprints sont vides (comme RDKit).
+    """
+    union = counts_a[:, None] + counts_b[None, :] - common
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, common / union, 0.0)
+
+def cosine_block(common: np.ndarray, counts_a: np.ndarray, counts_b: np.ndarray) -> np.ndarray:
+    """
+    Similarité cosinus d'un bloc de fingerprints binaires : |a ET b| / sqrt(|a| * |b|), 0 si l'un est vide.
+    """
+    denom = np.sqrt(counts_a[:, None].astype(float) * counts_b[None, :])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denom > 0, common / denom, 0.0)
+
+_BLOCK_FUNCTIONS = {"jaccard": tanimoto_block, "cosinus": cosine_block}
+
+def _similarity_tile(words, counts, rows, cols, block_fn):
+    common = and_popcounts(words[rows[0]:rows[1]], words[cols[0]:cols[1]])
+    return rows, cols, block_fn(common, counts[rows[0]:rows[1]], counts[cols[0]:cols[1]])
+
+def packed_similarity_matrix(packed: np.ndarray, sim_type: str = "jaccard", block_size: int = 256,
+                             n_jobs: int = -1) -> np.ndarray:
+    """
+    Calcule la matrice de similarité (Tanimoto ou cosinus) de fingerprints binaires compactés.
+
+    Les fingerprints sont lus comme des mots de 64 bits : pour chaque bloc de block_size x block_size
+    molécules, les bits communs sont comptés par popcount du ET bit à bit, puis combinés au nombre de bits
+    de chaque ligne. Seuls les blocs du triangle supérieur sont calculés ; ils sont répartis sur n_jobs
+    threads (les opérations numpy libèrent le GIL).
+
+    Arguments:
+      - packed : np.ndarray (n, n_octets) en uint8, voir generate_packed_fingerprint_matrix.
+      - sim_type : str, "jaccard" (Tanimoto) ou "cosinus".
+      - block_size : int, nombre de molécules par bloc.
+      - n_jobs : int, nombre de threads (défaut -1 : tous les cœurs).
+
+    Retourne:
+      - np.ndarray : matrice de similarité (n, n).
+    """
+    if sim_type not in _BLOCK_FUNCTIONS:
+        raise ValueError(f"sim_type must be one of {', '.join(SIM_TYPES)}")
+    block_fn = _BLOCK_FUNCTIONS[sim_type]
+    words = as_words(packed)
+    counts = row_popcounts(words)
+    n = words.shape[0]
+    bounds = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    tiles = [(bounds[bi], bounds[bj]) for bi in range(len(bounds)) for bj in range(bi, len(bounds))]
+    if n_jobs == 1 or len(tiles) <= 1:
+        results = [_similarity_tile(words, counts, rows, cols, block_fn) for rows, cols in tiles]
+    else:
+        results = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_similarity_tile)(words, counts, rows, cols, block_fn) for rows, cols in tiles
+        )
+    sim_matrix = np.zeros((n, n))
+    for (r0, r1), (c0, c1), block in results:
+        sim_matrix[r0:r1, c0:c1] = block
+        sim_matrix[c0:c1, r0:r1] = block.T
+    return sim_matrix
+
+def _condensed_tile(words, counts, rows, block_fn, out):
+    n = len(counts)
+    dist = 1 - block_fn(and_popcounts(words[rows[0]:rows[1]], words[rows[0]:]), counts[rows[0]:rows[1]],
+                        counts[rows[0]:])
+    for i in range(rows[0], min(rows[1], n - 1)):
+        start = i * n - i * (i + 1) // 2
+        out[start:start + n - i - 1] = dist[i - rows[0], i - rows[0] + 1:]
+
+def packed_condensed_distances(packed: np.ndarray, sim_type: str = "jaccard", block_size: int = 256,
+                               n_jobs: int = -1, dtype=np.float64, out=None) -> np.ndarray:
+    """
+    Distances (1 - similarité) de fingerprints compactés au format condensé de scipy (triangle supérieur strict),
+    sans matrice carrée : chaque paquet de block_size lignes est écrit directement dans out, qui peut être
+    un np.memmap (voir clustering_utilis.hac.run_hac_condensed).
+
+    Retourne:
+      - np.ndarray (n * (n - 1) / 2,) en dtype (ou out).
+    """
+    if sim_type not in _BLOCK_FUNCTIONS:
+        raise ValueError(f"sim_type must be one of {', '.join(SIM_TYPES)}")
+    block_fn = _BLOCK_FUNCTIONS[sim_type]
+    words = as_words(packed)
+    counts = row_popcounts(words)
+    n = words.shape[0]
+    if out is None:
+        out = np.empty(n * (n - 1) // 2, dtype=dtype)
+    bounds = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    if n_jobs == 1 or len(bounds) <= 1:
+        for rows in bounds:
+            _condensed_tile(words, counts, rows, block_fn, out)
+    else:
+        Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_condensed_tile)(words, counts, rows, block_fn, out) for rows in bounds
+        )
+    return out
@@ -1,6 +1,10 @@
-from rdkit import Chem
+import logging
+import multiprocessing as mp
+from functools import lru_cache
+from rdkit import Chem, RDLogger
 from rdkit.Chem import rdFingerprintGenerator
 import numpy as np
+from scipy import sparse
 
 def gen_lingos(smile: str, n: int = 3) -> np.ndarray:
     """
@@ -9,14 +13,206 @@ def gen_lingos(smile: str, n: int = 3) -> np.ndarray:
     # Exemple: pour n=3, on génère tous les trigrammes.
     return np.array([smile[i:i+n] for i in range(len(smile) - n + 1)])
 
+@lru_cache(maxsize=None)
+def get_morgan_generator(radius: int = 2, fp_size: int = 2048):
+    """
+    Retourne le générateur Morgan RDKit pour ces paramètres, créé une seule fois par processus.
+    """
+    return rdFingerprintGenerator.GetMorganGenerator(radius=radius, fpSize=fp_size)
+
 def morgan_fingerprint(smile: str, fp_size: int = 2048):
     """
     Génère un fingerprint de type Morgan à partir d'un SMILES.
     Retourne un objet rdkit.DataStructs.cDataStructs.ExplicitBitVect.
     """
-    from rdkit import Chem
     mol = Chem.MolFromSmiles(smile)
     if mol is None:
         raise ValueError(f"Impossible de convertir le SMILES '{smile}' en molécule RDKit.")
-    generator = rdFingerprintGenerator.GetMorganGenerator(radius=2, fpSize=fp_size)
-    return generator.GetFingerprint(mol)
+    return get_morgan_generator(2, fp_size).GetFingerprint(mol)
+
+# Paramètres du générateur partagés par les workers (initialisés une seule fois par processus)
+_WORKER_STATE = {}
+
+def _set_worker_state(radius: int, fp_size: int, canonical: bool = False):
+    _WORKER_STATE["generator"] = get_morgan_generator(radius, fp_size)
+    _WORKER_STATE["fp_size"] = fp_size
+    _WORKER_STATE["canonical"] = canonical
+
+def _init_worker(radius: int, fp_size: int, canonical: bool = False):
+    # Journal RDKit coupé dans les workers seulement : les SMILES invalides sont résumés par le processus principal
+    RDLogger.DisableLog("rdApp.*")
+    _set_worker_state(radius, fp_size, canonical)
+
+def _fingerprint_chunk(chunk):
+    """
+    Calcule les fingerprints compactés d'un paquet (start, smiles) ; les SMILES invalides donnent une ligne vide.
+    """
+    start, smiles = chunk
+    generator, fp_size = _WORKER_STATE["generator"], _WORKER_STATE["fp_size"]
+    bits = np.zeros((len(smiles), fp_size), dtype=np.uint8)
+    invalid, canonical = [], [None] * len(smiles)
+    for k, smile in enumerate(smiles):
+        mol = Chem.MolFromSmiles(smile)
+        if mol is None:
+            invalid.append({"index": start + k, "smiles": smile})
+            continue
+        bits[k] = generator.GetFingerprintAsNumPy(mol)
+        if _WORKER_STATE["canonical"]:
+            canonical[k] = Chem.MolToSmiles(mol)
+    return start, np.packbits(bits, axis=1), invalid, canonical
+
+def log_invalid_smiles(invalid: list):
+    """
+    Signale les SMILES invalides ({"index", "smiles"}, indices dans la liste de l'appelant) par un avertissement.
+    """
+    if invalid:
+        logging.warning("%d invalid SMILES skipped (empty fingerprints): %s", len(invalid),
+                        ", ".join(f"{item['index']}:{item['smiles']}" for item in invalid[:20])
+                        + (" ..." if len(invalid) > 20 else ""))
+
+def batch_packed_fingerprints(smiles: list, fp_size: int = 2048, radius: int = 2, n_jobs: int = -1,
+                              chunk_size: int = 1024, return_canonical: bool = False, warn_invalid: bool = True):
+    """
+    Calcule les fingerprints Morgan compactés (8 bits par octet) d'une liste de SMILES.
+
+    Les SMILES sont découpés en paquets de chunk_size, traités par un pool de n_jobs processus
+    disposant chacun de son propre générateur Morgan. Les SMILES invalides n'interrompent pas le calcul :
+    leur ligne reste vide et ils sont listés dans le résultat.
+
+    Arguments:
+      - smiles : list, SMILES à traiter.
+      - fp_size : int, taille du fingerprint (défaut 2048).
+      - radius : int, rayon Morgan (défaut 2).
+      - n_jobs : int, nombre de processus (défaut -1 : tous les cœurs).
+      - chunk_size : int, nombre de SMILES par paquet.
+      - return_canonical : bool, si True retourne aussi les SMILES canoniques RDKit (None si invalide).
+      - warn_invalid : bool, si False les SMILES invalides ne sont pas signalés ici (l'appelant les signale
+          avec ses propres indices, voir log_invalid_smiles).
+
+    Retourne:
+      - tuple:
+          packed : np.ndarray (n, ceil(fp_size / 8)) en uint8, dans l'ordre des SMILES.
+          invalid : liste de {"index", "smiles"} des SMILES non convertibles (lignes vides dans packed).
+          canonical : liste des SMILES canoniques (uniquement si return_canonical).
+    """
+    chunks = [(start, smiles[start:start + chunk_size]) for start in range(0, len(smiles), chunk_size)]
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = mp.cpu_count()
+    packed = np.zeros((len(smiles), (fp_size + 7) // 8), dtype=np.uint8)
+    invalid, canonical = [], []
+    initargs = (radius, fp_size, return_canonical)
+    if n_jobs == 1 or len(chunks) <= 1:
+        _set_worker_state(*initargs)
+        for start, block, chunk_invalid, chunk_canonical in map(_fingerprint_chunk, chunks):
+            packed[start:start + len(block)] = block
+            invalid.extend(chunk_invalid)
+            canonical.extend(chunk_canonical)
+    else:
+        with mp.Pool(processes=min(n_jobs, len(chunks)), initializer=_init_worker, initargs=initargs) as pool:
+            # imap conserve l'ordre des paquets
+            for start, block, chunk_invalid, chunk_canonical in pool.imap(_fingerprint_chunk, chunks):
+                packed[start:start + len(block)] = block
+                invalid.extend(chunk_invalid)
+                canonical.extend(chunk_canonical)
+    if warn_invalid:
+        log_invalid_smiles(invalid)
+    if return_canonical:
+        return packed, invalid, canonical
+    return packed, invalid
+
+def _unfolded_chunk(chunk):
+    """
+    Calcule les fingerprints Morgan non repliés d'un paquet (start, smiles) : identifiants d'environnement
+    (entiers 32 bits) et nombre d'occurrences ; les SMILES invalides donnent une ligne vide.
+    """
+    start, smiles = chunk
+    generator = _WORKER_STATE["generator"]
+    lengths, ids, counts = [], [], []
+    invalid, canonical = [], [None] * len(smiles)
+    for k, smile in enumerate(smiles):
+        mol = Chem.MolFromSmiles(smile)
+        if mol is None:
+            invalid.append({"index": start + k, "smiles": smile})
+            lengths.append(0)
+            continue
+        elements = generator.GetSparseCountFingerprint(mol).GetNonzeroElements()
+        lengths.append(len(elements))
+        ids.extend(elements.keys())
+        counts.extend(elements.values())
+        if _WORKER_STATE["canonical"]:
+            canonical[k] = Chem.MolToSmiles(mol)
+    return (start, np.array(lengths, dtype=np.int64), np.array(ids, dtype=np.uint32),
+            np.array(counts, dtype=np.uint32), invalid, canonical)
+
+def batch_unfolded_fingerprints(smiles: list, radius: int = 2, n_jobs: int = -1, chunk_size: int = 1024,
+                                return_canonical: bool = False, warn_invalid: bool = True):
+    """
+    Calcule les fingerprints Morgan non repliés (identifiants d'environnement et comptes) d'une liste de SMILES,
+    sur un pool de n_jobs processus comme batch_packed_fingerprints. N'importe quelle taille de fingerprint,
+    en bits (fold_packed) ou en comptes (fold_counts), s'en déduit ensuite sans repasser par RDKit :
+    le bit d'un identifiant est identifiant % fp_size, comme dans le générateur Morgan de RDKit.
+    warn_invalid : voir batch_packed_fingerprints.
+
+    Retourne:
+      - tuple:
+          unfolded : dict, format CSR : "indptr" (n + 1,) en int64, "ids" et "counts" en uint32.
+          invalid : liste de {"index", "smiles"} des SMILES non convertibles (lignes vides).
+          canonical : liste des SMILES canoniques (uniquement si return_canonical).
+    """
+    chunks = [(start, smiles[start:start + chunk_size]) for start in range(0, len(smiles), chunk_size)]
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = mp.cpu_count()
+    # La taille du générateur n'intervient pas dans le fingerprint non replié
+    initargs = (radius, 2048, return_canonical)
+    if n_jobs == 1 or len(chunks) <= 1:
+        _set_worker_state(*initargs)
+        results = list(map(_unfolded_chunk, chunks))
+    else:
+        with mp.Pool(processes=min(n_jobs, len(chunks)), initializer=_init_worker, initargs=initargs) as pool:
+            results = pool.map(_unfolded_chunk, chunks)
+    lengths = np.concatenate([r[1] for r in results]) if results else np.zeros(0, np.int64)
+    unfolded = {
+        "indptr": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        "ids": np.concatenate([r[2] for r in results]) if results else np.zeros(0, np.uint32),
+        "counts": np.concatenate([r[3] for r in results]) if results else np.zeros(0, np.uint32),
+    }
+    invalid = [item for r in results for item in r[4]]
+    if warn_invalid:
+        log_invalid_smiles(invalid)
+    if return_canonical:
+        return unfolded, invalid, [canon for r in results for canon in r[5]]
+    return unfolded, invalid
+
+def _folded_positions(unfolded: dict, fp_size: int):
+    rows = np.repeat(np.arange(len(unfolded["indptr"]) - 1), np.diff(unfolded["indptr"]))
+    return rows, (unfolded["ids"] % np.uint32(fp_size)).astype(np.int64)
+
+def fold_packed(unfolded: dict, fp_size: int = 2048) -> np.ndarray:
+    """
+    Replie des fingerprints non repliés en fingerprints binaires compactés de fp_size bits,
+    identiques à ceux de batch_packed_fingerprints.
+
+    Retourne:
+      - np.ndarray (n, ceil(fp_size / 8)) en uint8.
+    """
+    rows, cols = _folded_positions(unfolded, fp_size)
+    row_bytes = (fp_size + 7) // 8
+    packed = np.zeros((len(unfolded["indptr"]) - 1, row_bytes), dtype=np.uint8)
+    # Ordre des bits de np.packbits : le bit 0 est le bit de poids fort du premier octet
+    positions = np.unique(rows * (row_bytes * 8) + cols)
+    np.bitwise_or.at(packed.reshape(-1), positions >> 3, (128 >> (positions & 7)).astype(np.uint8))
+    return packed
+
+def fold_counts(unfolded: dict, fp_size: int = 2048) -> sparse.csr_matrix:
+    """
+    Replie des fingerprints non repliés en comptes de fp_size colonnes (comptes des identifiants
+    de même reste additionnés, comme GetCountFingerprint de RDKit).
+
+    Retourne:
+      - scipy.sparse.csr_matrix (n, fp_size) en int32.
+    """
+    rows, cols = _folded_positions(unfolded, fp_size)
+    counts = sparse.csr_matrix((unfolded["counts"].astype(np.int32), (rows, cols)),
+                               shape=(len(unfolded["indptr"]) - 1, fp_size))
+    counts.sum_duplicates()
+    return counts
@@ -0,0 +1,158 @@
+"""
+Blocage par squelette de Bemis-Murcko : les molécules sont regroupées par squelette (ou squelette
+générique : atomes et liaisons banalisés), et les similarités exactes ne sont calculées qu'à l'intérieur
+des blocs. Entre blocs, seule une comparaison grossière est faite sur un fingerprint résumé
+(OU bit à bit des fingerprints du bloc) : les paires de blocs dont le résumé atteint link_cutoff sont
+aussi comparées exactement, les autres paires reçoivent implicitement la distance maximale.
+
+Ce test des résumés est une heuristique, pas une borne : la similarité de deux résumés ne majore pas
+celle des paires de molécules des deux blocs, et des paires proches de blocs non reliés peuvent être manquées.
+"""
+import time
+import logging
+import multiprocessing as mp
+import numpy as np
+from scipy import sparse
+from joblib import Parallel, delayed
+from rdkit import Chem, RDLogger
+from rdkit.Chem.Scaffolds import MurckoScaffold
+from utils.bitops import as_words, row_popcounts, and_popcounts
+from smiles.similarity.packed import tanimoto_block, cosine_block, SIM_TYPES
+from smiles.similarity.neighbors import threshold_neighbors
+
+logger = logging.getLogger(__name__)
+
+BLOCKING_MODES = ("scaffold", "generic")
+
+_BLOCK_FUNCTIONS = {"jaccard": tanimoto_block, "cosinus": cosine_block}
+
+def _init_scaffold_worker():
+    RDLogger.DisableLog("rdApp.*")
+
+def _scaffold_chunk(args) -> list:
+    smiles, generic = args
+    scaffolds = []
+    for smile in smiles:
+        mol = Chem.MolFromSmiles(smile)
+        if mol is None:
+            scaffolds.append("")
+            continue
+        try:
+            core = MurckoScaffold.GetScaffoldForMol(mol)
+            if generic:
+                core = MurckoScaffold.MakeScaffoldGeneric(core)
+            scaffolds.append(Chem.MolToSmiles(core))
+        except (ValueError, RuntimeError):
+            scaffolds.append("")
+    return scaffolds
+
+def compute_scaffolds(smiles: list, generic: bool = False, n_jobs: int = -1, chunk_size: int = 1024) -> list:
+    """
+    Squelette de Bemis-Murcko (SMILES canonique) de chaque SMILES, calculé sur n_jobs processus.
+    Les molécules acycliques et les SMILES invalides ont le squelette vide "".
+    """
+    chunks = [(smiles[start:start + chunk_size], generic) for start in range(0, len(smiles), chunk_size)]
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = mp.cpu_count()
+    if n_jobs == 1 or len(chunks) <= 1:
+        results = list(map(_scaffold_chunk, chunks))
+    else:
+        with mp.Pool(processes=min(n_jobs, len(chunks)), initializer=_init_scaffold_worker) as pool:
+            results = pool.map(_scaffold_chunk, chunks)
+    return [scaffold for chunk in results for scaffold in chunk]
+
+def scaffold_blocks(scaffolds: list) -> list:
+    """
+    Regroupe les indices des molécules par squelette, dans l'ordre de première apparition.
+    Les molécules sans squelette ("" : acycliques) forment chacune un bloc singleton : réunies, elles
+    formeraient un seul bloc arbitrairement grand dont toutes les paires seraient calculées.
+
+    Retourne:
+      - list de np.ndarray : indices des molécules de chaque bloc.
+    """
+    groups = {}
+    for i, scaffold in enumerate(scaffolds):
+        groups.setdefault(scaffold or i, []).append(i)
+    return [np.array(members, dtype=np.int64) for members in groups.values()]
+
+def _chunks(members: np.ndarray, block_size: int) -> list:
+    return [members[start:start + block_size] for start in range(0, len(members), block_size)]
+
+def _pair_tile(words, counts, rows, cols, block_fn, diagonal):
+    """
+    Similarités des paires d'une tuile (rows x cols) ; pour une tuile diagonale, paires i < j seulement.
+    """
+    sims = block_fn(and_popcounts(words[rows], words[cols]), counts[rows], counts[cols])
+    if diagonal:
+        i, j = np.triu_indices(len(rows), k=1)
+        return rows[i], cols[j], sims[i, j]
+    return np.repeat(rows, len(cols)), np.tile(cols, len(rows)), sims.ravel()
+
+def blocked_distance_graph(packed: np.ndarray, blocks: list, sim_type: str = "jaccard", link_cutoff: float = 0.5,
+                           fold_segments: int = 0, block_size: int = 512, n_jobs: int = -1):
+    """
+    Structure de distances creuse par blocs (distance = 1 - similarité).
+
+    Les distances exactes sont calculées pour toutes les paires d'un même bloc, et pour les paires de deux blocs
+    dont les fingerprints résumés (OU des fingerprints du bloc) ont une similarité >= link_cutoff ;
+    ces comparaisons de résumés passent par neighbors.threshold_neighbors. Ce lien entre blocs est heuristique
+    (voir le module). Les paires absentes valent implicitement 1 (distance maximale), comme pour
+    apply_hdbscan_sparse. link_cutoff=None désactive les comparaisons entre blocs.
+
+    Comme dans threshold_neighbors, les blocs sont découpés en tuiles de block_size x block_size molécules
+    réparties sur n_jobs threads : la mémoire de travail est celle d'une tuile par thread, en plus des paires
+    conservées.
+
+    Retourne:
+      - tuple:
+          graph : scipy.sparse.csr_matrix (n, n) symétrique des distances calculées (nulles ramenées à un epsilon).
+          stats : dict, nombre de blocs, taille du plus grand, paires calculées / ignorées, paires de blocs reliées.
+    """
+    if sim_type not in SIM_TYPES:
+        raise ValueError(f"sim_type must be one of {', '.join(SIM_TYPES)}")
+    start = time.perf_counter()
+    block_fn = _BLOCK_FUNCTIONS[sim_type]
+    words = as_words(packed)
+    counts = row_popcounts(words)
+    n = len(counts)
+    linked = []
+    if link_cutoff is not None and len(blocks) > 1:
+        summaries = np.vstack([np.bitwise_or.reduce(packed[members], axis=0) for members in blocks])
+        summary_graph, _ = threshold_neighbors(summaries, link_cutoff, sim_type, fold_segments=fold_segments,
+                                               n_jobs=n_jobs)
+        summary_graph = sparse.triu(summary_graph, k=1).tocoo()
+        linked = list(zip(summary_graph.row, summary_graph.col))
+    tiles = []
+    for members in blocks:
+        if len(members) < 2:
+            continue
+        chunks = _chunks(members, block_size)
+        tiles.extend((chunks[a], chunks[b], a == b) for a in range(len(chunks)) for b in range(a, len(chunks)))
+    for a, b in linked:
+        tiles.extend((rows, cols, False) for rows in _chunks(blocks[a], block_size)
+                     for cols in _chunks(blocks[b], block_size))
+    if n_jobs == 1 or len(tiles) <= 1:
+        entries = [_pair_tile(words, counts, rows, cols, block_fn, diagonal) for rows, cols, diagonal in tiles]
+    else:
+        entries = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_pair_tile)(words, counts, rows, cols, block_fn, diagonal) for rows, cols, diagonal in tiles
+        )
+    i = np.concatenate([e[0] for e in entries]) if entries else np.zeros(0, np.int64)
+    j = np.concatenate([e[1] for e in entries]) if entries else np.zeros(0, np.int64)
+    dist = np.maximum(1 - np.concatenate([e[2] for e in entries]), np.finfo(np.float32).eps) if entries else np.zeros(0)
+    graph = sparse.csr_matrix((np.concatenate([dist, dist]), (np.concatenate([i, j]), np.concatenate([j, i]))),
+                              shape=(n, n))
+    total = n * (n - 1) // 2
+    sizes = [len(members) for members in blocks]
+    stats = {
+        "n_blocks": len(blocks),
+        "largest_block": max(sizes) if sizes else 0,
+        "linked_block_pairs": len(linked),
+        "total_pairs": total,
+        "computed_pairs": len(dist),
+        "skipped_pairs": total - len(dist),
+        "elapsed_seconds": time.perf_counter() - start,
+    }
+    logger.info("Scaffold blocking: %d blocks (largest %d), %d linked block pairs, %d/%d pairs skipped",
+                stats["n_blocks"], stats["largest_block"], stats["linked_block_pairs"], stats["skipped_pairs"], total)
+    return graph, stats
@@ -2,99 +2,200 @@ import os
 import time
 import logging
 import numpy as np
+import config
 import json
 import hashlib
 from datetime import datetime
 from spectra.similarity.binning import bin_file
-from spectra.similarity.matrix import make_matrix_for_file, read_matrix
-from clustering_utilis.hac import run_hac
+from spectra.similarity.matrix import make_matrix_for_file, read_matrix, make_sparse_matrix_for_file, read_sparse_matrix
+from clustering_utilis.hac import linkage_square, linkage_sparse, parse_cluster_counts, cached_linkage, sweep_cuts
 from clustering_utilis.common import generate_hash, write_json_results
+from utils.file_utils import file_digest
 from matchms.importing import load_from_mgf
 
 logger = logging.getLogger(__name__)
 
-def run_hac_pipeline(mgf_file: str, bin_size: float, n_clusters: int,
+def run_hac_pipeline(mgf_file: str, bin_size: float, n_clusters,
                      opt: str = 'somme', mz_min: float = 20, mz_max: float = 2000,
-                     tol: float = 0.1, num_workers: int = None, dist_method: str = "cosinus") -> str:
+                     tol: float = 0.1, num_workers: int = None, dist_method: str = "cosinus",
+                     precursor_tol: float = None, precursor_unit: str = "da",
+                     dist_cutoff: float = None, lsh: bool = False, lsh_num_perm: int = 128,
+                     lsh_bands: int = 32, lsh_recall_sample: int = 0,
+                     min_matched_peaks: int = None, auto_k: bool = False,
+                     linkage_cache_dir: str = config.DEFAULT_LINKAGE_CACHE_DIR):
     """
     Exécute le pipeline de clustering HAC sur un fichier MGF de spectres.
     
     Étapes :
-      1. Applique le binning sur le fichier MGF via la fonction bin_file.
-         Le fichier binned est sauvegardé dans "output/tmp/binned_adducts_<bin_size>".
+      1. Applique le binning sur le fichier MGF via la fonction bin_file (seulement si les distances sont
+         nécessaires : arbre absent du cache, ou auto_k). Le fichier binned est sauvegardé dans
+         "output/tmp/binned_adducts_<bin_size>".
       2. Génère la matrice de distances à partir du fichier binned en utilisant
          make_matrix_for_file avec la méthode spécifiée par dist_method et tolérance tol.
          Le CSV est sauvegardé dans "output/tmp/matrix_<bin_size>_cosinus" (ou autre selon la méthode).
-      3. Lit la matrice de distances (avec read_matrix) et applique HAC (run_hac) pour obtenir les labels.
-      4. Recharge les spectres depuis le fichier binned pour générer les résultats,
-         en utilisant les indices (IDs commençant à 1).
-      5. Génère un hash à partir des paramètres (en excluant les valeurs variables) et sauvegarde
-         les résultats dans un fichier JSON dans :
+      3. Lit la matrice de distances (avec read_matrix). Avec dist_cutoff, lsh ou min_matched_peaks, la matrice
+         creuse est gardée telle quelle (paires absentes à la distance maximale 1) : l'arbre est construit par
+         linkage_sparse et le score des coupes calculé sur la matrice creuse, sans matrice n x n.
+      4. Construit l'arbre HAC complet (average linkage, celui d'AgglomerativeClustering). L'arbre ne dépend pas
+         du nombre de clusters : il est sauvegardé dans linkage_cache_dir, avec pour clé le contenu du fichier MGF
+         et les paramètres de distance, et relu aux exécutions suivantes (étapes 1-3 évitées) ; les statistiques
+         du calcul des distances ("blocking", "pruning", "cosine_greedy", "lsh") et les IDs des spectres
+         sont sauvegardés avec lui.
+      5. Coupe l'arbre pour chaque nombre de clusters de n_clusters ; avec auto_k, seule la coupe de meilleur
+         score de silhouette est conservée et les scores sont enregistrés dans le bloc performance ("cut_scores").
+      6. Attribue à chaque spectre (IDs lus dans le fichier binned, sauvegardés avec l'arbre) son label.
+      7. Pour chaque coupe conservée, génère un hash à partir des paramètres (en excluant les valeurs variables)
+         et sauvegarde les résultats dans un fichier JSON dans :
          "output/clustering_results/hac/spectra/<base_name>_Bin<bin_size>/".
          Le nom du fichier final intègre le nombre de clusters et le hash.
     
     Paramètres:
       - mgf_file: str           : Chemin du fichier MGF à traiter.
       - bin_size: float         : Taille du bin pour le binning.
-      - n_clusters: int         : Nombre de clusters à former avec HAC.
+      - n_clusters: int ou str  : Nombre(s) de clusters à former avec HAC : entier, liste ou plage
+                                  ("4", "2,4,8", "2-20", voir parse_cluster_counts).
       - opt: str                : Option pour le binning ("somme" ou "moyenne").
       - mz_min, mz_max: float    : Bornes pour le binning.
       - tol: float              : Tolérance pour le calcul de la matrice de distance.
       - num_workers: int        : Nombre de processus pour le calcul parallèle (facultatif).
-      - dist_method: str        : Méthode de calcul de distance, parmi "cosinus", "manhattan", "simple", "cosine_greedy".
+      - dist_method: str        : Méthode de calcul de distance, parmi les métriques du registre
+                                  (spectra.similarity.registry : "cosinus", "manhattan", "simple", "cosine_greedy", ...).
+      - precursor_tol: float    : Fenêtre de masse précurseur pour le blocking (None = désactivé).
+      - precursor_unit: str     : Unité de la fenêtre, "da" ou "ppm".
+      - dist_cutoff: float      : Si renseigné, seules les distances <= dist_cutoff sont calculées (matrice creuse,
+                                  distance maximale ailleurs) ; méthodes "cosinus" et "cosine_greedy", ou "simple" en mode LSH.
+      - lsh: bool               : Si True, seules les paires candidates MinHash/LSH sont calculées (méthode "simple").
+      - lsh_num_perm: int       : Longueur des signatures MinHash.
+      - lsh_bands: int          : Nombre de bandes LSH (plus de bandes = meilleur rappel, plus de candidats).
+      - lsh_recall_sample: int  : Taille de l'échantillon pour mesurer le rappel LSH (0 = pas de mesure).
+      - min_matched_peaks: int  : Pour "cosine_greedy", nombre minimal de pics appariés pour conserver une paire
+                                  (active la matrice creuse).
+      - auto_k: bool            : Choisit parmi n_clusters la coupe de meilleur score de silhouette.
+      - linkage_cache_dir: str  : Dossier du cache des arbres HAC (None : pas de cache).
     
     Retourne:
-      - output_file: str        : Chemin complet du fichier JSON contenant les résultats.
+      - output_files: list      : Chemins complets des fichiers JSON de résultats, un par coupe conservée.
     """
-    # 1. Binning : création du dossier temporaire pour le fichier binned
-    tmp_binned_dir = os.path.join("output", "tmp", f"binned_adducts_{bin_size}")
-    os.makedirs(tmp_binned_dir, exist_ok=True)
-    
-    # Appliquer le binning sur le fichier MGF en utilisant l'option "somme" ou "moyenne"
-    binned_file = bin_file(mgf_file, tmp_binned_dir, bin_size=bin_size, opt=opt)
-    logger.info("Binned file created: %s", binned_file)
-    
-    # 2. Génération de la matrice de distance
-    tmp_matrix_dir = os.path.join("output", "tmp", f"matrix_{bin_size}_{dist_method}")
-    os.makedirs(tmp_matrix_dir, exist_ok=True)
-    distance_csv = make_matrix_for_file(binned_file, methode=dist_method, output_dir=tmp_matrix_dir, tol=tol, num_workers=num_workers)
-    logger.info("Distance matrix CSV created: %s", distance_csv)
-    
-    # 3. Lecture de la matrice de distance
-    distance_matrix = read_matrix(distance_csv)
-    
-    # 4. Exécuter le clustering HAC sur la matrice de distance
-    labels = run_hac(distance_matrix, n_clusters=n_clusters)
-    
-    # 5. Recharger les spectres depuis le fichier binned
-    spectra_list = list(load_from_mgf(binned_file))
-    results = []
-    for i, spec in enumerate(spectra_list):
-        spec_id = spec.metadata.get("id")
-        results.append({"id": spec_id, "cluster": int(labels[i])})
-    
-    # 6. Préparer les paramètres et générer un hash
-    params = {
-        "mgf_file": mgf_file,
+    cluster_counts = parse_cluster_counts(n_clusters)
+    performance = {}
+    distances = {}
+    binned = {}
+    sparse_mode = dist_cutoff is not None or lsh or min_matched_peaks is not None
+
+    def binned_file():
+        # 1. Binning (option "somme" ou "moyenne") dans le dossier temporaire, au premier besoin seulement
+        if "path" not in binned:
+            tmp_binned_dir = os.path.join("output", "tmp", f"binned_adducts_{bin_size}")
+            os.makedirs(tmp_binned_dir, exist_ok=True)
+            binned["path"] = bin_file(mgf_file, tmp_binned_dir, bin_size=bin_size, opt=opt)
+            logger.info("Binned file created: %s", binned["path"])
+        return binned["path"]
+
+    def distance_matrix():
+        # 2-3. Génération (ou relecture) de la matrice de distance
+        if "matrix" in distances:
+            return distances["matrix"]
+        tmp_matrix_dir = os.path.join("output", "tmp", f"matrix_{bin_size}_{dist_method}")
+        os.makedirs(tmp_matrix_dir, exist_ok=True)
+        if sparse_mode:
+            # Statistiques de la matrice creuse, sous la clé de son mode de calcul
+            stats_key = "lsh" if lsh else "cosine_greedy" if dist_method == "cosine_greedy" else "pruning"
+            distance_npz, performance[stats_key] = make_sparse_matrix_for_file(
+                binned_file(), methode=dist_method, output_dir=tmp_matrix_dir, cutoff=dist_cutoff,
+                precursor_tol=precursor_tol, precursor_unit=precursor_unit, tol=tol,
+                lsh=lsh, num_perm=lsh_num_perm, bands=lsh_bands, recall_sample=lsh_recall_sample,
+                min_matches=min_matched_peaks, num_workers=num_workers)
+            logger.info("Sparse distance matrix created: %s", distance_npz)
+            # Matrice creuse lue telle quelle : les paires absentes valent la distance maximale 1
+            # (linkage_sparse, distance_silhouette), sans matrice n x n
+            distances["matrix"] = read_sparse_matrix(distance_npz)
+        else:
+            distance_csv, blocking_stats = make_matrix_for_file(binned_file(), methode=dist_method, output_dir=tmp_matrix_dir, tol=tol, num_workers=num_workers,
+                                                                precursor_tol=precursor_tol, precursor_unit=precursor_unit)
+            logger.info("Distance matrix CSV created: %s", distance_csv)
+            if blocking_stats:
+                performance["blocking"] = blocking_stats
+            distances["matrix"] = read_matrix(distance_csv)
+        return distances["matrix"]
+
+    # 4. Arbre HAC complet (average linkage), sauvegardé avec pour clé l'entrée et la métrique
+    tree_key = {
+        "mgf_md5": file_digest(mgf_file),
         "bin_size": bin_size,
-        "n_clusters": n_clusters,
         "opt": opt,
         "mz_min": mz_min,
         "mz_max": mz_max,
         "tol": tol,
-        "dist_method": dist_method
+        "dist_method": dist_method,
+        "precursor_tol": precursor_tol,
+        "precursor_unit": precursor_unit,
+        "dist_cutoff": dist_cutoff,
+        "lsh": lsh,
+        "lsh_num_perm": lsh_num_perm,
+        "lsh_bands": lsh_bands,
+        "min_matched_peaks": min_matched_peaks,
+        "linkage": "average"
     }
-    performance = {}  # Vous pouvez ajouter d'autres métriques si nécessaire
-    
-    hash_val = generate_hash(params)
+
+    def build_tree():
+        if sparse_mode:
+            tree = linkage_sparse(distance_matrix(), "average", max_distance=1.0)
+        else:
+            tree = linkage_square(distance_matrix(), "average")
+        # 6. IDs des spectres, lus dans le fichier binned
+        spectra_ids = [spec.metadata.get("id") for spec in load_from_mgf(binned_file())]
+        stats = {name: performance[name] for name in ("blocking", "pruning", "cosine_greedy", "lsh")
+                 if name in performance}
+        return tree, {"spectra_ids": spectra_ids, "performance": stats}
+
+    tree, extras, performance["linkage_tree"] = cached_linkage(linkage_cache_dir, tree_key, build_tree)
+    performance.update(extras["performance"])
+    spectra_ids = extras["spectra_ids"]
+
+    # 5. Coupes de l'arbre pour chaque nombre de clusters (score de silhouette en mode automatique)
+    cuts = sweep_cuts(tree, cluster_counts, distance_matrix() if auto_k else None)
+    if auto_k:
+        performance["cut_scores"] = {k: cut["silhouette"] for k, cut in cuts.items()}
+        selected = [max(cuts, key=lambda k: cuts[k]["silhouette"])]
+        performance["selected_n_clusters"] = selected[0]
+        logger.info("Selected n_clusters=%d (silhouette %.4f)", selected[0], cuts[selected[0]]["silhouette"])
+    else:
+        selected = list(cuts)
+
     base_name = os.path.splitext(os.path.basename(mgf_file))[0]
     results_dir = os.path.join("output", "clustering_results", "hac", "spectra", f"{base_name}_Bin{bin_size}")
     os.makedirs(results_dir, exist_ok=True)
-    output_file = os.path.join(results_dir, f"{base_name}_hac_{n_clusters}_{hash_val}.json")
-    
-    write_json_results(params, performance, results, output_file)
-    logger.info("HAC clustering pipeline completed. Results saved in %s", output_file)
-    return output_file
+    output_files = []
+    for k in selected:
+        labels = cuts[k]["labels"]
+        results = [{"id": spec_id, "cluster": int(labels[i])} for i, spec_id in enumerate(spectra_ids)]
+        
+        # 7. Préparer les paramètres, générer un hash et sauvegarder
+        params = {
+            "mgf_file": mgf_file,
+            "bin_size": bin_size,
+            "n_clusters": k,
+            "opt": opt,
+            "mz_min": mz_min,
+            "mz_max": mz_max,
+            "tol": tol,
+            "dist_method": dist_method,
+            "precursor_tol": precursor_tol,
+            "precursor_unit": precursor_unit,
+            "dist_cutoff": dist_cutoff,
+            "lsh": lsh,
+            "lsh_num_perm": lsh_num_perm,
+            "lsh_bands": lsh_bands,
+            "min_matched_peaks": min_matched_peaks,
+            "auto_k_candidates": cluster_counts if auto_k else None
+        }
+        cut_performance = dict(performance, n_clusters=k, cut_height=cuts[k]["height"], cut_seconds=cuts[k]["seconds"])
+        hash_val = generate_hash(params)
+        output_file = os.path.join(results_dir, f"{base_name}_hac_{k}_{hash_val}.json")
+        write_json_results(params, cut_performance, results, output_file)
+        logger.info("HAC clustering pipeline completed (k=%d). Results saved in %s", k, output_file)
+        output_files.append(output_file)
+    return output_files
 
 if __name__ == "__main__":
     import sys
@@ -104,7 +205,7 @@ if __name__ == "__main__":
         sys.exit(1)
     mgf_file = sys.argv[1]
     bin_size = float(sys.argv[2])
-    n_clusters = int(sys.argv[3])
+    n_clusters = sys.argv[3]
     mz_min = float(sys.argv[4]) if len(sys.argv) > 4 else 20
     mz_max = float(sys.argv[5]) if len(sys.argv) > 5 else 2000
     tol = float(sys.argv[6]) if len(sys.argv) > 6 else 0.1
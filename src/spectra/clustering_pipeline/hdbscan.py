@@ -3,17 +3,26 @@ import time
 import logging
 import numpy as np
 from spectra.similarity.binning import bin_file
-from spectra.similarity.matrix import make_matrix_for_file, read_matrix
-from clustering_utilis.hdbscan import apply_hdbscan
+from spectra.similarity.matrix import make_matrix_for_file, read_matrix, make_sparse_matrix_for_file, read_sparse_matrix
+from spectra.similarity.features import (feature_matrix, feature_distances, core_distances, spectra_knn_graph,
+                                         FEATURE_METHODS, KNN_METHODS)
+from clustering_utilis.hdbscan import (hdbscan_linkage_tree, mutual_reachability_mst, mst_linkage_tree,
+                                       sweep_min_cluster_sizes)
+from clustering_utilis.hac import parse_cluster_counts
 from clustering_utilis.common import generate_hash, write_json_results
 from matchms.importing import load_from_mgf
 
 logger = logging.getLogger(__name__)
 
-def run_hdbscan_pipeline(mgf_file: str, bin_size: float, n_clusters: int,
-                           min_samples: int,
+def run_hdbscan_pipeline(mgf_file: str, bin_size: float, n_clusters,
+                           min_samples,
                            opt: str = 'somme', mz_min: float = 20, mz_max: float = 2000,
-                           tol: float = 0.1, num_workers: int = None, dist_method: str = "cosinus") -> str:
+                           tol: float = 0.1, num_workers: int = None, dist_method: str = "cosinus",
+                           precursor_tol: float = None, precursor_unit: str = "da",
+                           dist_cutoff: float = None, lsh: bool = False, lsh_num_perm: int = 128,
+                           lsh_bands: int = 32, lsh_recall_sample: int = 0,
+                           min_matched_peaks: int = None, feature_space: bool = False,
+                           knn: int = 0, mutual_knn: bool = False):
     """
     Exécute le pipeline de clustering HDBSCAN sur un fichier MGF de spectres.
     
@@ -23,61 +32,132 @@ def run_hdbscan_pipeline(mgf_file: str, bin_size: float, n_clusters: int,
       2. Génère la matrice de distances à partir du fichier binned en utilisant make_matrix_for_file
          avec la méthode dist_method et la tolérance tol.
          Le CSV est sauvegardé dans "output/tmp/matrix_<bin_size>_<dist_method>".
-      3. Lit la matrice de distances (avec read_matrix) et applique HDBSCAN (apply_hdbscan) pour obtenir les labels.
-      4. Recharge les spectres depuis le fichier binned pour générer les résultats.
+      3. Lit la matrice de distances (avec read_matrix).
+         Avec feature_space, les étapes 2-3 sont remplacées par HDBSCAN sur les vecteurs binned eux-mêmes
+         (features.feature_matrix) : distances de cœur par blocs (une seule recherche de plus proches voisins
+         pour toutes les valeurs de min_samples), arbre couvrant de portée mutuelle construit
+         par Prim une ligne de distances à la fois (mutual_reachability_mst), mêmes labels ; avec knn > 0,
+         par HDBSCAN sur le graphe creux des knn plus proches voisins (spectra_knn_graph, voisins mutuels
+         avec mutual_knn), knn étant porté au moins à min_samples. La matrice n x n n'est jamais construite.
+      4. Construit, pour chaque valeur de min_samples, l'arbre de fusion de HDBSCAN (distances de cœur et arbre
+         couvrant de portée mutuelle), qui ne dépend pas de min_cluster_size.
+      5. Extrait de cet arbre le clustering de chaque min_cluster_size (n_clusters) : arbre condensé et sélection
+         des clusters, sans recalculer les distances ni l'arbre couvrant.
+      6. Recharge les spectres depuis le fichier binned pour générer les résultats.
          Pour chaque spectre, l'ID est récupéré via spec.metadata.get("id"). S'il n'existe pas, on utilise (index+1).
-      5. Génère un hash à partir des paramètres (en excluant les valeurs variables) et sauvegarde
-         les résultats dans un fichier JSON dans :
+      7. Pour chaque combinaison, génère un hash à partir des paramètres (en excluant les valeurs variables)
+         et sauvegarde les résultats dans un fichier JSON dans :
          "output/clustering_results/hdbscan/spectra/<base_name>_Bin<bin_size>/".
          Le nom du fichier final inclut n_clusters et le hash.
+      8. Avec plusieurs combinaisons, sauvegarde dans le même dossier un résumé du balayage
+         "<base_name>_hdbscan_sweep_<hash>.json" : une ligne par combinaison (nombre de clusters, points de bruit,
+         temps de l'arbre et de l'extraction, fichier de résultats).
     
     Paramètres :
       - mgf_file: str           : Chemin du fichier MGF à traiter.
       - bin_size: float         : Taille du bin pour le binning.
-      - n_clusters: int         : Nombre de clusters (utilisé ici comme min_cluster_size pour HDBSCAN).
-      - min_samples: int        : Nombre minimum d'échantillons pour HDBSCAN.
+      - n_clusters: int ou str  : Nombre de clusters (utilisé ici comme min_cluster_size pour HDBSCAN) ; liste
+                                  ou plage pour un balayage ("5,10,20", "2-30:2", voir parse_cluster_counts).
+      - min_samples: int ou str : Nombre minimum d'échantillons pour HDBSCAN (même syntaxe que n_clusters).
       - opt: str                : Option pour le binning ("somme" ou "moyenne").
       - mz_min, mz_max: float    : Bornes pour le binning.
       - tol: float              : Tolérance pour le calcul de la matrice de distance.
       - num_workers: int        : Nombre de workers pour le calcul parallèle (facultatif).
-      - dist_method: str        : Méthode de calcul de distance ("cosinus", "manhattan", "simple" ou "cosine_greedy").
+      - dist_method: str        : Méthode de calcul de distance, parmi les métriques du registre
+                                  (spectra.similarity.registry : "cosinus", "manhattan", "simple", "cosine_greedy", ...).
+      - precursor_tol: float    : Fenêtre de masse précurseur pour le blocking (None = désactivé).
+      - precursor_unit: str     : Unité de la fenêtre, "da" ou "ppm".
+      - dist_cutoff: float      : Si renseigné, seules les distances <= dist_cutoff sont calculées (matrice creuse,
+                                  distance maximale ailleurs) ; méthodes "cosinus" et "cosine_greedy", ou "simple" en mode LSH.
+      - lsh: bool               : Si True, seules les paires candidates MinHash/LSH sont calculées (méthode "simple").
+      - lsh_num_perm: int       : Longueur des signatures MinHash.
+      - lsh_bands: int          : Nombre de bandes LSH (plus de bandes = meilleur rappel, plus de candidats).
+      - lsh_recall_sample: int  : Taille de l'échantillon pour mesurer le rappel LSH (0 = pas de mesure).
+      - min_matched_peaks: int  : Pour "cosine_greedy", nombre minimal de pics appariés pour conserver une paire
+                                  (active la matrice creuse).
+      - feature_space: bool     : HDBSCAN dans l'espace des bins, sans matrice de distances ("cosinus" ou "manhattan").
+      - knn: int                : Nombre de plus proches voisins du graphe creux (défaut : 0, matrice ; "cosinus").
+      - mutual_knn: bool        : Ne garde que les voisins mutuels dans le graphe des knn plus proches voisins.
     
     Retourne:
-      - output_file: str        : Chemin complet du fichier JSON contenant les résultats.
+      - output_files: list      : Chemins complets des fichiers JSON de résultats, un par combinaison.
     """
+    matrix_options = dist_cutoff is not None or lsh or min_matched_peaks is not None or precursor_tol is not None
+    if feature_space and knn > 0:
+        raise ValueError("feature_space and knn cannot be combined")
+    if (feature_space or knn > 0) and matrix_options:
+        raise ValueError("feature_space and knn do not support precursor blocking, dist_cutoff, lsh or min_matched_peaks")
+    if feature_space and dist_method not in FEATURE_METHODS:
+        raise ValueError(f"Feature-space distances are available for: {', '.join(FEATURE_METHODS)}")
+    if knn > 0 and dist_method not in KNN_METHODS:
+        raise ValueError(f"k-nearest-neighbour graphs are available for: {', '.join(KNN_METHODS)}")
+    min_cluster_sizes = parse_cluster_counts(n_clusters)
+    min_samples_values = parse_cluster_counts(min_samples, "min_samples")
+    
     # 1. Appliquer le binning
     tmp_binned_dir = os.path.join("output", "tmp", f"binned_adducts_{bin_size}")
     os.makedirs(tmp_binned_dir, exist_ok=True)
     binned_file = bin_file(mgf_file, tmp_binned_dir, bin_size=bin_size, opt=opt)
     logger.info("Binned file created: %s", binned_file)
     
-    # 2. Générer la matrice de distances
-    tmp_matrix_dir = os.path.join("output", "tmp", f"matrix_{bin_size}_{dist_method}")
-    os.makedirs(tmp_matrix_dir, exist_ok=True)
-    distance_csv = make_matrix_for_file(binned_file, methode=dist_method, output_dir=tmp_matrix_dir, tol=tol, num_workers=num_workers)
-    logger.info("Distance matrix CSV created: %s", distance_csv)
-    
-    # 3. Lire la matrice de distances
-    distance_matrix = read_matrix(distance_csv)
-    
-    # 4. Appliquer HDBSCAN sur la matrice de distances
-    labels, max_label = apply_hdbscan(distance_matrix, min_cluster_size=n_clusters, min_samples=min_samples)
-    
-    # === Attribution des points bruit à des clusters uniques ===
-    current_cluster_id = max_label + 1
-    for idx, cluster in enumerate(labels):
-        if cluster == -1:
-            labels[idx] = current_cluster_id
-            current_cluster_id += 1
-    # ====================================================
+    performance = {}
+    knn_stats = {}
+    if feature_space or knn > 0:
+        logging.getLogger("matchms").setLevel(logging.ERROR)
+    if feature_space:
+        # 2-3. Vecteurs binned, sans matrice de distances
+        features = feature_matrix(list(load_from_mgf(binned_file)), dist_method)
+        performance["feature_space"] = {"n_features": int(features.shape[1])}
+        # Distances de cœur de toutes les valeurs de min_samples, par une seule recherche de plus proches voisins
+        cores = core_distances(features, min_samples_values, dist_method, n_jobs=num_workers or -1)
+    elif knn > 0:
+        # 2-3. Graphes creux des k plus proches voisins, construits à la demande (un par valeur de k)
+        spectra = list(load_from_mgf(binned_file))
+        graphs = {}
+    elif dist_cutoff is not None or lsh or min_matched_peaks is not None:
+        # 2. Générer la matrice de distances creuse
+        tmp_matrix_dir = os.path.join("output", "tmp", f"matrix_{bin_size}_{dist_method}")
+        os.makedirs(tmp_matrix_dir, exist_ok=True)
+        # Statistiques de la matrice creuse, sous la clé de son mode de calcul
+        stats_key = "lsh" if lsh else "cosine_greedy" if dist_method == "cosine_greedy" else "pruning"
+        distance_npz, performance[stats_key] = make_sparse_matrix_for_file(
+            binned_file, methode=dist_method, output_dir=tmp_matrix_dir, cutoff=dist_cutoff,
+            precursor_tol=precursor_tol, precursor_unit=precursor_unit, tol=tol,
+            lsh=lsh, num_perm=lsh_num_perm, bands=lsh_bands, recall_sample=lsh_recall_sample,
+            min_matches=min_matched_peaks, num_workers=num_workers)
+        logger.info("Sparse distance matrix created: %s", distance_npz)
+        # 3. HDBSCAN travaille directement sur la matrice creuse
+        distance_matrix = read_sparse_matrix(distance_npz)
+    else:
+        # 2. Générer la matrice de distances
+        tmp_matrix_dir = os.path.join("output", "tmp", f"matrix_{bin_size}_{dist_method}")
+        os.makedirs(tmp_matrix_dir, exist_ok=True)
+        distance_csv, blocking_stats = make_matrix_for_file(binned_file, methode=dist_method, output_dir=tmp_matrix_dir, tol=tol, num_workers=num_workers,
+                                                            precursor_tol=precursor_tol, precursor_unit=precursor_unit)
+        logger.info("Distance matrix CSV created: %s", distance_csv)
+        if blocking_stats:
+            performance["blocking"] = blocking_stats
+        
+        # 3. Lire la matrice de distances
+        distance_matrix = read_matrix(distance_csv)
+
+    def build_tree(samples):
+        # 4. Arbre de fusion de HDBSCAN (distances de cœur et arbre couvrant), qui ne dépend que de min_samples
+        if feature_space:
+            return mst_linkage_tree(mutual_reachability_mst(cores[samples], lambda i: feature_distances(features, i, dist_method)))
+        if knn > 0:
+            k = max(knn, samples)
+            if k not in graphs:
+                graphs[k], knn_stats[k] = spectra_knn_graph(spectra, k, dist_method, mutual=mutual_knn,
+                                                            n_jobs=num_workers or -1)
+            return hdbscan_linkage_tree(graphs[k], samples)
+        return hdbscan_linkage_tree(distance_matrix, samples)
     
-    # 5. Recharger les spectres depuis le fichier binned
+    # 6. Recharger les spectres depuis le fichier binned (IDs des résultats)
     spectra_list = list(load_from_mgf(binned_file))
-    results = []
-    for i, spec in enumerate(spectra_list):
-        spec_id = spec.metadata.get("id")
-        results.append({"id": spec_id, "cluster": int(labels[i])})
-    
+    base_name = os.path.splitext(os.path.basename(mgf_file))[0]
+    results_dir = os.path.join("output", "clustering_results", "hdbscan", "spectra", f"{base_name}_Bin{bin_size}")
+    os.makedirs(results_dir, exist_ok=True)
     params = {
         "mgf_file": mgf_file,
         "bin_size": bin_size,
@@ -87,19 +167,65 @@ def run_hdbscan_pipeline(mgf_file: str, bin_size: float, n_clusters: int,
         "mz_min": mz_min,
         "mz_max": mz_max,
         "tol": tol,
-        "dist_method": dist_method
+        "dist_method": dist_method,
+        "precursor_tol": precursor_tol,
+        "precursor_unit": precursor_unit,
+        "dist_cutoff": dist_cutoff,
+        "lsh": lsh,
+        "lsh_num_perm": lsh_num_perm,
+        "lsh_bands": lsh_bands,
+        "min_matched_peaks": min_matched_peaks,
+        "feature_space": feature_space,
+        "knn": knn,
+        "mutual_knn": mutual_knn if knn > 0 else None
     }
-    performance = {"max_label": max_label}
-    
-    hash_val = generate_hash(params)
-    base_name = os.path.splitext(os.path.basename(mgf_file))[0]
-    results_dir = os.path.join("output", "clustering_results", "hdbscan", "spectra", f"{base_name}_Bin{bin_size}")
-    os.makedirs(results_dir, exist_ok=True)
-    output_file = os.path.join(results_dir, f"{base_name}_hdbscan_{n_clusters}_{hash_val}.json")
+    output_files = []
+    summary = []
+    for samples in min_samples_values:
+        deb = time.time()
+        tree = build_tree(samples)
+        tree_seconds = time.time() - deb
+        logger.info("HDBSCAN tree built for min_samples=%d in %.2f s", samples, tree_seconds)
+        # 5. Clusterings de chaque min_cluster_size, extraits du même arbre
+        for size, extraction in sweep_min_cluster_sizes(tree, min_cluster_sizes).items():
+            labels, max_label = extraction["labels"].copy(), extraction["max_label"]
+            
+            # === Attribution des points bruit à des clusters uniques ===
+            current_cluster_id = max_label + 1
+            for idx, cluster in enumerate(labels):
+                if cluster == -1:
+                    labels[idx] = current_cluster_id
+                    current_cluster_id += 1
+            # ====================================================
+            
+            results = []
+            for i, spec in enumerate(spectra_list):
+                spec_id = spec.metadata.get("id")
+                results.append({"id": spec_id, "cluster": int(labels[i])})
+            
+            # 7. Paramètres de la combinaison, hash et sauvegarde
+            combination = dict(params, n_clusters=size, min_samples=samples)
+            combination_performance = dict(performance, max_label=max_label, tree_seconds=tree_seconds,
+                                           extract_seconds=extraction["seconds"])
+            if knn > 0:
+                combination_performance["knn"] = knn_stats[max(knn, samples)]
+            hash_val = generate_hash(combination)
+            output_file = os.path.join(results_dir, f"{base_name}_hdbscan_{size}_{hash_val}.json")
+            write_json_results(combination, combination_performance, results, output_file)
+            logger.info("HDBSCAN clustering pipeline for spectra completed (min_cluster_size=%d, min_samples=%d). "
+                        "Results saved in %s", size, samples, output_file)
+            output_files.append(output_file)
+            summary.append({"n_clusters": size, "min_samples": samples, "clusters": max_label + 1,
+                            "noise": extraction["noise"], "tree_seconds": tree_seconds,
+                            "extract_seconds": extraction["seconds"], "output_file": output_file})
     
-    write_json_results(params, performance, results, output_file)
-    logger.info("HDBSCAN clustering pipeline for spectra completed. Results saved in %s", output_file)
-    return output_file
+    if len(output_files) > 1:
+        # 8. Résumé du balayage : une ligne par combinaison
+        params["n_clusters"], params["min_samples"] = min_cluster_sizes, min_samples_values
+        summary_file = os.path.join(results_dir, f"{base_name}_hdbscan_sweep_{generate_hash(params)}.json")
+        write_json_results(params, dict(performance, combinations=len(summary)), summary, summary_file)
+        logger.info("HDBSCAN sweep summary (%d combinations) saved in %s", len(summary), summary_file)
+    return output_files
 
 if __name__ == "__main__":
     import sys
@@ -109,8 +235,8 @@ if __name__ == "__main__":
         sys.exit(1)
     mgf_file = sys.argv[1]
     bin_size = float(sys.argv[2])
-    n_clusters = int(sys.argv[3])
-    min_samples = int(sys.argv[4])
+    n_clusters = sys.argv[3]
+    min_samples = sys.argv[4]
     mz_min = float(sys.argv[5]) if len(sys.argv) > 5 else 20
     mz_max = float(sys.argv[6]) if len(sys.argv) > 6 else 2000
     tol = float(sys.argv[7]) if len(sys.argv) > 7 else 0.1
@@ -1,13 +1,15 @@
 import os
+import time
 import numpy as np
 import logging
 import json
 import hashlib
 from datetime import datetime
 from matchms.importing import load_from_mgf
-from spectra.similarity.binning import fixed_binning_vector
+from spectra.similarity.binning import fixed_binning_csr
 from clustering_utilis.kmeans import normalize_features, select_best_k, run_kmeans
 from clustering_utilis.common import generate_hash, write_json_results
+from clustering_utilis.reduction import fit_reduction, save_reduction
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +17,8 @@ def load_feature_matrix(mgf_file, bin_size, mz_min=20, mz_max=2000):
     """
     Charge les spectres depuis un fichier MGF et calcule leur vecteur de caractéristiques
     via fixed binning (sans normalisation, celle-ci sera appliquée par la suite).
+    La matrice est construite directement sous forme creuse (fixed_binning_csr) : avec des bins fins,
+    la plupart des colonnes de chaque spectre sont vides.
     
     Arguments:
       - mgf_file: str, chemin vers le fichier MGF.
@@ -23,35 +27,69 @@ def load_feature_matrix(mgf_file, bin_size, mz_min=20, mz_max=2000):
       - mz_max: float, valeur maximale de m/z (défaut=2000).
     
     Retourne:
-      - X: matrice numpy de dimension (n_spectres, n_bins)
+      - X: matrice creuse (scipy.sparse.csr_matrix) de dimension (n_spectres, n_bins)
       - spectra_list: liste des spectres chargés (pour récupérer les métadonnées).
     """
     logger.info("Loading spectra from %s", mgf_file)
     spectra_list = list(load_from_mgf(mgf_file))
-    features = [fixed_binning_vector(spec, bin_size, mz_min, mz_max) for spec in spectra_list]
-    X = np.vstack(features)
-    logger.info("Feature matrix shape: %s", X.shape)
+    X = fixed_binning_csr(spectra_list, bin_size, mz_min, mz_max)
+    logger.info("Feature matrix shape: %s (%d non-zero values)", X.shape, X.nnz)
     return X, spectra_list
 
+def select_and_cluster(X, k_min, k_max, n_init=10, random_state=42, algorithm='mini', n_jobs=-1):
+    """
+    Sélection du meilleur k (select_best_k) puis clustering kmeans final, chronométrés ensemble.
+
+    Retourne:
+      - tuple: (best_k, scores, labels, centers, silhouette, temps en secondes).
+    """
+    deb = time.perf_counter()
+    best_k, scores = select_best_k(X, k_min, k_max, n_init, random_state, algorithm, n_jobs)
+    labels, centers, silhouette = run_kmeans(X, best_k, n_init, random_state, algorithm)
+    return best_k, scores, labels, centers, silhouette, time.perf_counter() - deb
+
 def run_clustering_pipeline(mgf_file, bin_size, k_min, k_max, n_init=10, random_state=42,
-                            algorithm='mini', mz_min=20, mz_max=2000, n_jobs=-1):
+                            algorithm='mini', mz_min=20, mz_max=2000, n_jobs=-1,
+                            reduction=None, n_components=256, measure_speedup=False):
     """
     Exécute le pipeline de clustering kmeans sur un fichier MGF de spectres.
     
     Étapes :
-      1. Charge le fichier MGF et calcule la matrice de caractéristiques via fixed binning.
+      1. Charge le fichier MGF et calcule la matrice creuse de caractéristiques via fixed binning.
       2. Normalise la matrice par L2.
-      3. Sélectionne le meilleur nombre de clusters (k) par score de silhouette.
-      4. Exécute le clustering kmeans.
-      5. Génère un hash à partir des paramètres.
-      6. Sauvegarde les résultats dans un fichier JSON.
+      3. Optionnellement, réduit la dimension (reduction="random_projection" ou "svd", n_components dimensions).
+         La projection ajustée est sauvegardée (joblib) à côté du JSON pour projeter de nouveaux spectres ;
+         la variance expliquée et le temps d'ajustement sont ajoutés aux performances.
+      4. Sélectionne le meilleur nombre de clusters (k) par score de silhouette.
+      5. Exécute le clustering kmeans. Le temps des étapes 4-5 est ajouté aux performances ; avec measure_speedup
+         et une réduction, les étapes 4-5 sont aussi exécutées sur les caractéristiques d'origine pour mesurer
+         le gain de temps réel de la réduction (le calcul de référence double le temps d'exécution).
+      6. Génère un hash à partir des paramètres.
+      7. Sauvegarde les résultats dans un fichier JSON.
     
     Retourne le chemin du fichier JSON généré.
     """
     X, spectra_list = load_feature_matrix(mgf_file, bin_size, mz_min, mz_max)
     X_norm = normalize_features(X)
-    best_k, scores = select_best_k(X_norm, k_min, k_max, n_init, random_state, algorithm, n_jobs)
-    labels, centers, silhouette = run_kmeans(X_norm, best_k, n_init, random_state, algorithm)
+    reduction_model, reduction_info = None, None
+    if reduction is not None:
+        deb = time.perf_counter()
+        reduction_model, X_reduced, reduction_info = fit_reduction(X_norm, reduction, n_components, random_state)
+        reduction_info["fit_seconds"] = time.perf_counter() - deb
+        if measure_speedup:
+            # Référence : sélection de k et kmeans sur les caractéristiques d'origine (creuses)
+            *_, reduction_info["clustering_seconds_original"] = select_and_cluster(
+                X_norm, k_min, k_max, n_init, random_state, algorithm, n_jobs)
+        X_norm = X_reduced
+    best_k, scores, labels, centers, silhouette, clustering_seconds = select_and_cluster(
+        X_norm, k_min, k_max, n_init, random_state, algorithm, n_jobs)
+    if reduction_info is not None and measure_speedup:
+        original = reduction_info["clustering_seconds_original"]
+        reduction_info["clustering_seconds_reduced"] = clustering_seconds
+        reduction_info["speedup"] = original / (clustering_seconds + reduction_info["fit_seconds"])
+        logger.info("select_best_k + kmeans: %.2f s (original) vs %.2f s (reduced, with %.2f s of fitting), "
+                    "speedup x%.1f.", original, clustering_seconds, reduction_info["fit_seconds"],
+                    reduction_info["speedup"])
     
     # Construction des résultats
     results = []
@@ -69,9 +107,11 @@ def run_clustering_pipeline(mgf_file, bin_size, k_min, k_max, n_init=10, random_
         "random_state": random_state,
         "algorithm": algorithm,
         "mz_min": mz_min,
-        "mz_max": mz_max
+        "mz_max": mz_max,
+        "reduction": reduction,
+        "n_components": n_components if reduction is not None else None
     }
-    performance = {"silhouette_score": silhouette, "scores": scores}
+    performance = {"silhouette_score": silhouette, "scores": scores, "clustering_seconds": clustering_seconds}
     
     # Générer un hash des paramètres (pour inclure une signature stable dans le nom du fichier)
     hash_val = generate_hash(params)
@@ -81,6 +121,10 @@ def run_clustering_pipeline(mgf_file, bin_size, k_min, k_max, n_init=10, random_
     os.makedirs(results_dir, exist_ok=True)
     # Le nom final inclut le nom de base, l'algorithme, le nombre de clusters, et le hash
     output_file = os.path.join(results_dir, f"{base_name}_kmeans_{algorithm}_{best_k}_{hash_val}.json")
+    if reduction_model is not None:
+        reduction_info["model_file"] = output_file[:-5] + f"_{reduction}.joblib"
+        save_reduction(reduction_model, reduction_info["model_file"])
+        performance["reduction"] = reduction_info
     
     write_json_results(params, performance, results, output_file)
     logger.info("Clustering pipeline completed. Results saved in %s", output_file)
@@ -90,7 +134,7 @@ if __name__ == "__main__":
     import sys
     logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
     if len(sys.argv) < 6:
-        print("Usage: kmeans.py <mgf_file> <bin_size> <k_min> <k_max> <algorithm> [n_init] [random_state] [mz_min] [mz_max]")
+        print("Usage: kmeans.py <mgf_file> <bin_size> <k_min> <k_max> <algorithm> [n_init] [random_state] [mz_min] [mz_max] [reduction] [n_components] [measure_speedup]")
         sys.exit(1)
     mgf_file = sys.argv[1]
     bin_size = float(sys.argv[2])
@@ -101,5 +145,9 @@ if __name__ == "__main__":
     random_state = int(sys.argv[7]) if len(sys.argv) > 7 else 42
     mz_min = float(sys.argv[8]) if len(sys.argv) > 8 else 20
     mz_max = float(sys.argv[9]) if len(sys.argv) > 9 else 2000
+    reduction = sys.argv[10] if len(sys.argv) > 10 else None
+    n_components = int(sys.argv[11]) if len(sys.argv) > 11 else 256
     
-    run_clustering_pipeline(mgf_file, bin_size, k_min, k_max, n_init, random_state, algorithm, mz_min, mz_max)
\ No newline at end of file
+    measure_speedup = len(sys.argv) > 12 and sys.argv[12].lower() in ("1", "true", "yes")
+    run_clustering_pipeline(mgf_file, bin_size, k_min, k_max, n_init, random_state, algorithm, mz_min, mz_max,
+                            reduction=reduction, n_components=n_components, measure_speedup=measure_speedup)
\ No newline at end of file
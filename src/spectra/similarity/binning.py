@@ -1,8 +1,9 @@
 import os
+import json
 import time
 import numpy as np
 from matchms.exporting import save_as_mgf
-from utils.file_utils import load_mgf_file, new_dir
+from utils.file_utils import load_mgf_file, new_dir, file_digest
 from matchms import Spectrum
 import logging
 import config
@@ -61,12 +62,66 @@ def fixed_binning_vector(spec, bin_size, mz_min=20, mz_max=2000):
     feature, _ = np.histogram(spec.peaks.mz, bins=bins, weights=spec.peaks.intensities)
     return feature.astype(float)
 
+def fixed_binning_csr(spectra, bin_size, mz_min=20, mz_max=2000):
+    """
+    Matrice creuse (CSR) des vecteurs de fixed_binning_vector de plusieurs spectres, sans construire
+    la matrice dense (n_spectres, n_bins) : mêmes bins (bornes incluses comme np.histogram), mêmes valeurs
+    à l'arrondi près (ordre des sommes).
+
+    Arguments :
+      - spectra   : liste d'objets Spectrum.
+      - bin_size, mz_min, mz_max : voir fixed_binning_vector.
+
+    Retourne :
+      - scipy.sparse.csr_matrix (n_spectres, n_bins) en float64.
+    """
+    from scipy.sparse import coo_matrix
+    bins = np.arange(mz_min, mz_max + bin_size, bin_size)
+    n_bins = len(bins) - 1
+    counts = [len(spec.peaks.mz) for spec in spectra]
+    if sum(counts) == 0:
+        return coo_matrix((len(spectra), n_bins)).tocsr()
+    mz = np.concatenate([spec.peaks.mz for spec in spectra])
+    intensities = np.concatenate([spec.peaks.intensities for spec in spectra]).astype(float)
+    rows = np.repeat(np.arange(len(spectra)), counts)
+    cols = np.searchsorted(bins, mz, side="right") - 1
+    cols[mz == bins[-1]] = n_bins - 1  # la dernière borne est incluse, comme dans np.histogram
+    keep = (cols >= 0) & (cols < n_bins)
+    # Les pics d'un même bin sont additionnés lors de la conversion en CSR
+    return coo_matrix((intensities[keep], (rows[keep], cols[keep])), shape=(len(spectra), n_bins)).tocsr()
+
+def binned_spectra_to_csr(spectra):
+    """
+    Construit une matrice creuse (CSR) à partir de spectres déjà binned.
+
+    Après binning, les valeurs m/z des spectres sont des indices de bins entiers :
+    chaque bin devient une colonne de la matrice et les intensités les valeurs.
+
+    Arguments:
+      - spectra : liste d'objets Spectrum binned (voir binning).
+
+    Retourne:
+      - scipy.sparse.csr_matrix : matrice (n_spectres, n_bins) des intensités.
+    """
+    from scipy.sparse import csr_matrix
+    indptr = np.zeros(len(spectra) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(spec.peaks.mz) for spec in spectra])
+    if len(spectra) == 0 or indptr[-1] == 0:
+        return csr_matrix((len(spectra), 0))
+    indices = np.concatenate([spec.peaks.mz for spec in spectra]).astype(np.int64)
+    data = np.concatenate([spec.peaks.intensities for spec in spectra]).astype(float)
+    offset = min(indices.min(), 0)  # les bins sous config.MZ_FROM ont un indice négatif
+    return csr_matrix((data, indices - offset, indptr), shape=(len(spectra), int(indices.max() - offset) + 1))
+
 
 def bin_file(input_file: str, output_dir: str, bin_size: float = 1, opt: str = 'somme') -> str:
     """
     Applique le binning (avec normalisation) sur un fichier MGF unique et sauvegarde le résultat dans output_dir.
 
     Cette fonction utilise la méthode 'binning' (qui intègre la normalisation).
+    Les paramètres du binning et l'empreinte MD5 du fichier source sont enregistrés à côté du fichier binned
+    (<nom>_Bin<bin_size>.json) : si le fichier binned existe déjà pour la même source et les mêmes paramètres,
+    il est réutilisé tel quel (ni nouveau binning, ni suppression du dossier).
 
     Arguments:
       - input_file (str): chemin complet du fichier MGF à traiter.
@@ -77,15 +132,27 @@ def bin_file(input_file: str, output_dir: str, bin_size: float = 1, opt: str = '
     Retourne:
       - str: chemin complet du fichier binned généré.
     """
-    new_dir(output_dir)
     file = os.path.basename(input_file)
+    base_name = file[:-4]  # on retire l'extension .mgf
+    output_file_path = os.path.join(output_dir, f"{base_name}_Bin{bin_size}.mgf")
+    stamp_path = output_file_path[:-4] + ".json"
+    stamp = {"source_md5": file_digest(input_file), "bin_size": bin_size, "opt": opt, "mz_from": config.MZ_FROM}
+    if os.path.exists(output_file_path) and os.path.exists(stamp_path):
+        with open(stamp_path, "r") as f:
+            try:
+                current = json.load(f) == stamp
+            except json.JSONDecodeError:
+                current = False
+        if current:
+            logging.info(f"Binned file {output_file_path} is up to date, binning skipped.")
+            return output_file_path
+    new_dir(output_dir)
     print(f"Processing {file} ...")
     deb = time.time()
     spectra = list(load_mgf_file(input_file))
     binned_spectra = [binning(spec, bin_size, opt) for spec in spectra]
-    base_name = file[:-4]  # on retire l'extension .mgf
-    output_file = f"{base_name}_Bin{bin_size}.mgf"
-    output_file_path = os.path.join(output_dir, output_file)
     save_as_mgf(binned_spectra, output_file_path)
+    with open(stamp_path, "w") as f:
+        json.dump(stamp, f, indent=2)
     print(f"Binning execution in {time.time()-deb:.2f} s.")
     return output_file_path
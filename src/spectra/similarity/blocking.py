@@ -0,0 +1,58 @@
+import numpy as np
+
+PRECURSOR_UNITS = ("da", "ppm")
+
+def get_precursor_mz(spectra) -> np.ndarray:
+    """
+    Récupère la masse du précurseur (champ PEPMASS du MGF) de chaque spectre.
+
+    Arguments:
+      - spectra : liste d'objets Spectrum (matchms).
+
+    Retourne:
+      - np.ndarray : tableau (n,) des m/z des précurseurs, dans l'ordre des spectres.
+    """
+    precursors = np.empty(len(spectra), dtype=float)
+    for i, spec in enumerate(spectra):
+        precursor_mz = spec.get("precursor_mz")
+        if precursor_mz is None:
+            raise ValueError(
+                f"Le spectre {i} ne possède pas de PEPMASS : impossible d'appliquer le blocking par masse précurseur. "
+                "Relancez la commande 'process' pour conserver le PEPMASS dans les fichiers d'adduits."
+            )
+        precursors[i] = float(precursor_mz)
+    return precursors
+
+def precursor_window_bounds(precursor_mz: np.ndarray, tol: float, unit: str = "da"):
+    """
+    Trie les spectres par m/z du précurseur et calcule, pour chaque position du tri,
+    la borne (exclue) de la fenêtre de comparaison.
+
+    Une paire (p, q) du tri, avec p < q, est comparée si
+      - unit="da"  : mz[q] - mz[p] <= tol
+      - unit="ppm" : mz[q] - mz[p] <= tol * 1e-6 * mz[p]
+
+    Arguments:
+      - precursor_mz : np.ndarray, m/z des précurseurs.
+      - tol : float, largeur de la fenêtre.
+      - unit : str, "da" ou "ppm".
+
+    Retourne:
+      - tuple:
+          order : indices des spectres triés par m/z du précurseur.
+          ends  : pour chaque position p du tri, indice de fin (exclu) de la fenêtre.
+    """
+    if unit not in PRECURSOR_UNITS:
+        raise ValueError(f"Unité de fenêtre inconnue: {unit} (attendu: {', '.join(PRECURSOR_UNITS)})")
+    if tol < 0:
+        raise ValueError("La largeur de la fenêtre de masse précurseur doit être positive.")
+    order = np.argsort(precursor_mz, kind="mergesort")
+    sorted_mz = precursor_mz[order]
+    if unit == "da":
+        upper = sorted_mz + tol
+    else:
+        upper = sorted_mz * (1 + tol * 1e-6)
+    ends = np.searchsorted(sorted_mz, upper, side="right")
+    # La fenêtre commence toujours après la position courante
+    ends = np.maximum(ends, np.arange(1, len(sorted_mz) + 1))
+    return order, ends
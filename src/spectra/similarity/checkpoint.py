@@ -0,0 +1,118 @@
+"""
+Points de reprise du calcul des matrices de distances.
+
+Chaque bloc calculé est sauvegardé dans un fichier .npy du dossier de reprise, puis enregistré
+dans un journal (une ligne par bloc, ajoutée après l'écriture complète du bloc). Le fichier
+manifest.json décrit les paramètres du calcul : un dossier de reprise n'est réutilisé que si
+ces paramètres (contenu du fichier d'entrée, méthode, tolérance, fenêtre précurseur, taille des blocs)
+sont identiques. Le fichier d'entrée est identifié par son contenu et non par sa date : un fichier binned
+réécrit à l'identique (nouvelle exécution du binning) ne remet pas le calcul à zéro.
+"""
+import os
+import json
+import shutil
+import logging
+import numpy as np
+from utils.file_utils import file_digest
+
+MANIFEST_FILE = "manifest.json"
+JOURNAL_FILE = "tiles.log"
+
+def checkpoint_params(input_file: str, **params) -> dict:
+    """
+    Construit les paramètres identifiant un calcul : fichier d'entrée (chemin et empreinte MD5 du contenu)
+    et paramètres nommés du calcul.
+    """
+    params.update(input_file=os.path.abspath(input_file), input_md5=file_digest(input_file))
+    # Aller-retour JSON pour comparer les paramètres tels qu'ils sont relus depuis le manifeste
+    return json.loads(json.dumps(params, sort_keys=True))
+
+def tile_name(tile) -> str:
+    (r0, r1), (c0, c1) = tile
+    return f"tile_{r0}_{r1}_{c0}_{c1}.npy"
+
+def open_checkpoint(checkpoint_dir: str, params: dict) -> dict:
+    """
+    Ouvre (ou crée) un dossier de reprise pour les paramètres donnés.
+
+    Si le dossier existe avec d'autres paramètres, il est vidé et le calcul repart de zéro.
+
+    Arguments:
+      - checkpoint_dir : str, dossier de reprise.
+      - params : dict, paramètres du calcul (voir checkpoint_params).
+
+    Retourne:
+      - dict : {nom du bloc: nombre de paires masquées} pour les blocs déjà calculés.
+    """
+    manifest_path = os.path.join(checkpoint_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            try:
+                previous = json.load(f)
+            except json.JSONDecodeError:
+                previous = None
+        if previous == params:
+            done = _read_journal(checkpoint_dir)
+            # Réécriture du journal sans l'éventuelle ligne tronquée, avant d'y ajouter de nouveaux blocs
+            _atomic_write(os.path.join(checkpoint_dir, JOURNAL_FILE),
+                          lambda path: _write_journal(done, path))
+            logging.info(f"Resuming from checkpoint {checkpoint_dir}: {len(done)} tiles already computed.")
+            return done
+        logging.warning(f"Checkpoint {checkpoint_dir} was created with other parameters, starting over.")
+    if os.path.exists(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+    os.makedirs(checkpoint_dir)
+    _atomic_write(manifest_path, lambda path: _dump_json(params, path))
+    return {}
+
+def _read_journal(checkpoint_dir: str) -> dict:
+    done = {}
+    journal_path = os.path.join(checkpoint_dir, JOURNAL_FILE)
+    if not os.path.exists(journal_path):
+        return done
+    with open(journal_path, "r") as f:
+        for line in f:
+            parts = line.split()
+            # Une dernière ligne tronquée (arrêt pendant l'écriture) est ignorée
+            if len(parts) != 2 or not parts[1].isdigit():
+                continue
+            if os.path.exists(os.path.join(checkpoint_dir, parts[0])):
+                done[parts[0]] = int(parts[1])
+    return done
+
+def _write_journal(done: dict, path: str):
+    with open(path, "w") as f:
+        for name, masked in done.items():
+            f.write(f"{name} {masked}\n")
+
+def save_tile(checkpoint_dir: str, tile, block: np.ndarray, masked: int):
+    """
+    Sauvegarde un bloc calculé puis l'enregistre dans le journal du dossier de reprise.
+    """
+    name = tile_name(tile)
+    _atomic_write(os.path.join(checkpoint_dir, name), lambda path: _save_npy(block, path))
+    with open(os.path.join(checkpoint_dir, JOURNAL_FILE), "a") as f:
+        f.write(f"{name} {masked}\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def load_tile(checkpoint_dir: str, tile) -> np.ndarray:
+    return np.load(os.path.join(checkpoint_dir, tile_name(tile)))
+
+def remove_checkpoint(checkpoint_dir: str):
+    if os.path.exists(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+
+def _save_npy(array, path):
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+def _dump_json(data, path):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+def _atomic_write(path: str, writer):
+    # Écriture dans un fichier temporaire puis renommage : un arrêt brutal ne laisse pas de fichier partiel
+    tmp_path = path + ".tmp"
+    writer(tmp_path)
+    os.replace(tmp_path, path)
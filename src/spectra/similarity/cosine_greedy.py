@@ -0,0 +1,79 @@
+import logging
+import multiprocessing as mp
+import numpy as np
+from scipy.sparse import coo_matrix
+
+logger = logging.getLogger(__name__)
+
+# Spectres et tolérance partagés par les workers (initialisés une seule fois par processus)
+_WORKER_STATE = {}
+
+def _init_worker(spectra, tol):
+    from matchms.similarity import CosineGreedy
+    logging.getLogger("matchms").setLevel(logging.ERROR)
+    _WORKER_STATE["spectra"] = spectra
+    _WORKER_STATE["cosine"] = CosineGreedy(tolerance=tol)
+
+def _score_block(bounds):
+    """
+    Calcule les scores CosineGreedy du bloc de lignes [start, stop) contre les colonnes [start, n).
+    Seul le triangle supérieur est calculé, la matrice étant symétrique.
+    """
+    start, stop = bounds
+    spectra = _WORKER_STATE["spectra"]
+    scores = _WORKER_STATE["cosine"].matrix(spectra[start:stop], spectra[start:],
+                                            is_symmetric=False, progress_bar=False)
+    return start, stop, scores["score"], scores["matches"]
+
+def _iter_blocks(spectra, tol, num_workers, block_size):
+    n = len(spectra)
+    blocks = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    if num_workers is None:
+        num_workers = mp.cpu_count()
+    if num_workers <= 1 or len(blocks) <= 1:
+        _init_worker(spectra, tol)
+        for block in blocks:
+            yield _score_block(block)
+        return
+    with mp.Pool(processes=num_workers, initializer=_init_worker, initargs=(spectra, tol)) as pool:
+        for result in pool.imap_unordered(_score_block, blocks):
+            yield result
+
+def compute_sparse_cosine_greedy_matrix(spectra, tol: float = 0.1, num_workers: int = None,
+                                        min_score: float = None, min_matches: int = None,
+                                        block_size: int = 128):
+    """
+    Calcule la matrice creuse des distances CosineGreedy, en ne conservant que les paires dont le score
+    est >= min_score et dont le nombre de pics appariés est >= min_matches (chaque filtre est optionnel).
+
+    Retourne:
+      - tuple:
+          matrix : scipy.sparse.csr_matrix (n, n) symétrique des distances conservées
+                   (distance maximale 1 implicite ailleurs, diagonale absente).
+          stats  : dict avec le nombre total de paires et de paires conservées.
+    """
+    n = len(spectra)
+    rows, cols, values = [], [], []
+    for start, stop, scores, matches in _iter_blocks(spectra, tol, num_workers, block_size):
+        keep = np.triu(np.ones(scores.shape, dtype=bool), k=1)
+        if min_score is not None:
+            keep &= scores >= min_score
+        if min_matches is not None:
+            keep &= matches >= min_matches
+        r, c = np.nonzero(keep)
+        rows.append(r + start)
+        cols.append(c + start)
+        values.append(1.0 - scores[r, c])
+    if rows:
+        rows, cols, values = np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+    else:
+        rows, cols, values = np.array([], dtype=int), np.array([], dtype=int), np.array([])
+    matrix = coo_matrix((np.concatenate([values, values]),
+                         (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+                        shape=(n, n)).tocsr()
+    total = n * (n - 1) // 2
+    stats = {"total_pairs": total, "kept_pairs": int(len(values)),
+             "min_score": min_score, "min_matches": min_matches}
+    logger.info("CosineGreedy sparse matrix: %d/%d pairs kept (min_score=%s, min_matches=%s).",
+                len(values), total, min_score, min_matches)
+    return matrix, stats
@@ -0,0 +1,166 @@
+"""
+Espace des caractéristiques des spectres binned, pour les algorithmes qui n'ont pas besoin de la matrice
+de distances n x n (arbre couvrant de HDBSCAN, graphe des k plus proches voisins).
+
+Les bins sont les colonnes de la matrice creuse des intensités (binning.binned_spectra_to_csr) ;
+les colonnes vides sont retirées. Pour la distance "cosinus", les lignes sont normalisées (norme L2) :
+la distance d'un spectre à tous les autres est alors un seul produit matrice creuse - vecteur.
+Pour "manhattan", les intensités sont utilisées telles quelles, comme dans le registre des métriques.
+Les distances obtenues sont celles du registre (noyaux "cosinus" et "manhattan").
+"""
+import time
+import logging
+import numpy as np
+from scipy import sparse
+from joblib import Parallel, delayed
+from sklearn.metrics.pairwise import manhattan_distances
+from spectra.similarity.binning import binned_spectra_to_csr
+
+logger = logging.getLogger(__name__)
+
+# Méthodes de distance calculables dans l'espace des caractéristiques
+FEATURE_METHODS = ("cosinus", "manhattan")
+
+# Méthodes pour lesquelles le graphe des k plus proches voisins est disponible (distances dans [0, 1])
+KNN_METHODS = ("cosinus",)
+
+def feature_matrix(spectra, dist_method: str = "cosinus") -> sparse.csr_matrix:
+    """
+    Matrice creuse (n_spectres, n_bins occupés) des spectres binned, normalisée pour "cosinus".
+
+    Arguments:
+      - spectra : liste d'objets Spectrum binned (m/z = indices de bins entiers).
+      - dist_method : str, "cosinus" ou "manhattan".
+
+    Retourne:
+      - scipy.sparse.csr_matrix en float64.
+    """
+    if dist_method not in FEATURE_METHODS:
+        raise ValueError(f"Feature-space distances are available for: {', '.join(FEATURE_METHODS)}")
+    X = binned_spectra_to_csr(spectra)
+    X = X[:, np.flatnonzero(X.getnnz(axis=0))].tocsr()
+    if dist_method == "cosinus":
+        norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+        X = sparse.diags(1 / np.where(norms > 0, norms, 1)) @ X
+    return X.tocsr()
+
+def feature_distances(X: sparse.csr_matrix, rows, dist_method: str = "cosinus") -> np.ndarray:
+    """
+    Distances des spectres rows (indice ou tranche de lignes de X, voir feature_matrix) à tous les spectres.
+
+    Retourne:
+      - np.ndarray (len(rows), n), ou (n,) pour un indice seul.
+    """
+    if np.isscalar(rows):
+        return feature_distances(X, slice(rows, rows + 1), dist_method)[0]
+    block = X[rows]
+    if dist_method == "cosinus":
+        # Produit matrice creuse - bloc dense, bien plus rapide qu'un produit de deux matrices creuses
+        return np.abs(1 - (X @ block.toarray().T).T)
+    return manhattan_distances(block, X)
+
+def _knn_rows(X, rows, k, dist_method):
+    """
+    k plus proches voisins (lui-même exclu) des lignes rows[0]:rows[1] de X.
+    """
+    dist = feature_distances(X, slice(rows[0], rows[1]), dist_method)
+    local = np.arange(rows[1] - rows[0])
+    dist[local, local + rows[0]] = np.inf
+    idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(dist, idx, axis=1)
+    order = np.argsort(top, axis=1, kind="stable")
+    return rows, np.take_along_axis(idx, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+def spectra_knn(X: sparse.csr_matrix, k: int, dist_method: str = "cosinus", block_size: int = 1024,
+                n_jobs: int = -1):
+    """
+    k plus proches voisins de chaque spectre dans l'espace des caractéristiques (voir feature_matrix),
+    calculés par blocs de block_size lignes : la mémoire est en block_size x n par thread.
+
+    Retourne:
+      - tuple:
+          neighbors : np.ndarray (n, k) en int64, par distance croissante.
+          distances : np.ndarray (n, k).
+    """
+    n = X.shape[0]
+    k = min(k, max(n - 1, 0))
+    neighbors = np.full((n, k), -1, dtype=np.int64)
+    distances = np.zeros((n, k))
+    if k == 0:
+        return neighbors, distances
+    bounds = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    if n_jobs == 1 or len(bounds) <= 1:
+        results = [_knn_rows(X, rows, k, dist_method) for rows in bounds]
+    else:
+        results = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_knn_rows)(X, rows, k, dist_method) for rows in bounds
+        )
+    for (r0, r1), idx, dist in results:
+        neighbors[r0:r1] = idx
+        distances[r0:r1] = dist
+    return neighbors, distances
+
+def core_distances(X: sparse.csr_matrix, min_samples_values: list, dist_method: str = "cosinus",
+                   n_jobs: int = -1) -> dict:
+    """
+    Distances de cœur HDBSCAN de chaque spectre pour chaque valeur de min_samples : distance à son
+    min_samples-ième plus proche voisin (lui-même exclu), comme pour une matrice de distances précalculée.
+    Une seule recherche des max(min_samples_values) plus proches voisins suffit : la distance de cœur
+    de chaque valeur en est une colonne.
+
+    Retourne:
+      - dict : min_samples -> np.ndarray (n,).
+    """
+    n = X.shape[0]
+    _, distances = spectra_knn(X, max(min_samples_values, default=0), dist_method, n_jobs=n_jobs)
+    cores = {}
+    for min_samples in min_samples_values:
+        # Comme HDBSCAN, min_samples est ramené au nombre de voisins disponibles
+        column = min(min_samples, distances.shape[1]) - 1
+        cores[min_samples] = distances[:, column] if column >= 0 else np.zeros(n)
+    return cores
+
+def knn_graph(neighbors: np.ndarray, distances: np.ndarray, mutual: bool = False) -> sparse.csr_matrix:
+    """
+    Graphe de distances symétrique des k plus proches voisins, pour apply_hdbscan_sparse.
+
+    Avec mutual=False, une arête i-j existe si j est voisin de i ou i voisin de j ; avec mutual=True,
+    seulement si les deux le sont (graphe des voisins mutuels : les points isolés des zones denses
+    gardent peu d'arêtes et deviennent plus facilement du bruit). Les distances nulles (spectres
+    identiques) sont ramenées à un epsilon pour rester des arêtes.
+    """
+    n = neighbors.shape[0]
+    rows = np.repeat(np.arange(n), neighbors.shape[1])
+    cols = neighbors.ravel()
+    valid = cols >= 0
+    dist = np.maximum(distances.ravel()[valid], np.finfo(np.float32).eps)
+    graph = sparse.csr_matrix((dist, (rows[valid], cols[valid])), shape=(n, n))
+    if mutual:
+        return graph.minimum(graph.T).tocsr()
+    return graph.maximum(graph.T).tocsr()
+
+def spectra_knn_graph(spectra, k: int, dist_method: str = "cosinus", mutual: bool = False, n_jobs: int = -1):
+    """
+    Graphe creux des distances de chaque spectre binned vers ses k plus proches voisins, sans matrice n x n.
+
+    Retourne:
+      - tuple:
+          graph : scipy.sparse.csr_matrix (n, n) symétrique, à passer à apply_hdbscan_sparse.
+          stats : dict, k, voisins mutuels ou non, nombre d'arêtes, nombre de bins et temps de calcul.
+    """
+    if dist_method not in KNN_METHODS:
+        raise ValueError(f"k-nearest-neighbour graphs are available for: {', '.join(KNN_METHODS)}")
+    start = time.perf_counter()
+    X = feature_matrix(spectra, dist_method)
+    neighbors, distances = spectra_knn(X, k, dist_method, n_jobs=n_jobs)
+    graph = knn_graph(neighbors, distances, mutual=mutual)
+    stats = {
+        "k": int(neighbors.shape[1]),
+        "mutual": mutual,
+        "edges": int(graph.nnz // 2),
+        "n_features": int(X.shape[1]),
+        "elapsed_seconds": time.perf_counter() - start,
+    }
+    logger.info("kNN distance graph built: %d spectra, %d edges (k=%d, mutual=%s) in %.2f s",
+                X.shape[0], stats["edges"], stats["k"], mutual, stats["elapsed_seconds"])
+    return graph, stats
@@ -0,0 +1,151 @@
+import logging
+import numpy as np
+from scipy.sparse import coo_matrix
+from spectra.similarity import metrics
+from spectra.similarity.binning import binned_spectra_to_csr
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+
+def minhash_signatures(spectra, num_perm: int = 128, seed: int = 42, chunk_size: int = 1024) -> np.ndarray:
+    """
+    Calcule la signature MinHash de l'ensemble des bins de chaque spectre binned.
+
+    Chaque permutation est approchée par une fonction de hachage h(x) = (a*x + b) mod p
+    (p premier de Mersenne 2^31 - 1). La proportion de valeurs égales entre deux signatures
+    estime la similarité de Jaccard des deux ensembles de pics.
+
+    Arguments:
+      - spectra : liste d'objets Spectrum binned.
+      - num_perm : int, nombre de fonctions de hachage (longueur de la signature).
+      - seed : int, graine des fonctions de hachage.
+      - chunk_size : int, nombre de spectres traités simultanément.
+
+    Retourne:
+      - np.ndarray : matrice (n_spectres, num_perm) de signatures (uint64).
+    """
+    X = binned_spectra_to_csr(spectra)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+    n = X.shape[0]
+    signatures = np.full((n, num_perm), _MERSENNE_PRIME, dtype=np.uint64)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        lo, hi = X.indptr[start], X.indptr[stop]
+        if hi == lo:
+            continue
+        values = X.indices[lo:hi].astype(np.uint64)
+        hashes = (a[:, None] * values[None, :] + b[:, None]) % _MERSENNE_PRIME
+        offsets = X.indptr[start:stop] - lo
+        non_empty = np.diff(X.indptr[start:stop + 1]) > 0
+        reduced = np.minimum.reduceat(hashes, offsets[non_empty], axis=1)
+        signatures[start:stop][non_empty] = reduced.T
+    return signatures
+
+def collision_probability(similarity, bands: int, rows: int):
+    """
+    Probabilité qu'une paire de similarité de Jaccard donnée devienne candidate : 1 - (1 - s^rows)^bands.
+
+    Permet de régler le compromis rappel/vitesse : plus de bandes (moins de lignes par bande)
+    augmente le rappel et le nombre de candidats.
+    """
+    return 1 - (1 - np.asarray(similarity, dtype=float) ** rows) ** bands
+
+def lsh_candidate_pairs(signatures: np.ndarray, bands: int) -> np.ndarray:
+    """
+    Génère les paires candidates par banding : deux spectres sont candidats s'ils ont
+    au moins une bande de leur signature identique.
+
+    Arguments:
+      - signatures : np.ndarray (n, num_perm), signatures MinHash.
+      - bands : int, nombre de bandes (num_perm doit être divisible par bands).
+
+    Retourne:
+      - np.ndarray : tableau (n_paires, 2) des paires candidates (i, j), avec i < j.
+    """
+    n, num_perm = signatures.shape
+    if num_perm % bands != 0:
+        raise ValueError(f"num_perm ({num_perm}) doit être divisible par le nombre de bandes ({bands}).")
+    rows = num_perm // bands
+    codes = []
+    for band in range(bands):
+        band_sig = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        _, bucket = np.unique(band_sig, axis=0, return_inverse=True)
+        bucket = bucket.ravel()
+        order = np.argsort(bucket, kind="mergesort")
+        sorted_bucket = bucket[order]
+        starts = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            members = np.sort(order[start:start + size])
+            i, j = np.triu_indices(size, k=1)
+            codes.append(members[i].astype(np.int64) * n + members[j])
+    if not codes:
+        return np.empty((0, 2), dtype=np.int64)
+    codes = np.unique(np.concatenate(codes))
+    return np.stack([codes // n, codes % n], axis=1)
+
+def compute_lsh_distance_matrix(spectra, tol: float = 0.1, num_perm: int = 128, bands: int = 32,
+                                seed: int = 42, cutoff: float = None):
+    """
+    Calcule une matrice creuse de distances "simple" en ne calculant que les paires candidates LSH.
+
+    Arguments:
+      - spectra : liste d'objets Spectrum binned.
+      - tol : float, tolérance de metrics.simple_similarity.
+      - num_perm, bands, seed : paramètres MinHash/LSH (voir collision_probability).
+      - cutoff : float, si renseigné, seules les distances <= cutoff sont conservées.
+
+    Retourne:
+      - tuple:
+          matrix : scipy.sparse.csr_matrix (n, n) symétrique des distances des paires candidates
+                   (distance maximale 1 implicite ailleurs).
+          stats  : dict avec le nombre total de paires, de candidats et de paires conservées.
+    """
+    n = len(spectra)
+    signatures = minhash_signatures(spectra, num_perm, seed)
+    candidates = lsh_candidate_pairs(signatures, bands)
+    distances = np.array([metrics.simple_similarity(spectra[i], spectra[j], tol) for i, j in candidates], dtype=float)
+    keep = np.ones(len(candidates), dtype=bool) if cutoff is None else distances <= cutoff
+    rows, cols, values = candidates[keep, 0], candidates[keep, 1], distances[keep]
+    matrix = coo_matrix((np.concatenate([values, values]),
+                         (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+                        shape=(n, n)).tocsr()
+    total = n * (n - 1) // 2
+    stats = {"total_pairs": total, "candidate_pairs": int(len(candidates)), "kept_pairs": int(keep.sum()),
+             "num_perm": num_perm, "bands": bands}
+    logger.info("MinHash/LSH (%d perms, %d bands): %d candidate pairs out of %d (%.1f%%), %d kept.",
+                num_perm, bands, len(candidates), total, 100.0 * len(candidates) / max(total, 1), int(keep.sum()))
+    return matrix, stats
+
+def measure_lsh_recall(spectra, matrix, tol: float = 0.1, cutoff: float = None,
+                       sample_size: int = 50, seed: int = 42) -> dict:
+    """
+    Mesure le rappel de la matrice LSH par rapport au calcul exact, sur un échantillon de spectres.
+
+    Pour chaque spectre échantillonné, les distances "simple" exactes à tous les autres spectres
+    sont calculées ; une paire est un vrai voisin si sa distance est <= cutoff (ou < 1, c'est-à-dire
+    au moins un pic commun, si cutoff vaut None). Le rappel est la proportion de ces paires présentes
+    dans la matrice creuse.
+
+    Retourne:
+      - dict : nombre de spectres échantillonnés, de vrais voisins, de voisins retrouvés et rappel.
+    """
+    n = len(spectra)
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(n, size=min(sample_size, n), replace=False)
+    matrix = matrix.tocsr()
+    true_pairs, found_pairs = 0, 0
+    for i in sample:
+        exact = np.array([metrics.simple_similarity(spectra[i], spectra[j], tol) if j != i else np.inf
+                          for j in range(n)])
+        neighbours = np.flatnonzero(exact <= cutoff) if cutoff is not None else np.flatnonzero(exact < 1)
+        found = set(matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]].tolist())
+        true_pairs += len(neighbours)
+        found_pairs += sum(1 for j in neighbours if j in found)
+    recall = found_pairs / true_pairs if true_pairs else 1.0
+    logger.info("LSH recall on %d sampled spectra: %.4f (%d/%d true neighbours found).",
+                len(sample), recall, found_pairs, true_pairs)
+    return {"sample_size": int(len(sample)), "true_pairs": true_pairs, "found_pairs": found_pairs, "recall": recall}
@@ -5,52 +5,245 @@ import numpy as np
 import multiprocessing as mp
 import logging
 from matchms.importing import load_from_mgf
-from utils.file_utils import new_dir
-from spectra.similarity import metrics  # Assurez-vous que ce chemin est correct selon votre structure
-
-def _compute_distance(pair, spectra, methode, tol):
-    i, j = pair
-    if methode == "cosinus":
-        score = metrics.cosinus_binning(spectra[i], spectra[j])
-    elif methode == "manhattan":
-        score = metrics.manhattan_distance_binning(spectra[i], spectra[j])
-    elif methode == "simple":
-        score = metrics.simple_similarity(spectra[i], spectra[j], tol)
-    else:
-        raise ValueError(f"Méthode inconnue: {methode}")
-    return i, j, score
+from spectra.similarity.blocking import get_precursor_mz, precursor_window_bounds
+from spectra.similarity.registry import get_metric
+from spectra.similarity.checkpoint import (checkpoint_params, open_checkpoint, save_tile, load_tile,
+                                           tile_name, remove_checkpoint)
+
+# État partagé par les workers (initialisé une seule fois par processus)
+_WORKER_STATE = {}
+
+def _init_worker(methode, state, tol, order, ends):
+    _WORKER_STATE.update(metric=get_metric(methode), state=state, tol=tol, order=order, ends=ends)
 
-def compute_distance_matrix(file_path: str, methode: str, tol: float = 0.1, num_workers: int = None) -> np.ndarray:
+# Nombre de lignes évaluées ensemble dans un bloc soumis au blocking précurseur
+_WINDOW_ROWS = 16
+
+def _window_starts(row_pos: np.ndarray, ends: np.ndarray) -> np.ndarray:
     """
-    Calcule la matrice de distance pour le fichier MGF spécifié en utilisant la méthode indiquée.
-    
-    Si la méthode est "cosine_greedy", on utilise l'objet CosineGreedy de matchms pour
-    calculer la matrice en une seule passe.
+    Pour chaque position q du tri, première position p telle que la paire (p, q), p < q, soit dans la fenêtre :
+    les bornes ends étant croissantes, les positions de la fenêtre de q sont exactement [début, q).
+    """
+    return np.searchsorted(ends, row_pos, side="right")
+
+def _window_pairs(tile, ends) -> int:
+    """
+    Nombre de paires (p < q) du bloc dont les deux spectres sont dans la même fenêtre de masse.
+    """
+    (r0, r1), (c0, c1) = tile
+    q = np.arange(r0, r1)
+    return int(np.sum(np.maximum(np.minimum(c1, q) - np.maximum(c0, _window_starts(q, ends)), 0)))
+
+def _compute_tile(tile):
+    """
+    Calcule le bloc de distances entre les positions [r0, r1) et [c0, c1) du tri.
+
+    Avec le blocking précurseur, seules les paires (p < q) de la fenêtre sont évaluées : pour chaque groupe
+    de _WINDOW_ROWS lignes, le noyau ne reçoit que l'intervalle de colonnes couvert par leurs fenêtres,
+    les autres paires reçoivent la distance maximale sans être calculées.
+    """
+    (r0, r1), (c0, c1) = tile
+    metric, state, order, ends = (_WORKER_STATE[k] for k in ("metric", "state", "order", "ends"))
+    rows, cols = order[r0:r1], order[c0:c1]
+    if ends is None:
+        return tile, np.asarray(metric["kernel"](state, rows, cols, _WORKER_STATE["tol"]), dtype=float), 0
+    block = np.array(metric["max_distance"](state, rows, cols), dtype=float)
+    starts = _window_starts(np.arange(r0, r1), ends)
+    for s0 in range(r0, r1, _WINDOW_ROWS):
+        s1 = min(s0 + _WINDOW_ROWS, r1)
+        # Colonnes de la fenêtre d'au moins une des lignes [s0, s1) : [début de la fenêtre de s0, s1 - 1)
+        a, b = max(c0, starts[s0 - r0]), min(c1, s1 - 1)
+        if a >= b:
+            continue
+        sub = np.asarray(metric["kernel"](state, order[s0:s1], order[a:b], _WORKER_STATE["tol"]), dtype=float)
+        q, p = np.arange(s0, s1)[:, None], np.arange(a, b)[None, :]
+        in_window = (p < q) & (p >= starts[s0 - r0:s1 - r0, None])
+        target = block[s0 - r0:s1 - r0, a - c0:b - c0]
+        target[in_window] = sub[in_window]
+    return tile, block, tile_pairs(tile) - _window_pairs(tile, ends)
+
+def _tile_has_pairs(tile, ends):
+    """
+    Indique si un bloc (positions [r0, r1) x [c0, c1), c0 <= r0) contient au moins une paire dans la fenêtre.
+    """
+    (r0, r1), (c0, c1) = tile
+    p = np.arange(c0, c1)
+    return bool(np.any(np.maximum(r0, p + 1) < np.minimum(r1, ends[p])))
+
+def triangular_tiles(n: int, block_size: int) -> list:
+    """
+    Découpe le triangle inférieur d'une matrice n x n en blocs ((r0, r1), (c0, c1)) avec c0 <= r0.
+    """
+    bounds = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    return [(bounds[bi], bounds[bj]) for bi in range(len(bounds)) for bj in range(bi + 1)]
+
+def tile_pairs(tile) -> int:
+    (r0, r1), (c0, c1) = tile
+    size = r1 - r0
+    return size * (size - 1) // 2 if r0 == c0 else size * (c1 - c0)
+
+def prepare_tiles(file_path: str, methode: str, tol: float = 0.1, precursor_tol: float = None,
+                  precursor_unit: str = "da", block_size: int = 256) -> dict:
+    """
+    Prépare le calcul par blocs d'une matrice de distances : chargement des spectres, état de la métrique,
+    tri par masse précurseur (si precursor_tol est renseigné) et découpage du triangle inférieur.
+
+    Retourne:
+      - dict : méthode, tolérance, état de la métrique, ordre du tri, bornes des fenêtres (ou None),
+               taille n, liste des blocs et, pour chaque bloc, s'il doit être évalué.
     """
     logging.getLogger("matchms").setLevel(logging.ERROR)
     spectra = list(load_from_mgf(file_path))
     length = len(spectra)
-    
-    if methode == "cosine_greedy":
-        from matchms.similarity import CosineGreedy
-        cos = CosineGreedy(tolerance=tol)
-        scores = cos.matrix(spectra, spectra, is_symmetric=True)
-        # Convertit les similarités en distances : distance = 1 - similarité
-        distance_matrix = np.array([[1.0 - s for s in row] for row in scores])
-        return distance_matrix
+    metric = get_metric(methode)
+    state = metric["prepare"](spectra, tol)
+
+    order, ends = np.arange(length), None
+    if precursor_tol is not None:
+        order, ends = precursor_window_bounds(get_precursor_mz(spectra), precursor_tol, precursor_unit)
+
+    tiles = triangular_tiles(length, block_size)
+    evaluated = [ends is None or _tile_has_pairs(tile, ends) for tile in tiles]
+    return {"methode": methode, "tol": tol, "metric": metric, "state": state, "order": order, "ends": ends,
+            "n": length, "tiles": tiles, "evaluated": evaluated}
+
+def iter_tile_blocks(run: dict, tiles: list, num_workers: int = None, checkpoint_dir: str = None,
+                     params: dict = None):
+    """
+    Calcule les blocs demandés (voir prepare_tiles) et les génère au fur et à mesure, dans un ordre quelconque.
+
+    Les blocs sans paire dans la fenêtre précurseur sont remplis avec la distance maximale sans être évalués.
+    Si checkpoint_dir est renseigné, les blocs déjà sauvegardés pour les mêmes paramètres (params)
+    sont relus, les autres sont sauvegardés dès qu'ils sont calculés.
+
+    Génère:
+      - tuple: (bloc, distances, paires hors fenêtre dans le bloc évalué, paires non évaluées).
+    """
+    metric, state, order = run["metric"], run["state"], run["order"]
+    evaluated = dict(zip(run["tiles"], run["evaluated"]))
+    to_compute = []
+    for tile in tiles:
+        if not evaluated[tile]:
+            (r0, r1), (c0, c1) = tile
+            yield tile, metric["max_distance"](state, order[r0:r1], order[c0:c1]), 0, tile_pairs(tile)
+        else:
+            to_compute.append(tile)
+
+    if checkpoint_dir is not None:
+        done = open_checkpoint(checkpoint_dir, params)
+        remaining = []
+        for tile in to_compute:
+            name = tile_name(tile)
+            if name in done:
+                yield tile, load_tile(checkpoint_dir, tile), done[name], 0
+            else:
+                remaining.append(tile)
+        logging.info(f"{len(to_compute) - len(remaining)}/{len(to_compute)} tiles loaded from checkpoint.")
+        to_compute = remaining
 
     if num_workers is None:
         num_workers = mp.cpu_count()  # Ou mp.cpu_count()-1 pour laisser une marge
+    initargs = (run["methode"], state, run["tol"], order, run["ends"])
+    pool = None
+    if num_workers <= 1 or len(to_compute) <= 1:
+        _init_worker(*initargs)
+        results = map(_compute_tile, to_compute)
+    else:
+        pool = mp.Pool(processes=num_workers, initializer=_init_worker, initargs=initargs)
+        results = pool.imap_unordered(_compute_tile, to_compute)
+    try:
+        for tile, block, tile_masked in results:
+            if checkpoint_dir is not None:
+                save_tile(checkpoint_dir, tile, block, tile_masked)
+            yield tile, block, tile_masked, 0
+    except BaseException:
+        # Interruption (Ctrl-C, erreur) : les workers sont arrêtés, les blocs déjà sauvegardés restent disponibles
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
-    distance_matrix = np.zeros((length, length))
-    pairs = [(i, j) for i in range(length) for j in range(i+1, length)]
-    with mp.Pool(processes=num_workers) as pool:
-        args = [(pair, spectra, methode, tol) for pair in pairs]
-        results = pool.starmap(_compute_distance, args)
-    for i, j, score in results:
-        distance_matrix[j, i] = score
+def assemble_tiles(n: int, order: np.ndarray, blocks) -> np.ndarray:
+    """
+    Assemble les blocs du triangle inférieur (positions dans le tri) en matrice carrée et symétrique.
+
+    Arguments:
+      - n : int, nombre de spectres.
+      - order : np.ndarray, indices des spectres dans l'ordre du tri.
+      - blocks : itérable de (bloc, distances).
+    """
+    distance_matrix = np.zeros((n, n))
+    for ((r0, r1), (c0, c1)), block in blocks:
+        distance_matrix[np.ix_(order[r0:r1], order[c0:c1])] = block
+    # Symétrisation à partir des blocs du triangle inférieur (dans l'ordre du tri)
+    pos = np.empty(n, dtype=np.int64)
+    pos[order] = np.arange(n)
+    upper = pos[:, None] < pos[None, :]
+    distance_matrix[upper] = distance_matrix.T[upper]
+    np.fill_diagonal(distance_matrix, 0.0)
     return distance_matrix
 
+def log_blocking_stats(n: int, precursor_tol: float, precursor_unit: str, skipped: int, masked: int) -> dict:
+    """
+    Reporte dans les logs les paires écartées par le blocking précurseur.
+
+    Retourne:
+      - dict : statistiques du blocking (bloc "blocking" du performance des résultats JSON).
+    """
+    total = n * (n - 1) // 2
+    logging.info("Precursor blocking (%s %s): %d pairs skipped without evaluation, %d pairs outside the window "
+                 "in evaluated blocks (%.1f%% of %d pairs set to the maximum distance).",
+                 precursor_tol, precursor_unit, skipped, masked, 100.0 * (skipped + masked) / max(total, 1), total)
+    return {"precursor_tol": precursor_tol, "precursor_unit": precursor_unit, "total_pairs": total,
+            "skipped_pairs": int(skipped), "masked_pairs": int(masked),
+            "computed_pairs": int(total - skipped - masked)}
+
+def compute_distance_matrix(file_path: str, methode: str, tol: float = 0.1, num_workers: int = None,
+                            precursor_tol: float = None, precursor_unit: str = "da",
+                            block_size: int = 256, checkpoint_dir: str = None):
+    """
+    Calcule la matrice de distance pour le fichier MGF spécifié en utilisant la méthode indiquée.
+
+    La méthode est recherchée dans le registre des métriques (voir registry) : son état est précalculé
+    une fois, puis le triangle inférieur de la matrice est découpé en blocs de block_size spectres,
+    calculés par le noyau de la métrique et répartis sur num_workers processus.
+
+    Si precursor_tol est renseigné, les spectres sont triés par m/z du précurseur (PEPMASS) et
+    seules les paires dont les précurseurs sont dans une fenêtre de precursor_tol (en Da ou en ppm
+    selon precursor_unit) sont retenues. Les blocs sans aucune paire dans la fenêtre ne sont pas évalués ;
+    dans les autres, le noyau ne reçoit que les colonnes des fenêtres de chaque groupe de lignes (voir _compute_tile).
+    Les paires hors fenêtre reçoivent la distance maximale de la métrique ; leur nombre est reporté
+    dans les logs et dans les statistiques retournées.
+
+    Si checkpoint_dir est renseigné, chaque bloc calculé y est sauvegardé (voir checkpoint) :
+    un calcul interrompu puis relancé avec les mêmes paramètres ne recalcule que les blocs manquants.
+
+    Retourne:
+      - tuple: matrice de distances carrée et symétrique, et statistiques du blocking
+               (voir log_blocking_stats ; dictionnaire vide sans blocking).
+    """
+    run = prepare_tiles(file_path, methode, tol, precursor_tol, precursor_unit, block_size)
+    params = None
+    if checkpoint_dir is not None:
+        params = checkpoint_params(file_path, methode=methode, tol=tol, precursor_tol=precursor_tol,
+                                   precursor_unit=precursor_unit, block_size=block_size, n=run["n"])
+    counts = {"masked": 0, "skipped": 0}
+
+    def blocks():
+        for tile, block, masked, skipped in iter_tile_blocks(run, run["tiles"], num_workers, checkpoint_dir, params):
+            counts["masked"] += masked
+            counts["skipped"] += skipped
+            yield tile, block
+
+    distance_matrix = assemble_tiles(run["n"], run["order"], blocks())
+    stats = {}
+    if run["ends"] is not None:
+        stats = log_blocking_stats(run["n"], precursor_tol, precursor_unit, counts["skipped"], counts["masked"])
+    return distance_matrix, stats
+
 def save_matrix(matrix: np.ndarray, output_file: str):
     size = matrix.shape[0]
     with open(output_file, 'w', newline='') as f:
@@ -85,27 +278,148 @@ def read_matrix(input_file: str) -> np.ndarray:
     square_matrix += square_matrix.T
     return square_matrix
 
-def make_matrix_for_file(input_file: str, methode: str, output_dir: str, tol: float = 0.1, num_workers: int = None) -> str:
+def save_sparse_matrix(matrix, output_file: str):
+    """
+    Sauvegarde une matrice de distances creuse (scipy.sparse) au format .npz.
+    """
+    from scipy.sparse import save_npz
+    save_npz(output_file, matrix.tocsr())
+
+def read_sparse_matrix(input_file: str):
+    """
+    Lit une matrice de distances creuse sauvegardée par save_sparse_matrix.
+
+    Retourne
+    -------
+    scipy.sparse.csr_matrix
+        Matrice symétrique des distances conservées (distance maximale implicite ailleurs).
+    """
+    from scipy.sparse import load_npz
+    return load_npz(input_file).tocsr()
+
+def sparse_to_dense(matrix, max_distance: float = 1.0) -> np.ndarray:
+    """
+    Reconstruit une matrice de distances carrée à partir d'une matrice creuse,
+    en remplaçant les entrées absentes par max_distance (diagonale nulle).
+    """
+    coo = matrix.tocoo()
+    dense = np.full(matrix.shape, max_distance, dtype=float)
+    dense[coo.row, coo.col] = coo.data
+    np.fill_diagonal(dense, 0.0)
+    return dense
+
+def make_sparse_matrix_for_file(input_file: str, methode: str, output_dir: str, cutoff: float = None,
+                                precursor_tol: float = None, precursor_unit: str = "da", tol: float = 0.1,
+                                lsh: bool = False, num_perm: int = 128, bands: int = 32, recall_sample: int = 0,
+                                min_matches: int = None, num_workers: int = None):
+    """
+    Calcule une matrice de distances creuse pour un fichier MGF binned et la sauvegarde au format .npz.
+
+    Trois modes sont disponibles :
+      - seuillé (méthode "cosinus") : seules les distances <= cutoff sont calculées, les autres
+        paires étant écartées par un index inversé des pics et une borne (voir pruning.compute_pruned_cosine_matrix) ;
+      - CosineGreedy (méthode "cosine_greedy") : toutes les paires sont calculées par blocs en parallèle,
+        seules celles de distance <= cutoff et ayant au moins min_matches pics appariés sont conservées
+        (voir cosine_greedy.compute_sparse_cosine_greedy_matrix) ;
+      - LSH (méthode "simple", lsh=True) : seules les paires candidates MinHash/LSH sont calculées
+        (voir lsh.compute_lsh_distance_matrix), puis filtrées par cutoff s'il est renseigné.
+        Si recall_sample > 0, le rappel est mesuré sur un échantillon de recall_sample spectres.
+
+    Retourne:
+      - tuple: chemin complet du fichier .npz généré et statistiques du calcul.
+    """
+    deb = time.time()
+    logging.getLogger("matchms").setLevel(logging.ERROR)
+    spectra = list(load_from_mgf(input_file))
+    if lsh:
+        from spectra.similarity.lsh import compute_lsh_distance_matrix, measure_lsh_recall
+        if methode != "simple":
+            raise ValueError(f"Le mode LSH n'est disponible que pour la méthode 'simple' (reçu: {methode}).")
+        if precursor_tol is not None:
+            raise ValueError("Le blocking par masse précurseur n'est pas disponible en mode LSH.")
+        matrix_result, stats = compute_lsh_distance_matrix(spectra, tol=tol, num_perm=num_perm, bands=bands,
+                                                           cutoff=cutoff)
+        if recall_sample > 0:
+            stats["recall"] = measure_lsh_recall(spectra, matrix_result, tol=tol, cutoff=cutoff,
+                                                 sample_size=recall_sample)
+        extra = f"_{methode}_tol{tol}_lsh{num_perm}x{bands}"
+        if cutoff is not None:
+            extra += f"_cut{cutoff}"
+    elif methode == "cosine_greedy":
+        from spectra.similarity.cosine_greedy import compute_sparse_cosine_greedy_matrix
+        if precursor_tol is not None:
+            raise ValueError("Le blocking par masse précurseur n'est pas disponible pour la matrice creuse CosineGreedy.")
+        min_score = 1.0 - cutoff if cutoff is not None else None
+        matrix_result, stats = compute_sparse_cosine_greedy_matrix(spectra, tol=tol, num_workers=num_workers,
+                                                                   min_score=min_score, min_matches=min_matches)
+        extra = f"_{methode}_tol{tol}"
+        if cutoff is not None:
+            extra += f"_cut{cutoff}"
+        if min_matches is not None:
+            extra += f"_matches{min_matches}"
+    else:
+        from spectra.similarity.pruning import compute_pruned_cosine_matrix
+        if methode != "cosinus":
+            raise ValueError(f"Le mode seuillé n'est disponible que pour les méthodes 'cosinus' et 'cosine_greedy' (reçu: {methode}).")
+        if cutoff is None:
+            raise ValueError("Le mode seuillé nécessite une distance maximale (cutoff).")
+        matrix_result, stats = compute_pruned_cosine_matrix(spectra, cutoff, precursor_tol=precursor_tol,
+                                                            precursor_unit=precursor_unit)
+        extra = f"_{methode}_cut{cutoff}"
+        if precursor_tol is not None:
+            extra += f"_prec{precursor_tol}{precursor_unit}"
+    base_name = os.path.basename(input_file)[:-4]  # Retire l'extension .mgf
+    subfolder = os.path.join(output_dir, base_name)
+    os.makedirs(subfolder, exist_ok=True)
+    output_file = os.path.join(subfolder, f"{base_name}{extra}.npz")
+    save_sparse_matrix(matrix_result, output_file)
+    logging.info(f"Sparse matrix computed and saved to {output_file} in {time.time()-deb:.2f} s.")
+    return output_file, stats
+
+def matrix_output_file(input_file: str, methode: str, output_dir: str, tol: float = 0.1,
+                       precursor_tol: float = None, precursor_unit: str = "da", extension: str = ".csv") -> str:
+    """
+    Construit le chemin du fichier de matrice associé à un fichier MGF binned et crée son sous-dossier.
+
+    Le sous-dossier porte le nom de base du fichier binned. Le nom du fichier intègre la méthode utilisée
+    (et la tolérance, le cas échéant), ainsi que la fenêtre de masse précurseur si le blocking est activé.
+    """
+    base_name = os.path.basename(input_file)[:-4]  # Retire l'extension .mgf
+    subfolder = os.path.join(output_dir, base_name)
+    # Le sous-dossier n'est pas vidé : il contient les éventuels points de reprise et fichiers de shards
+    os.makedirs(subfolder, exist_ok=True)
+    extra = f"_{methode}"
+    if get_metric(methode)["uses_tol"]:
+        extra += f"_tol{tol}"
+    if precursor_tol is not None:
+        extra += f"_prec{precursor_tol}{precursor_unit}"
+    return os.path.join(subfolder, f"{base_name}{extra}{extension}")
+
+def make_matrix_for_file(input_file: str, methode: str, output_dir: str, tol: float = 0.1, num_workers: int = None,
+                         precursor_tol: float = None, precursor_unit: str = "da", checkpoint: bool = True,
+                         block_size: int = 256):
     """
     Calcule la matrice de distance pour un fichier MGF binned et sauvegarde le résultat dans un sous-dossier.
     
     Le sous-dossier est créé dans output_dir et porte le nom de base du fichier binned.
-    Le nom du fichier CSV intègre la méthode utilisée (et la tolérance, le cas échéant).
+    Le nom du fichier CSV intègre la méthode utilisée (et la tolérance, le cas échéant),
+    ainsi que la fenêtre de masse précurseur si le blocking est activé.
+
+    Si checkpoint est vrai, les blocs calculés sont sauvegardés dans le dossier <nom du CSV>_checkpoint :
+    une relance avec les mêmes paramètres reprend là où le calcul s'était arrêté.
+    Le dossier de reprise est supprimé une fois le CSV écrit.
     
-    Retourne le chemin complet du CSV généré.
+    Retourne:
+      - tuple: chemin complet du CSV généré et statistiques du blocking (dictionnaire vide sans blocking).
     """
     deb = time.time()
-    matrix_result = compute_distance_matrix(input_file, methode, tol, num_workers)
-    base_name = os.path.basename(input_file)[:-4]  # Retire l'extension .mgf
-    subfolder = os.path.join(output_dir, base_name)
-    new_dir(subfolder)
-    if methode == "cosine_greedy":
-        extra = "_cosine_greedy"
-    else:
-        extra = f"_{methode}"
-        if methode == "simple":
-            extra += f"_tol{tol}"
-    output_file = os.path.join(subfolder, f"{base_name}{extra}.csv")
+    output_file = matrix_output_file(input_file, methode, output_dir, tol, precursor_tol, precursor_unit)
+    checkpoint_dir = output_file[:-4] + "_checkpoint" if checkpoint else None
+    matrix_result, stats = compute_distance_matrix(input_file, methode, tol, num_workers,
+                                                   precursor_tol=precursor_tol, precursor_unit=precursor_unit,
+                                                   block_size=block_size, checkpoint_dir=checkpoint_dir)
     save_matrix(matrix_result, output_file)
+    if checkpoint_dir is not None:
+        remove_checkpoint(checkpoint_dir)
     logging.info(f"Matrix computed and saved to {output_file} in {time.time()-deb:.2f} s.")
-    return output_file
+    return output_file, stats
@@ -0,0 +1,149 @@
+"""
+Registre des métriques de distance entre spectres.
+
+Chaque métrique fournit :
+  - prepare(spectra, tol) -> state : précalcul de l'état partagé (matrice creuse des bins, normes, ...),
+  - kernel(state, rows, cols, tol) -> np.ndarray : distances d'un bloc de lignes contre un bloc de colonnes,
+  - max_distance(state, rows, cols) -> np.ndarray : distance maximale atteignable pour chaque paire du bloc,
+  - uses_tol : bool, indique si la tolérance intervient dans le calcul (et dans le nom des fichiers).
+
+Le calcul par blocs, la parallélisation et le blocking (voir matrix.compute_distance_matrix),
+les choix de la CLI et les pipelines s'appuient sur ce registre : une nouvelle métrique
+n'a qu'à être enregistrée avec register_metric.
+"""
+import numpy as np
+from spectra.similarity import metrics
+from spectra.similarity.binning import binned_spectra_to_csr
+
+METRICS = {}
+
+def _prepare_spectra(spectra, tol):
+    """
+    État par défaut : les spectres, et leur matrice creuse si les m/z sont des indices de bins entiers.
+    """
+    state = {"spectra": spectra, "X": None}
+    if all(np.array_equal(spec.peaks.mz, np.round(spec.peaks.mz)) for spec in spectra):
+        state["X"] = binned_spectra_to_csr(spectra)
+    return state
+
+def _unit_max_distance(state, rows, cols):
+    return np.ones((len(rows), len(cols)))
+
+def pairwise_kernel(pair_fn, with_tol: bool = False):
+    """
+    Construit un noyau par blocs à partir d'une fonction de distance entre deux spectres.
+
+    Les métriques qui ne disposent que d'une fonction par paire profitent ainsi du découpage
+    en blocs et de la parallélisation du calcul de la matrice.
+    """
+    def kernel(state, rows, cols, tol):
+        spectra = state["spectra"]
+        block = np.empty((len(rows), len(cols)))
+        for a, i in enumerate(rows):
+            for b, j in enumerate(cols):
+                block[a, b] = pair_fn(spectra[i], spectra[j], tol) if with_tol else pair_fn(spectra[i], spectra[j])
+        return block
+    return kernel
+
+def register_metric(name: str, kernel=None, prepare=None, max_distance=None, pair_fn=None,
+                    uses_tol: bool = False):
+    """
+    Enregistre une métrique de distance entre spectres.
+
+    Arguments:
+      - name : str, nom de la métrique (utilisé par la CLI et les pipelines).
+      - kernel : function(state, rows, cols, tol) -> np.ndarray, noyau par blocs.
+      - prepare : function(spectra, tol) -> state, précalcul (défaut : spectres et matrice creuse des bins).
+      - max_distance : function(state, rows, cols) -> np.ndarray, distance maximale par paire (défaut : 1).
+      - pair_fn : function(spec1, spec2[, tol]) -> float, utilisée si aucun noyau n'est fourni.
+      - uses_tol : bool, si True la tolérance est transmise à pair_fn et apparaît dans le nom des fichiers.
+    """
+    if kernel is None:
+        if pair_fn is None:
+            raise ValueError(f"La métrique '{name}' doit fournir un noyau par blocs ou une fonction par paire.")
+        kernel = pairwise_kernel(pair_fn, with_tol=uses_tol)
+    METRICS[name] = {
+        "kernel": kernel,
+        "prepare": prepare or _prepare_spectra,
+        "max_distance": max_distance or _unit_max_distance,
+        "uses_tol": uses_tol,
+    }
+
+def get_metric(name: str) -> dict:
+    """
+    Retourne la métrique enregistrée sous ce nom.
+    """
+    if name not in METRICS:
+        raise ValueError(f"Méthode inconnue: {name} (disponibles: {', '.join(available_metrics())})")
+    return METRICS[name]
+
+def available_metrics() -> list:
+    """
+    Retourne la liste des noms de métriques enregistrées.
+    """
+    return list(METRICS)
+
+# --- Métriques intégrées ---
+
+def _prepare_norms(spectra, tol):
+    state = _prepare_spectra(spectra, tol)
+    if state["X"] is not None:
+        state["norms"] = np.sqrt(np.asarray(state["X"].multiply(state["X"]).sum(axis=1)).ravel())
+    return state
+
+def _cosinus_kernel(state, rows, cols, tol):
+    X = state["X"]
+    if X is None:
+        return pairwise_kernel(metrics.cosinus_binning)(state, rows, cols, tol)
+    dots = (X[rows] @ X[cols].T).toarray()
+    denom = state["norms"][rows][:, None] * state["norms"][cols][None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denom > 0, np.abs(1 - dots / denom), 1.0)
+
+def _manhattan_kernel(state, rows, cols, tol):
+    from sklearn.metrics.pairwise import manhattan_distances
+    X = state["X"]
+    if X is None:
+        return pairwise_kernel(metrics.manhattan_distance_binning)(state, rows, cols, tol)
+    return manhattan_distances(X[rows], X[cols])
+
+def _prepare_manhattan(spectra, tol):
+    state = _prepare_spectra(spectra, tol)
+    state["sums"] = np.array([np.sum(np.abs(spec.peaks.intensities)) for spec in spectra], dtype=float)
+    return state
+
+def _manhattan_max_distance(state, rows, cols):
+    # Distance atteinte lorsque les deux spectres n'ont aucun bin commun
+    return state["sums"][rows][:, None] + state["sums"][cols][None, :]
+
+def _prepare_simple(spectra, tol):
+    state = _prepare_spectra(spectra, tol)
+    if state["X"] is not None:
+        state["binary"] = (state["X"] != 0).astype(np.float64)
+        state["counts"] = np.diff(state["binary"].indptr)
+    return state
+
+def _simple_kernel(state, rows, cols, tol):
+    X = state["X"]
+    # Avec des indices de bins entiers et tol < 1, deux pics s'apparient ssi ils sont dans le même bin
+    if X is None or tol >= 1:
+        return pairwise_kernel(metrics.simple_similarity, with_tol=True)(state, rows, cols, tol)
+    B, counts = state["binary"], state["counts"]
+    inter = (B[rows] @ B[cols].T).toarray()
+    total = counts[rows][:, None] + counts[cols][None, :]
+    return np.round(1 - 2 * inter / total, 10)
+
+def _prepare_cosine_greedy(spectra, tol):
+    from matchms.similarity import CosineGreedy
+    return {"spectra": spectra, "cosine": CosineGreedy(tolerance=tol)}
+
+def _cosine_greedy_kernel(state, rows, cols, tol):
+    spectra = state["spectra"]
+    scores = state["cosine"].matrix([spectra[i] for i in rows], [spectra[j] for j in cols],
+                                    is_symmetric=False, progress_bar=False)
+    return 1.0 - scores["score"]
+
+register_metric("cosinus", kernel=_cosinus_kernel, prepare=_prepare_norms)
+register_metric("manhattan", kernel=_manhattan_kernel, prepare=_prepare_manhattan, max_distance=_manhattan_max_distance)
+register_metric("simple", kernel=_simple_kernel, prepare=_prepare_simple, uses_tol=True)
+register_metric("cosine_greedy", kernel=_cosine_greedy_kernel, prepare=_prepare_cosine_greedy, uses_tol=True)
@@ -0,0 +1,162 @@
+"""
+Calcul d'une matrice de distances réparti en shards indépendants.
+
+Chaque invocation (--shard i/N) calcule un sous-ensemble déterministe et équilibré des blocs du triangle
+inférieur et l'écrit dans son propre fichier .npz ; seuls le fichier MGF binned et les paramètres
+doivent être partagés entre les machines. merge_matrix_shards assemble ensuite les shards en
+matrice finale (CSV, voir matrix.save_matrix) après avoir vérifié que chaque bloc est présent une seule fois.
+"""
+import os
+import json
+import time
+import logging
+import numpy as np
+from spectra.similarity.matrix import (prepare_tiles, iter_tile_blocks, assemble_tiles, log_blocking_stats,
+                                       triangular_tiles, matrix_output_file, save_matrix, tile_pairs)
+from spectra.similarity.checkpoint import checkpoint_params, remove_checkpoint
+from utils.file_utils import file_digest
+
+def parse_shard(shard: str) -> tuple:
+    """
+    Lit une spécification de shard "i/N" (i commençant à 0).
+
+    Retourne:
+      - tuple: (i, N).
+    """
+    try:
+        index, count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard invalide: '{shard}' (attendu: i/N, par exemple 0/4).")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard invalide: '{shard}' (il faut 0 <= i < N).")
+    return index, count
+
+def shard_tiles(tiles: list, costs: list, shard: int, num_shards: int) -> list:
+    """
+    Répartit les blocs entre num_shards shards et retourne ceux du shard demandé.
+
+    La répartition est gloutonne (les blocs les plus coûteux d'abord, chacun affecté au shard le moins chargé)
+    et ne dépend que des blocs et de leurs coûts : chaque invocation retrouve la même répartition.
+
+    Arguments:
+      - tiles : list, blocs ((r0, r1), (c0, c1)).
+      - costs : list, coût de chaque bloc (nombre de paires évaluées).
+      - shard : int, indice du shard (0 <= shard < num_shards).
+      - num_shards : int, nombre total de shards.
+    """
+    loads = [0] * num_shards
+    counts = [0] * num_shards
+    assigned = []
+    for k in sorted(range(len(tiles)), key=lambda k: (-costs[k], tiles[k])):
+        target = min(range(num_shards), key=lambda s: (loads[s], counts[s], s))
+        loads[target] += costs[k]
+        counts[target] += 1
+        if target == shard:
+            assigned.append(tiles[k])
+    return sorted(assigned)
+
+def compute_distance_shard(input_file: str, methode: str, shard: int, num_shards: int, output_dir: str,
+                           tol: float = 0.1, num_workers: int = None, precursor_tol: float = None,
+                           precursor_unit: str = "da", block_size: int = 256, checkpoint: bool = True) -> str:
+    """
+    Calcule les blocs d'un shard de la matrice de distances et les sauvegarde dans un fichier .npz.
+
+    Le fichier est placé à côté de la matrice finale (voir matrix.make_matrix_for_file),
+    avec le suffixe _shard<i>of<N>. Si checkpoint est vrai, le calcul du shard peut être repris
+    après une interruption (voir checkpoint).
+
+    Retourne le chemin complet du fichier de shard.
+    """
+    deb = time.time()
+    run = prepare_tiles(input_file, methode, tol, precursor_tol, precursor_unit, block_size)
+    costs = [tile_pairs(tile) if evaluated else 0 for tile, evaluated in zip(run["tiles"], run["evaluated"])]
+    tiles = shard_tiles(run["tiles"], costs, shard, num_shards)
+    logging.info(f"Shard {shard}/{num_shards}: {len(tiles)}/{len(run['tiles'])} tiles, "
+                 f"{sum(tile_pairs(tile) for tile in tiles)} pairs.")
+
+    # Paramètres communs à tous les shards, vérifiés lors de l'assemblage
+    params = {"input_name": os.path.basename(input_file), "input_sha1": file_digest(input_file, "sha1"),
+              "methode": methode, "tol": tol, "precursor_tol": precursor_tol, "precursor_unit": precursor_unit,
+              "block_size": block_size, "n": run["n"], "num_shards": num_shards}
+    output_file = matrix_output_file(input_file, methode, output_dir, tol, precursor_tol, precursor_unit,
+                                     extension=f"_shard{shard}of{num_shards}.npz")
+    checkpoint_dir = output_file[:-4] + "_checkpoint" if checkpoint else None
+    ckpt_params = None
+    if checkpoint_dir is not None:
+        ckpt_params = checkpoint_params(input_file, methode=methode, tol=tol, precursor_tol=precursor_tol,
+                                        precursor_unit=precursor_unit, block_size=block_size, n=run["n"])
+
+    results = sorted(iter_tile_blocks(run, tiles, num_workers, checkpoint_dir, ckpt_params), key=lambda r: r[0])
+    bounds = np.array([[r0, r1, c0, c1] for ((r0, r1), (c0, c1)), _, _, _ in results], dtype=np.int64).reshape(-1, 4)
+    blocks = [np.asarray(block, dtype=float).ravel() for _, block, _, _ in results]
+    np.savez(output_file,
+             params=json.dumps(params, sort_keys=True),
+             shard=np.array([shard, num_shards]),
+             order=run["order"],
+             tiles=bounds,
+             masked=np.array([r[2] for r in results], dtype=np.int64),
+             skipped=np.array([r[3] for r in results], dtype=np.int64),
+             blocks=np.concatenate(blocks) if blocks else np.empty(0))
+    if checkpoint_dir is not None:
+        remove_checkpoint(checkpoint_dir)
+    logging.info(f"Shard {shard}/{num_shards} computed and saved to {output_file} in {time.time()-deb:.2f} s.")
+    return output_file
+
+def merge_matrix_shards(shard_files: list, output_dir: str) -> str:
+    """
+    Assemble les fichiers de shards en matrice de distances complète et la sauvegarde au format CSV.
+
+    Vérifie que tous les shards proviennent du même calcul (même fichier d'entrée et mêmes paramètres),
+    que les N shards sont présents et que chaque bloc du triangle inférieur apparaît exactement une fois.
+
+    Arguments:
+      - shard_files : list, chemins des fichiers .npz produits par compute_distance_shard.
+      - output_dir : str, dossier de sortie (la matrice est écrite dans le sous-dossier du fichier binned).
+
+    Retourne le chemin complet du CSV généré.
+    """
+    deb = time.time()
+    params, order, seen_shards = None, None, set()
+    blocks, masked, skipped = [], 0, 0
+    for path in shard_files:
+        with np.load(path) as data:
+            shard_params = json.loads(str(data["params"]))
+            if params is None:
+                params, order = shard_params, data["order"]
+            elif shard_params != params:
+                raise ValueError(f"Le shard {path} ne provient pas du même calcul que les autres shards.")
+            elif not np.array_equal(data["order"], order):
+                raise ValueError(f"Le shard {path} utilise un autre ordre des spectres que les autres shards.")
+            shard = int(data["shard"][0])
+            if shard in seen_shards:
+                raise ValueError(f"Le shard {shard}/{params['num_shards']} est fourni plusieurs fois.")
+            seen_shards.add(shard)
+            offset, values = 0, data["blocks"]
+            for r0, r1, c0, c1 in data["tiles"]:
+                size = (r1 - r0) * (c1 - c0)
+                blocks.append((((int(r0), int(r1)), (int(c0), int(c1))),
+                               values[offset:offset + size].reshape(r1 - r0, c1 - c0)))
+                offset += size
+            masked += int(data["masked"].sum())
+            skipped += int(data["skipped"].sum())
+    if params is None:
+        raise ValueError("Aucun fichier de shard fourni.")
+
+    missing_shards = sorted(set(range(params["num_shards"])) - seen_shards)
+    if missing_shards:
+        raise ValueError(f"Shards manquants: {', '.join(map(str, missing_shards))} (sur {params['num_shards']}).")
+    expected = set(triangular_tiles(params["n"], params["block_size"]))
+    found = [tile for tile, _ in blocks]
+    if len(found) != len(set(found)) or set(found) != expected:
+        missing = len(expected - set(found))
+        raise ValueError(f"Blocs incohérents entre les shards: {missing} blocs manquants, "
+                         f"{len(found) - len(set(found))} blocs en double.")
+
+    distance_matrix = assemble_tiles(params["n"], order, blocks)
+    if params["precursor_tol"] is not None:
+        log_blocking_stats(params["n"], params["precursor_tol"], params["precursor_unit"], skipped, masked)
+    output_file = matrix_output_file(params["input_name"], params["methode"], output_dir, params["tol"],
+                                     params["precursor_tol"], params["precursor_unit"])
+    save_matrix(distance_matrix, output_file)
+    logging.info(f"{len(shard_files)} shards merged and saved to {output_file} in {time.time()-deb:.2f} s.")
+    return output_file
@@ -0,0 +1,57 @@
+import numpy as np
+
+# Table du nombre de bits à 1 de chaque octet (repli si np.bitwise_count n'est pas disponible, numpy < 2.0)
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """
+    Nombre de bits à 1 de chaque élément d'un tableau d'entiers non signés (uint8 ou uint64).
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    as_bytes = np.ascontiguousarray(words).view(np.uint8).reshape(words.shape + (words.dtype.itemsize,))
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+def pack_rows(bits: np.ndarray) -> np.ndarray:
+    """
+    Compacte une matrice binaire (n, n_bits) en octets : (n, ceil(n_bits / 8)) en uint8.
+    """
+    return np.packbits(np.asarray(bits, dtype=bool), axis=1)
+
+def unpack_rows(packed: np.ndarray, n_bits: int) -> np.ndarray:
+    """
+    Opération inverse de pack_rows : retourne la matrice binaire (n, n_bits) en uint8.
+    """
+    return np.unpackbits(packed, axis=1, count=n_bits)
+
+def as_words(packed: np.ndarray) -> np.ndarray:
+    """
+    Vue des lignes compactées en mots de 64 bits (n, ceil(n_octets / 8)), complétées par des zéros si besoin.
+    """
+    packed = np.ascontiguousarray(packed, dtype=np.uint8)
+    pad = (-packed.shape[1]) % 8
+    if pad:
+        packed = np.pad(packed, ((0, 0), (0, pad)))
+    return packed.view(np.uint64)
+
+def row_popcounts(words: np.ndarray) -> np.ndarray:
+    """
+    Nombre de bits à 1 de chaque ligne.
+    """
+    return popcount(words).sum(axis=1, dtype=np.int64)
+
+def and_popcounts(words_a: np.ndarray, words_b: np.ndarray, chunk_size: int = 64) -> np.ndarray:
+    """
+    Nombre de bits communs (popcount du ET bit à bit) de chaque paire de lignes de words_a et words_b.
+
+    Le calcul est découpé en paquets de chunk_size lignes de words_a pour borner la mémoire temporaire
+    (chunk_size x len(words_b) x n_mots entiers).
+
+    Retourne:
+      - np.ndarray : matrice (len(words_a), len(words_b)) en int64.
+    """
+    counts = np.empty((words_a.shape[0], words_b.shape[0]), dtype=np.int64)
+    for start in range(0, words_a.shape[0], chunk_size):
+        chunk = words_a[start:start + chunk_size]
+        counts[start:start + len(chunk)] = popcount(chunk[:, None, :] & words_b[None, :, :]).sum(axis=2, dtype=np.int64)
+    return counts
@@ -1,5 +1,6 @@
 import os
 import shutil
+import hashlib
 import logging
 from matchms.importing import load_from_mgf
 
@@ -19,6 +20,18 @@ def new_dir(directory: str):
     os.makedirs(directory, exist_ok=True)
 
 
+def file_digest(path: str, algorithm: str = "md5", chunk_size: int = 1 << 20) -> str:
+    """
+    Empreinte (MD5 par défaut) du contenu d'un fichier : clé de cache ou de reprise indépendante
+    du chemin et de la date de modification.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def load_mgf_file(file: str) -> list:
     """
     Charge le fichier MGF en utilisant matchms et retourne une liste de spectra.